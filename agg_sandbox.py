@@ -0,0 +1,135 @@
+"""Runs LLM-generated aggregation code in a worker subprocess with CPU-time, memory and wall-clock limits.
+
+The columns of the uploaded dataframe that the code mentions are handed over as an uncompressed Arrow
+(feather) file that the worker memory-maps, and the summary comes back the same way, nothing is pickled.
+This contains runaway or memory hungry generated code, it is not a security boundary against deliberately
+malicious code.
+"""
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows, the worker then only has the wall-clock timeout
+    resource = None
+
+AGG_SANDBOX_TIMEOUT = float(os.environ.get('AGG_SANDBOX_TIMEOUT', 60.0))  # wall-clock secs
+AGG_SANDBOX_CPU_SECONDS = int(os.environ.get('AGG_SANDBOX_CPU_SECONDS', 45))
+AGG_SANDBOX_MAX_MEMORY_MB = int(os.environ.get('AGG_SANDBOX_MAX_MEMORY_MB', 2048))  # address space of the worker on top of its input
+# address space per byte of the input file: its memory map, the pandas frame built from it and room for the code's copies
+AGG_SANDBOX_INPUT_MEMORY_FACTOR = float(os.environ.get('AGG_SANDBOX_INPUT_MEMORY_FACTOR', 4.0))
+
+AGG_FUNCTION_NAME = 'get_vehicle_usage_summary'
+
+class AggregationSandboxError(Exception):
+    """Raised when the generated aggregation code fails, exceeds a limit or returns no usable dataframe."""
+
+def get_referenced_columns(code, columns):
+    """The columns the code mentions by name, all of them when it mentions none."""
+    referenced = [column for column in columns if re.search(rf'\b{re.escape(str(column))}\b', code)]
+    return referenced or list(columns)
+
+def _limit_resources(cpu_seconds, max_memory):
+    # set by the worker itself, a preexec_fn could deadlock between fork and exec in the threaded app
+    if resource is None:
+        return
+    # SIGXCPU at the soft limit, SIGKILL a second later if it is ignored
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+def run_generated_aggregation(code, df, timeout=AGG_SANDBOX_TIMEOUT, cpu_seconds=AGG_SANDBOX_CPU_SECONDS, max_memory_mb=AGG_SANDBOX_MAX_MEMORY_MB):
+    """Returns the dataframe built by the code's get_vehicle_usage_summary(df), raises AggregationSandboxError.
+
+    The secs spent in the call itself, without the worker start up, are in the result's attrs['agg_seconds'].
+    The worker's address space is max_memory_mb plus AGG_SANDBOX_INPUT_MEMORY_FACTOR times the input file."""
+    import pyarrow.feather as feather
+
+    with tempfile.TemporaryDirectory(prefix='agg-sandbox-') as workdir:
+        code_path = os.path.join(workdir, 'agg_code.py')
+        input_path = os.path.join(workdir, 'input.feather')
+        with open(code_path, 'w', encoding='utf-8') as f:
+            f.write(code)
+        # uncompressed so the worker can memory-map the columns instead of reading a copy
+        df = df[get_referenced_columns(code, df.columns)].reset_index(drop=True)
+        feather.write_feather(df, input_path, compression='uncompressed')
+        # the memory map of the input counts against RLIMIT_AS, the limit grows with it
+        max_memory = int(max_memory_mb * 1024 * 1024 + AGG_SANDBOX_INPUT_MEMORY_FACTOR * os.path.getsize(input_path))
+
+        # single threaded BLAS, thread pools reserve address space that counts against the memory limit
+        env = dict(os.environ, OMP_NUM_THREADS='1', OPENBLAS_NUM_THREADS='1', MKL_NUM_THREADS='1')
+        try:
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), workdir, str(cpu_seconds), str(max_memory)],
+                cwd=workdir, env=env, capture_output=True, text=True, timeout=timeout, start_new_session=True,
+            )
+        except subprocess.TimeoutExpired:
+            raise AggregationSandboxError(f"Generated aggregation code timed out after {timeout:.0f}s")
+
+        error_path = os.path.join(workdir, 'error.json')
+        if os.path.exists(error_path):
+            with open(error_path, encoding='utf-8') as f:
+                raise AggregationSandboxError(json.load(f)['error'])
+        if completed.returncode == -signal.SIGXCPU:
+            raise AggregationSandboxError(f"Generated aggregation code exceeded the {cpu_seconds}s CPU time limit")
+        if completed.returncode == -signal.SIGKILL:
+            raise AggregationSandboxError("Generated aggregation code was killed (CPU or memory limit)")
+        if completed.returncode != 0:
+            stderr_tail = completed.stderr.strip().splitlines()[-1:] or [f"exit code {completed.returncode}"]
+            raise AggregationSandboxError(f"Generated aggregation code failed: {stderr_tail[0]}")
+
+        vehicle_usage_df = feather.read_table(os.path.join(workdir, 'output.feather'), memory_map=True).to_pandas()
+        with open(os.path.join(workdir, 'stats.json'), encoding='utf-8') as f:
+            vehicle_usage_df.attrs['agg_seconds'] = json.load(f)['agg_seconds']
+        return vehicle_usage_df
+
+def _write_error(workdir, message):
+    with open(os.path.join(workdir, 'error.json'), 'w', encoding='utf-8') as f:
+        json.dump({'error': message}, f)
+
+def _run_worker(workdir, cpu_seconds, max_memory):
+    # limits first, the imports and the input already count against them
+    _limit_resources(cpu_seconds, max_memory)
+    import pandas as pd
+    import pyarrow.feather as feather
+
+    # a column per block and the Arrow buffers released as they are converted, no consolidated copy
+    df = feather.read_table(os.path.join(workdir, 'input.feather'), memory_map=True).to_pandas(split_blocks=True, self_destruct=True)
+    with open(os.path.join(workdir, 'agg_code.py'), encoding='utf-8') as f:
+        code = f.read()
+
+    namespace = {'__name__': 'agg_code', 'pd': pd}
+    try:
+        exec(compile(code, 'agg_code.py', 'exec'), namespace)
+        if not callable(namespace.get(AGG_FUNCTION_NAME)):
+            _write_error(workdir, f"Generated code does not define {AGG_FUNCTION_NAME}")
+            return 1
+        start_time = time.perf_counter()
+        vehicle_usage_df = namespace[AGG_FUNCTION_NAME](df)
+        agg_seconds = time.perf_counter() - start_time
+    except MemoryError:
+        _write_error(workdir, "Generated aggregation code exceeded the memory limit")
+        return 1
+    except Exception as e:
+        _write_error(workdir, f"Generated aggregation code raised {type(e).__name__}: {e}")
+        return 1
+
+    if not isinstance(vehicle_usage_df, pd.DataFrame):
+        _write_error(workdir, f"{AGG_FUNCTION_NAME} returned {type(vehicle_usage_df).__name__}, not a DataFrame")
+        return 1
+    try:
+        feather.write_feather(vehicle_usage_df.reset_index(drop=True), os.path.join(workdir, 'output.feather'), compression='uncompressed')
+    except Exception as e:
+        _write_error(workdir, f"Summary dataframe could not be converted to Arrow: {e}")
+        return 1
+    with open(os.path.join(workdir, 'stats.json'), 'w', encoding='utf-8') as f:
+        json.dump({'agg_seconds': agg_seconds}, f)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(_run_worker(sys.argv[1], int(sys.argv[2]), int(sys.argv[3])))
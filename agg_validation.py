@@ -0,0 +1,85 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from agg_sandbox import AggregationSandboxError, run_generated_aggregation
+
+# Generated aggregation code is first run on a small stratified sample of the upload and compared
+# with the reference summary; only code that matches and whose per-row cost extrapolates within
+# the time budget is run on the full upload.
+AGG_VALIDATION_VEHICLES = int(os.environ.get('AGG_VALIDATION_VEHICLES', 5))
+AGG_VALIDATION_MAX_ROWS = int(os.environ.get('AGG_VALIDATION_MAX_ROWS', 5000))
+AGG_VALIDATION_TIMEOUT = float(os.environ.get('AGG_VALIDATION_TIMEOUT', 20.0))  # wall-clock secs for the sample run
+AGG_TIME_BUDGET = float(os.environ.get('AGG_TIME_BUDGET', 30.0))  # secs the full upload may extrapolate to
+AGG_VALUE_RTOL = 1e-3
+AGG_VALUE_ATOL = 0.01  # both sides round to 2 decimals
+
+SUMMARY_COLUMNS = ['vehicle_number', 'mean_soh', 'temperature_excursions', 'final_capacity', 'age_of_vehicle', 'num_cycles', 'max_voltage', 'min_voltage']
+
+@dataclass
+class ValidationResult:
+    ok: bool
+    reason: str = ''
+    sample_rows: int = 0
+    sample_seconds: Optional[float] = None
+    extrapolated_seconds: Optional[float] = None
+
+def get_vehicle_column(df):
+    return 'Topic' if 'Topic' in df.columns else 'vehicle_number'
+
+def get_validation_sample(df, vehicles=AGG_VALIDATION_VEHICLES, max_rows=AGG_VALIDATION_MAX_ROWS):
+    """A few vehicles spread over the fleet's rows-per-vehicle distribution, each thinned to an even share of max_rows.
+
+    Rows are taken at a regular stride so each vehicle keeps its first-to-last span in order."""
+    vehicle_column = get_vehicle_column(df)
+    row_counts = df[vehicle_column].value_counts().sort_values()
+    picks = row_counts.index[np.unique(np.linspace(0, len(row_counts) - 1, min(vehicles, len(row_counts))).round().astype(int))]
+
+    rows_per_vehicle = max(max_rows // len(picks), 1)
+    sample_index = []
+    for vehicle in picks:
+        vehicle_index = df.index[df[vehicle_column] == vehicle]
+        stride = max(len(vehicle_index) // rows_per_vehicle, 1)
+        sample_index.append(vehicle_index[::stride][:rows_per_vehicle])
+    return df.loc[np.concatenate(sample_index)].sort_index()
+
+def compare_summaries(candidate_df, reference_df):
+    """Reason the candidate summary differs from the reference, '' when it matches."""
+    missing = [column for column in SUMMARY_COLUMNS + ['vehicle_summary'] if column not in candidate_df.columns]
+    if missing:
+        return f"missing columns {missing}"
+    if candidate_df['vehicle_number'].duplicated().any():
+        return "more than one row per vehicle"
+    if set(candidate_df['vehicle_number'].astype(str)) != set(reference_df['vehicle_number'].astype(str)):
+        return "vehicles differ from the reference"
+    if not all(isinstance(summary, dict) and set(SUMMARY_COLUMNS) <= set(summary) for summary in candidate_df['vehicle_summary']):
+        return "vehicle_summary is not a dict with every summary field"
+
+    candidate = candidate_df.assign(vehicle_number=candidate_df['vehicle_number'].astype(str)).set_index('vehicle_number')
+    reference = reference_df.assign(vehicle_number=reference_df['vehicle_number'].astype(str)).set_index('vehicle_number')
+    for column in SUMMARY_COLUMNS[1:]:
+        try:
+            candidate_values = candidate.loc[reference.index, column].astype(float).to_numpy()
+        except (TypeError, ValueError):
+            return f"{column} is not numeric"
+        if not np.isclose(candidate_values, reference[column].astype(float).to_numpy(), rtol=AGG_VALUE_RTOL, atol=AGG_VALUE_ATOL, equal_nan=True).all():
+            return f"{column} does not match the reference"
+    return ''
+
+def validate_aggregation_code(code, df, reference_fn, time_budget=AGG_TIME_BUDGET):
+    """Run code on a sample of df and check it against reference_fn(sample) and the time budget."""
+    sample = get_validation_sample(df)
+    try:
+        candidate_df = run_generated_aggregation(code, sample, timeout=AGG_VALIDATION_TIMEOUT)
+    except AggregationSandboxError as e:
+        return ValidationResult(False, str(e), len(sample))
+
+    # per-row cost of the sample run, extrapolated to the full upload
+    sample_seconds = candidate_df.attrs.get('agg_seconds', 0.0)
+    extrapolated_seconds = sample_seconds * len(df) / max(len(sample), 1)
+    reason = compare_summaries(candidate_df, reference_fn(sample))
+    if not reason and extrapolated_seconds > time_budget:
+        reason = f"extrapolates to {extrapolated_seconds:.0f}s on {len(df)} rows, over the {time_budget:.0f}s budget"
+    return ValidationResult(not reason, reason, len(sample), sample_seconds, extrapolated_seconds)
@@ -8,16 +8,12 @@ from datetime import date
 from datetime import datetime
 import os 
 import re
+from telemetry_reader import read_telemetry_csv
+from trip_buckets import add_trip_buckets
 pd.options.mode.chained_assignment = None  # default='warn'
 
-def get_day_hour(value):
-    day = value.date()
-    hour = value.hour
-    minute = value.minute
-    return day,hour,minute
-
 def get_ecozen_file(file_path):
-    df = pd.read_csv(f'/Users/Muskaan_Jain/Dev/data_engineering/blusmart-battery-cell-level-data/{file_path}')
+    df = read_telemetry_csv(f'/Users/Muskaan_Jain/Dev/data_engineering/blusmart-battery-cell-level-data/{file_path}')
     print("Data file length:",df.shape)
     df.rename(columns={'Topic':'vehicle_number'}, inplace=True) 
 
@@ -40,9 +36,7 @@ def get_ecozen_file(file_path):
     df['createdAt'] = pd.to_datetime(df['createdAt'])
     df['deviceTime'] = pd.to_datetime(df['deviceTime'])
 
-    df['trip_day'] = df.apply(lambda x: get_day_hour(x['createdAt'])[0], axis=1)
-    df['trip_hour'] = df.apply(lambda x: get_day_hour(x['createdAt'])[1], axis=1)
-    df['trip_min'] = df.apply(lambda x: get_day_hour(x['createdAt'])[2], axis=1)
+    df = add_trip_buckets(df)
 
     return df 
 
@@ -81,7 +75,7 @@ def calculate_aggs(df, grouped_data, input_params):
 
     #renaming the column - Handling multiindex levels 
     agg_df.columns = ['_'.join(col).strip() if type(col) is tuple else col for col in agg_df.columns.values]
-    agg_df.rename(columns={'vehicle_number_':'vehicle_number', 'trip_day_':'trip_day'}, inplace=True)
+    agg_df.rename(columns={'vehicle_number_':'vehicle_number', 'trip_day_':'trip_day', 'trip_hour_':'trip_hour'}, inplace=True)
     return agg_df
 
 def get_agg_data(df, grouped_data):
@@ -111,23 +105,39 @@ def get_agg_data(df, grouped_data):
     print("Final merged data shape:",agg_df_final.shape)
     return agg_df_final
 
-#final call 0 parsing through all the datafiles 
-folder_path = '/Users/Muskaan_Jain/Dev/data_engineering/blusmart-battery-cell-level-data'
-datafiles = os.listdir(folder_path)
-
-for file_path in datafiles:
-    print(file_path)
-    df = get_ecozen_file(file_path)
-    get_model_variants(file_path)
-
-    #get daily basis 
-    grouped_data_daily = df.groupby(['vehicle_number','trip_day'])
-    agg_df_final_day = get_agg_data(df, grouped_data_daily)
-    agg_df_final_day.to_csv(f'/Users/Muskaan_Jain/Dev/data_engineering/aggr_data_blusmart/daily_aggr_{file_path}', index=False)
-    # agg_df_final_day.tail()
-
-    #get hourly basis 
-    grouped_hourly_data = df.groupby(['vehicle_number','trip_day','trip_hour'])
-    agg_df_final_hour = get_agg_data(df, grouped_hourly_data)
-    agg_df_final_hour.to_csv(f'/Users/Muskaan_Jain/Dev/data_engineering/aggr_data_blusmart/hourly_aggr_{file_path}', index=False)
-    # agg_df_final_hour.head()
+if __name__ == '__main__':
+    # batch only, the catalog and the aggregate store pull in pyarrow.dataset
+    from fleet_catalog import update_catalog
+    from aggregate_store import write_aggregates
+    from telemetry_store import get_telemetry_store, get_daily_rollups, get_file_fingerprint
+
+    #final call 0 parsing through all the datafiles 
+    folder_path = '/Users/Muskaan_Jain/Dev/data_engineering/blusmart-battery-cell-level-data'
+    # partitioned by vehicle and month, re-running on a folder only appends the days a file has not stored yet
+    aggr_folder_path = '/Users/Muskaan_Jain/Dev/data_engineering/aggr_data_blusmart'
+    # refresh the per-file / per-chunk stats used to prune vehicle and date range queries
+    catalog = update_catalog(folder_path)
+    datafiles = sorted(catalog.files)
+
+    for file_path in datafiles:
+        print(file_path)
+        df = get_ecozen_file(file_path)
+        get_model_variants(file_path)
+
+        # daily rollups shared with the app through the SQL store, when it is enabled, stored per file
+        # content hash: re-running a file, or uploading the same file in the app, replaces its rollups
+        store = get_telemetry_store()
+        if store is not None:
+            store.save_rollups(get_daily_rollups(df), get_file_fingerprint(file_path))
+
+        #get daily basis 
+        grouped_data_daily = df.groupby(['vehicle_number','trip_day'])
+        agg_df_final_day = get_agg_data(df, grouped_data_daily)
+        write_aggregates(agg_df_final_day, aggr_folder_path, 'daily', os.path.basename(file_path))
+        # agg_df_final_day.tail()
+
+        #get hourly basis 
+        grouped_hourly_data = df.groupby(['vehicle_number','trip_day','trip_hour'])
+        agg_df_final_hour = get_agg_data(df, grouped_hourly_data)
+        write_aggregates(agg_df_final_hour, aggr_folder_path, 'hourly', os.path.basename(file_path))
+        # agg_df_final_hour.head()
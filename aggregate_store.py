@@ -0,0 +1,101 @@
+import os
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+# Daily and hourly aggregates as compressed Parquet, hive-partitioned by vehicle and month:
+#   <root>/<granularity>/vehicle_number=<vehicle>/month=<YYYY-MM>/part-<write id>-<n>.parquet
+# An append only adds files, existing partitions are never rewritten. Rows carry the source file they
+# were aggregated from, a day (hour) that straddles two files has a row from each. Readers project the
+# columns they need and the vehicle / month filters prune whole partition directories.
+AGGREGATE_COMPRESSION = os.environ.get('AGGREGATE_COMPRESSION', 'zstd')
+PARTITIONING = ds.partitioning(pa.schema([('vehicle_number', pa.string()), ('month', pa.string())]), flavor='hive')
+
+def to_aggregate_table(agg_df):
+    """Typed Arrow table of an aggregate dataframe, with the month partition column."""
+    # the per-parameter aggregate frames are concatenated side by side, each with its own key columns
+    agg_df = agg_df.loc[:, ~agg_df.columns.duplicated()].copy()
+    agg_df['vehicle_number'] = agg_df['vehicle_number'].astype(str)
+    agg_df['source'] = agg_df['source'].astype(str)
+    trip_days = pd.to_datetime(agg_df['trip_day'])
+    agg_df['trip_day'] = trip_days.dt.date
+    agg_df['month'] = trip_days.dt.strftime('%Y-%m')
+    if 'trip_hour' in agg_df.columns:
+        agg_df['trip_hour'] = agg_df['trip_hour'].astype('int8')
+    value_columns = [column for column in agg_df.columns if column not in ('vehicle_number', 'month', 'trip_day', 'trip_hour', 'source')]
+    agg_df[value_columns] = agg_df[value_columns].apply(pd.to_numeric, errors='coerce').astype('float64')
+    # without the pandas schema metadata, a JSON entry per column that would double the footer of wide files
+    return pa.Table.from_pandas(agg_df, preserve_index=False).replace_schema_metadata(None)
+
+def get_dataset(root, granularity):
+    path = os.path.join(root, granularity)
+    if not os.path.isdir(path):
+        return None
+    return ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+
+def _stored_keys(root, granularity, key_columns, vehicles):
+    dataset = get_dataset(root, granularity)
+    if dataset is None:
+        return None
+    # only the key columns of the vehicles' partitions are read
+    return dataset.to_table(columns=['vehicle_number'] + key_columns, filter=pc.field('vehicle_number').isin(vehicles)).to_pandas()
+
+def write_aggregates(agg_df, root, granularity, source, mode='append'):
+    """Writes daily or hourly aggregates (granularity 'daily' / 'hourly') of the source file under root.
+    Returns the rows written.
+
+    mode='append' skips the days (hours) already stored for a vehicle from the same source, mode='overwrite'
+    replaces the partitions the new rows fall in."""
+    table = to_aggregate_table(agg_df.assign(source=source))
+    key_columns = [column for column in ('trip_day', 'trip_hour') if column in table.column_names] + ['source']
+    path = os.path.join(root, granularity)
+
+    if mode == 'append':
+        stored = _stored_keys(root, granularity, key_columns, pc.unique(table['vehicle_number']))
+        if stored is not None and len(stored):
+            new_keys = table.select(['vehicle_number'] + key_columns).to_pandas()
+            is_new = new_keys.merge(stored.drop_duplicates(), how='left', indicator=True)['_merge'].eq('left_only').to_numpy()
+            table = table.filter(pa.array(is_new))
+        existing_data_behavior = 'overwrite_or_ignore'
+    elif mode == 'overwrite':
+        existing_data_behavior = 'delete_matching'
+    else:
+        raise ValueError(f"Unknown aggregate write mode: {mode}")
+
+    if table.num_rows:
+        ds.write_dataset(
+            table, path, format='parquet', partitioning=PARTITIONING,
+            # a fresh name per write, so appended files never replace earlier ones
+            basename_template=f"part-{uuid.uuid4().hex[:12]}-{{i}}.parquet",
+            existing_data_behavior=existing_data_behavior,
+            file_options=ds.ParquetFileFormat().make_write_options(compression=AGGREGATE_COMPRESSION),
+        )
+    return table.num_rows
+
+def read_aggregates(root, granularity, columns=None, vehicles=None, start=None, end=None):
+    """Aggregates as a dataframe, only the requested columns of the partitions for vehicles and trip days
+    start..end (inclusive). Key columns, the source file included, are always included."""
+    dataset = get_dataset(root, granularity)
+    if dataset is None:
+        return pd.DataFrame()
+
+    key_columns = ['vehicle_number'] + [column for column in ('trip_day', 'trip_hour', 'source') if column in dataset.schema.names]
+    selected = key_columns + [column for column in (columns or dataset.schema.names) if column not in key_columns + ['month']]
+    filters = []
+    if vehicles is not None:
+        filters.append(pc.field('vehicle_number').isin([str(vehicle) for vehicle in vehicles]))
+    if start is not None:
+        start = pd.Timestamp(start)
+        filters += [pc.field('month') >= start.strftime('%Y-%m'), pc.field('trip_day') >= start.date()]
+    if end is not None:
+        end = pd.Timestamp(end)
+        filters += [pc.field('month') <= end.strftime('%Y-%m'), pc.field('trip_day') <= end.date()]
+
+    expression = None
+    for condition in filters:
+        expression = condition if expression is None else expression & condition
+    agg_df = dataset.to_table(columns=selected, filter=expression).to_pandas()
+    return agg_df.sort_values(key_columns).reset_index(drop=True)
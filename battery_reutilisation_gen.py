@@ -1,9 +1,9 @@
-import plotly.graph_objs as go
 from typing import Dict, List, Optional
-import ollama
+import llm_client
 import streamlit as st
 import pandas as pd 
 import json
+import re
 import time
 
 def colored_metric(label, value, color):
@@ -106,29 +106,47 @@ def get_battery_reutil_prods_report(usage_data):
         try:
             start_time = time.time()
             #run the prompt
-            prod_response = ollama.generate(model='mistral', prompt=battery_reutil_prods_prompt)
+            prod_response = llm_client.generate(prompt=battery_reutil_prods_prompt, prompt_type='reutilisation')
             prod_response_report = prod_response['response']
             return prod_response_report
             
         except Exception as e:
             print(f"Error: {e}")  
 
-def get_reutil_prod_df(usage_data):
+def extract_json_array(text):
+    # the prompt asks for the array inside ```json fences, fall back to the raw response
+    match = re.search(r"```json\s*(.*?)\s*```", text, re.DOTALL)
+    return match.group(1) if match else text
+
+def generate_reutil_prod_df(usage_data):
+    # no UI output here so it can also run from the background prefetcher
     prod_response_report = get_battery_reutil_prods_report(usage_data)
+    if prod_response_report:
+        try:
+            prod_res_json = json.loads(extract_json_array(prod_response_report))
+        except ValueError:
+            llm_client.record_output_quality('reutilisation', False)
+            raise
+        llm_client.record_output_quality('reutilisation', True)
+        return pd.DataFrame(prod_res_json)
+
+def get_reutil_prod_df(usage_data):
+    prod_df = generate_reutil_prod_df(usage_data)
     # st.write(prod_response_report)
     
-    if prod_response_report:
-        prod_res_json = json.loads(prod_response_report)
-        prod_df = pd.DataFrame(prod_res_json)
+    if prod_df is not None:
         st.write("Reutilisation Product report generated!")
         # st.write(prod_df)
         return prod_df 
     else:
         st.write("products reutil report not found!")
         
-def display_all_reutil_prods(usage_data):
-    #get the prod_df
-    prod_df = get_reutil_prod_df(usage_data)
+def display_all_reutil_prods(usage_data, prod_df=None):
+    #get the prod_df, unless it was already generated (e.g. by the prefetcher)
+    if prod_df is None:
+        prod_df = get_reutil_prod_df(usage_data)
+    if prod_df is None:
+        return
 
     #display in the streamlit UI
     for index, row in prod_df.iterrows():
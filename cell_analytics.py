@@ -0,0 +1,167 @@
+import os
+import re
+import warnings
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+# Per-cell health analytics. The CELL<n>_V / CELL<n>_OCV / CELL<n>_RI readings are packed into
+# dense (vehicle x time bucket x cell) arrays, one bincount pass per quantity, and every feature
+# is a vectorized reduction over those arrays - there are no per-vehicle loops.
+CELL_TIME_BUCKET = os.environ.get('CELL_TIME_BUCKET', '60min')  # pandas frequency string
+CELL_QUANTITIES = ('V', 'OCV', 'RI')
+CELL_WEAKEST_RANKED = 3  # weakest cells listed per vehicle
+# readings further than this many median absolute deviations from the quantity's median are sensor
+# glitches (RI values in the thousands), wide enough to keep genuine sag and drift
+CELL_OUTLIER_MADS = 50
+
+@dataclass
+class CellCube:
+    values: np.ndarray  # (vehicle, time bucket, cell) bucket means, forward-filled along time
+    observed: np.ndarray  # same shape, True where the bucket had a reading
+    vehicles: pd.Index
+    buckets: pd.DatetimeIndex
+    cells: List[int]
+
+def get_cell_columns(columns, quantity):
+    """(cell number, column) pairs for one quantity, in cell order (CELL2 before CELL10)."""
+    pattern = re.compile(rf'^CELL(\d+)_{quantity}$')
+    cell_columns = []
+    for column in columns:
+        match = pattern.match(column)
+        if match:
+            cell_columns.append((int(match.group(1)), column))
+    return sorted(cell_columns)
+
+def forward_fill(values, observed):
+    # index of the last observed bucket at or before each bucket, leading gaps stay NaN
+    last_observed = np.where(observed, np.arange(values.shape[1])[None, :, None], 0)
+    np.maximum.accumulate(last_observed, axis=1, out=last_observed)
+    return np.take_along_axis(values, last_observed, axis=1)
+
+def build_cell_cubes(df, quantities=CELL_QUANTITIES, bucket=CELL_TIME_BUCKET):
+    """quantity -> CellCube, all cubes share the vehicle and time bucket axes."""
+    vehicle_column = 'Topic' if 'Topic' in df.columns else 'vehicle_number'
+    time_column = 'deviceTime' if 'deviceTime' in df.columns else 'createdAt'
+    cell_columns = {quantity: get_cell_columns(df.columns, quantity) for quantity in quantities}
+    cell_columns = {quantity: columns for quantity, columns in cell_columns.items() if columns}
+    if not cell_columns or time_column not in df.columns:
+        return {}
+
+    # only the rows carrying cell readings, cell telemetry is reported far less often than the pack values
+    all_columns = [column for columns in cell_columns.values() for _, column in columns]
+    has_reading = df[all_columns].notna().any(axis=1).to_numpy()
+    if not has_reading.any():
+        return {}
+    vehicle_codes, vehicles = pd.factorize(df[vehicle_column].to_numpy()[has_reading])
+    floored = pd.to_datetime(df[time_column][has_reading], utc=True).dt.floor(bucket)
+    start, step = floored.min(), pd.Timedelta(bucket)
+    bucket_codes = ((floored - start) // step).to_numpy()
+    n_vehicles, n_buckets = len(vehicles), int(bucket_codes.max()) + 1
+    buckets = pd.date_range(start, periods=n_buckets, freq=step)
+    vehicle_bucket = vehicle_codes * n_buckets + bucket_codes
+
+    cubes = {}
+    for quantity, columns in cell_columns.items():
+        cells, names = zip(*columns)
+        readings = df[list(names)].to_numpy(dtype=np.float64)[has_reading]
+        rows, columns = np.nonzero(~np.isnan(readings))
+        values = readings[rows, columns]
+        median = np.median(values)
+        mad = np.median(np.abs(values - median))
+        if mad > 0:
+            kept = np.abs(values - median) <= CELL_OUTLIER_MADS * mad
+            rows, columns, values = rows[kept], columns[kept], values[kept]
+        # flat (vehicle, bucket, cell) slot of every reading, summed and counted in one pass each
+        slots = vehicle_bucket[rows] * len(cells) + columns
+        size = n_vehicles * n_buckets * len(cells)
+        sums = np.bincount(slots, weights=values, minlength=size)
+        counts = np.bincount(slots, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = (sums / counts).reshape(n_vehicles, n_buckets, len(cells))
+        observed = (counts > 0).reshape(n_vehicles, n_buckets, len(cells))
+        cubes[quantity] = CellCube(forward_fill(means, observed), observed, pd.Index(vehicles), buckets, list(cells))
+    return cubes
+
+def get_drift_slopes(cube):
+    """Least squares slope per (vehicle, cell) over the observed buckets, in units per day."""
+    bucket_days = ((cube.buckets - cube.buckets[0]) / pd.Timedelta(days=1)).to_numpy()[None, :, None]
+    weights = cube.observed.astype(np.float64)
+    readings = np.where(cube.observed, cube.values, 0.0)
+    n = weights.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        day_mean = (weights * bucket_days).sum(axis=1) / n
+        reading_mean = readings.sum(axis=1) / n
+        day_offsets = (bucket_days - day_mean[:, None, :]) * weights
+        covariance = (day_offsets * (readings - reading_mean[:, None, :])).sum(axis=1)
+        variance = (day_offsets * (bucket_days - day_mean[:, None, :])).sum(axis=1)
+        return np.where((n >= 2) & (variance > 0), covariance / variance, np.nan)
+
+def get_cell_features(df, bucket=CELL_TIME_BUCKET):
+    """Per-vehicle cell health features indexed by vehicle number, empty when the upload has no cell columns."""
+    cubes = build_cell_cubes(df, bucket=bucket)
+    if not cubes:
+        return pd.DataFrame()
+
+    features = pd.DataFrame(index=next(iter(cubes.values())).vehicles.rename('vehicle_number'))
+    with warnings.catch_warnings():
+        # all-NaN slices (vehicles without readings of a quantity) reduce to NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if 'V' in cubes:
+            voltages = cubes['V'].values
+            # imbalance: spread between the highest and lowest cell in each bucket
+            spread = np.nanmax(voltages, axis=2) - np.nanmin(voltages, axis=2)
+            features['cell_imbalance_mean_mv'] = np.nanmean(spread, axis=1) * 1000
+            features['cell_imbalance_max_mv'] = np.nanmax(spread, axis=1) * 1000
+
+            # weakest cells: lowest average voltage relative to the pack median of each bucket
+            deficit = np.nanmean(voltages - np.nanmedian(voltages, axis=2, keepdims=True), axis=1)
+            ranking = np.argsort(np.where(np.isnan(deficit), np.inf, deficit), axis=1)[:, :CELL_WEAKEST_RANKED]
+            cells = np.array(cubes['V'].cells)
+            weakest_deficit = np.take_along_axis(deficit, ranking[:, :1], axis=1)[:, 0]
+            features['weakest_cells'] = [list(map(int, ranked)) if not np.isnan(d) else None for ranked, d in zip(cells[ranking], weakest_deficit)]
+            features['weakest_cell_deficit_mv'] = weakest_deficit * 1000
+
+        if 'RI' in cubes:
+            slopes = get_drift_slopes(cubes['RI'])
+            features['ri_drift_max_per_day'] = np.nanmax(slopes, axis=1)
+            features['ri_drift_mean_per_day'] = np.nanmean(slopes, axis=1)
+
+        if 'OCV' in cubes:
+            # dispersion: spread of the cells' open circuit voltages around their mean, per bucket
+            features['ocv_dispersion_mv'] = np.nanmean(np.nanstd(cubes['OCV'].values, axis=2), axis=1) * 1000
+
+    return features.round(4)
+
+def merge_summary_features(vehicle_usage_df, features):
+    """Adds per-vehicle features (indexed by vehicle number) as columns, usage records pick them up from there."""
+    features = features.reindex(vehicle_usage_df['vehicle_number'])
+    vehicle_usage_df = vehicle_usage_df.copy()
+    for column in features.columns:
+        vehicle_usage_df[column] = features[column].to_numpy()
+    return vehicle_usage_df
+
+def add_cell_features(vehicle_usage_df, df):
+    """Adds the cell features as columns, for the pricing prompt."""
+    cell_features = get_cell_features(df)
+    if cell_features.empty:
+        return vehicle_usage_df
+    return merge_summary_features(vehicle_usage_df, cell_features)
+
+def format_cell_health(usage_data):
+    """Cell diagnostics section of the pricing prompt, empty when the summary has no cell features."""
+    lines = []
+    if usage_data.get('cell_imbalance_mean_mv') is not None:
+        lines.append(f"- Cell Voltage Imbalance (mean / max): {usage_data['cell_imbalance_mean_mv']:.1f} mV / {usage_data['cell_imbalance_max_mv']:.1f} mV")
+    if usage_data.get('weakest_cells'):
+        lines.append(f"- Weakest Cells: {', '.join(f'CELL{cell}' for cell in usage_data['weakest_cells'])} "
+                     f"(weakest {abs(usage_data['weakest_cell_deficit_mv']):.1f} mV below the pack median)")
+    if usage_data.get('ri_drift_max_per_day') is not None:
+        lines.append(f"- Internal Resistance Drift (fastest cell / mean): {usage_data['ri_drift_max_per_day']:+.4f} / {usage_data['ri_drift_mean_per_day']:+.4f} per day")
+    if usage_data.get('ocv_dispersion_mv') is not None:
+        lines.append(f"- OCV Dispersion across cells: {usage_data['ocv_dispersion_mv']:.1f} mV")
+    if not lines:
+        return ''
+    return "\n    5. Cell-Level Diagnostics:\n" + '\n'.join(f"        {line}" for line in lines) + '\n'
@@ -1,14 +1,38 @@
 import pandas as pd 
 import numpy as np 
-import ollama 
+import llm_client
 import re 
 import streamlit as st
-import plotly.express as px
-import plotly.graph_objects as go
 from electra_battery_usage_market_prompt import *
 from concurrent.futures import ThreadPoolExecutor
-from IPython.display import display
 import concurrent.futures
+import hashlib
+import os
+import random
+import time
+from job_queue import get_job_queue
+from pricing_journal import PricingJournal
+from agg_sandbox import run_generated_aggregation, AggregationSandboxError
+from agg_validation import validate_aggregation_code
+from cell_analytics import add_cell_features
+from thermal_episodes import add_excursion_episodes
+from usage_index import UsageWindowIndex
+from telemetry_store import get_telemetry_store, get_daily_rollups
+from price_sampling import sample_price_analysis, PRICE_SAMPLING_FLEET
+from usage_records import compact_usage_df, get_usage_records, PriceResult
+from fleet_charts import *
+
+# Cached stages are keyed on the upload fingerprint (+ parameters), never on the
+# dataframes themselves, and keep at most this many uploads before evicting.
+CACHE_MAX_ENTRIES = 4
+
+# Attempts per vehicle before fleet pricing gives up on it for this run, with exponential
+# backoff (secs) between attempts. Failed vehicles are priced again on the next run.
+PRICING_MAX_ATTEMPTS = int(os.environ.get('PRICING_MAX_ATTEMPTS', 3))
+PRICING_RETRY_BACKOFF = float(os.environ.get('PRICING_RETRY_BACKOFF', 2.0))
+
+# Generations of the aggregation code tried before falling back to the reference summary
+AGG_MAX_GENERATIONS = int(os.environ.get('AGG_MAX_GENERATIONS', 2))
 
 generate_agg_fields_prompt = """
 Role:
@@ -141,15 +165,34 @@ def get_vehicle_usage_summary(df):
 vehicle_usage_df = get_vehicle_usage_summary(df)
 """
 
-@st.cache_data  # Cache the prices estimated for each vehicle combined and visualized in line format
-def get_cached_pricing_all_vehicles(vehicle_usage_df):
-    return get_pricing_all_vehicles(vehicle_usage_df)
+def get_upload_fingerprint(file_bytes):
+    # byte hash of the raw upload, computed once per upload and used as the cache key downstream
+    return hashlib.sha256(file_bytes).hexdigest()
+
+def get_session_upload_fingerprint(uploaded_file):
+    # hash the upload bytes only when a new file arrives, not on every rerun
+    if st.session_state.get('upload_file_id') != uploaded_file.file_id:
+        st.session_state.upload_file_id = uploaded_file.file_id
+        st.session_state.upload_fingerprint = get_upload_fingerprint(uploaded_file.getvalue())
+    return st.session_state.upload_fingerprint
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)  # Cache the prices estimated for each vehicle, keyed on the upload fingerprint
+def get_cached_pricing_all_vehicles(_vehicle_usage_df, upload_fingerprint):
+    return get_pricing_all_vehicles(_vehicle_usage_df, upload_fingerprint)
+
+@st.cache_resource(max_entries=CACHE_MAX_ENTRIES)  # Built once per upload and shared read-only, date range summaries are then answered from it
+def get_cached_usage_index(_df, upload_fingerprint):
+    return UsageWindowIndex(_df)
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def get_cached_battery_health_fig(_vehicle_usage_df, upload_fingerprint):
+    return plot_battery_health_across_vehicles(_vehicle_usage_df)
 
 def generate_py_code_agg_fields(generate_agg_fields_prompt):
     try:
         # st.markdown("*GenAI is running..*")
         start_time = time.time()
-        agg_func_response = ollama.generate(model='mistral', prompt=generate_agg_fields_prompt)
+        agg_func_response = llm_client.generate(prompt=generate_agg_fields_prompt, prompt_type='agg_code')
         py_func_value = agg_func_response['response']
         
         # st.write("Python function formulated!")
@@ -164,20 +207,85 @@ def extract_python_function(text):
     match = re.search(r"```python\n(.*?)\n```", text, re.DOTALL)
     return match.group(1) if match else None
 
-def get_vehicle_usage_df(df, generate_agg_fields_prompt):
-    #extract the aggregated fields df for vehicle usage 
-    py_func_value = generate_py_code_agg_fields(generate_agg_fields_prompt)
-    extracted_code = extract_python_function(py_func_value) 
+def get_reference_usage_summary(df):
+    """Vectorized per-vehicle usage summary with the columns the generated code is asked for."""
+    vehicle_column = 'Topic' if 'Topic' in df.columns else 'vehicle_number'
+    vehicles = df[vehicle_column]
+    grouped = df.groupby(vehicle_column, sort=False)
+
+    def aggregate(column, how, default=np.nan):
+        if column not in df.columns:
+            return pd.Series(default, index=grouped.size().index)
+        return grouped[column].agg(how)
+
+    excursions = (df['MAX_CELL_T'] > 40.0).groupby(vehicles, sort=False).sum() if 'MAX_CELL_T' in df.columns else aggregate('MAX_CELL_T', 'count', 0)
+    vehicle_usage_df = pd.DataFrame({
+        'mean_soh': aggregate('SOH', 'mean').round(2),
+        'temperature_excursions': excursions.astype(int),
+        'final_capacity': aggregate('ADP_AMPHR', 'mean').round(2),
+        'age_of_vehicle': aggregate('ODO', 'max').round(2),
+        'num_cycles': aggregate('CYCLE', 'max', 0).fillna(0).astype(int),
+        'max_voltage': aggregate('MAX_CELL_V', 'max'),
+        'min_voltage': aggregate('MIN_CELL_V', 'min'),
+    })
+    return vehicle_usage_df.rename_axis('vehicle_number').reset_index()
+
+def get_vehicle_usage_df(df, generate_agg_fields_prompt, upload_fingerprint=None):
+    # with the SQL store enabled an upload is summarized once, by whichever session or job sees it first
+    store = get_telemetry_store() if upload_fingerprint else None
+    if store is not None:
+        vehicle_usage_df = store.get_usage_summaries(upload_fingerprint)
+        if vehicle_usage_df is not None:
+            return vehicle_usage_df
+
+    # excursion episodes and cell level features come from vectorized analytics, not from the generated code
+    vehicle_usage_df = get_pack_usage_df(df, generate_agg_fields_prompt)
+    vehicle_usage_df = add_excursion_episodes(vehicle_usage_df, df)
+    vehicle_usage_df = compact_usage_df(add_cell_features(vehicle_usage_df, df))
+    if store is not None:
+        store.save_rollups(get_daily_rollups(df), upload_fingerprint)
+        store.save_usage_summaries(upload_fingerprint, vehicle_usage_df)
+    return vehicle_usage_df
+
+def get_pack_usage_df(df, generate_agg_fields_prompt):
+    prompt = generate_agg_fields_prompt
+    for attempt in range(AGG_MAX_GENERATIONS):
+        #extract the aggregated fields df for vehicle usage 
+        py_func_value = generate_py_code_agg_fields(prompt)
+        extracted_code = extract_python_function(py_func_value) if py_func_value else None
+        if not extracted_code:
+            llm_client.record_output_quality('agg_code', False)
+            continue
+
+        # checked on a sample against the reference summary before it touches the full upload
+        validation = validate_aggregation_code(extracted_code, df, get_reference_usage_summary)
+        llm_client.record_output_quality('agg_code', validation.ok)
+        if not validation.ok:
+            print(f"Generated aggregation code rejected: {validation.reason}")
+            # the rejection reason also makes the regenerated prompt a new request
+            prompt = f"{generate_agg_fields_prompt}\n\nA previously generated function was rejected: {validation.reason}. Fix this in the new function."
+            continue
 
-    #execute the extracted py code which returns the get_vehicle_usage_summary func
-    if extracted_code: 
-        exec(extracted_code, globals())
+        #run the extracted py code (get_vehicle_usage_summary) in a resource limited worker process
+        try:
+            return run_generated_aggregation(extracted_code, df)
+        except AggregationSandboxError as e:
+            print(f"Error: {e}")
+            break
 
-    #get the dataframe 
-    vehicle_usage_df = get_vehicle_usage_summary(df)
-    return vehicle_usage_df 
+    # no usable generated code, the reference summary has the same columns
+    return get_reference_usage_summary(df)
+
+def plot_battery_health_across_vehicles(vehicle_usage_df, render_tier=None):
+    import plotly.graph_objects as go
+
+    # large fleets switch to WebGL markers, then to SOH-band summaries
+    render_tier = render_tier or get_render_tier(len(vehicle_usage_df))
+    if render_tier == WEBGL:
+        return plot_battery_health_webgl(vehicle_usage_df)
+    if render_tier == AGGREGATED:
+        return plot_battery_health_binned(vehicle_usage_df)
 
-def plot_battery_health_across_vehicles(vehicle_usage_df):
     vehicle_usage_df = vehicle_usage_df.sort_values(by='vehicle_number')
     fig = go.Figure()
     
@@ -224,34 +332,115 @@ def plot_battery_health_across_vehicles(vehicle_usage_df):
 
 def process_vehicle(usage_data):
     """Process a single vehicle's price analysis af1nd return the result."""
-    price_analysis_report = get_price_analysis_report(usage_data)
-    price_values = get_price_values(price_analysis_report)
+    if PRICE_SAMPLING_FLEET:
+        # median of the self-consistency samples instead of a single generation
+        price_values = sample_price_analysis(usage_data)[0] or {}
+    else:
+        price_analysis_report = get_price_analysis_report(usage_data)
+        price_values = get_price_values(price_analysis_report)
+    if 'current_value' not in price_values:
+        raise ValueError(f"No current value in the price analysis of vehicle {usage_data['vehicle_number']}")
     
-    return {
-        'vehicle_number': usage_data['vehicle_number'], 
-        'mean_soh': usage_data['mean_soh'], 
-        'temperature_excursions': usage_data['temperature_excursions'], 
-        'final_capacity': usage_data['final_capacity'], 
-        'age_of_vehicle': usage_data['age_of_vehicle'], 
-        'num_cycles': usage_data['num_cycles'], 
-        'max_voltage': usage_data['max_voltage'], 
-        'min_voltage': usage_data['min_voltage'], 
-        'current_price': price_values['current_value']
-    }
-
-def get_pricing_all_vehicles(vehicle_usage_df):
+    return PriceResult(
+        vehicle_number=usage_data['vehicle_number'], 
+        mean_soh=usage_data['mean_soh'], 
+        temperature_excursions=usage_data['temperature_excursions'], 
+        final_capacity=usage_data['final_capacity'], 
+        age_of_vehicle=usage_data['age_of_vehicle'], 
+        num_cycles=usage_data['num_cycles'], 
+        max_voltage=usage_data['max_voltage'], 
+        min_voltage=usage_data['min_voltage'], 
+        current_price=price_values['current_value']
+    )
+
+def price_vehicle_with_retry(usage_data, journal=None):
+    # every attempt's outcome goes to the journal as soon as it is known, so an interrupted run keeps its progress
+    for attempt in range(1, PRICING_MAX_ATTEMPTS + 1):
+        try:
+            result = process_vehicle(usage_data)
+        except llm_client.LLMCancelledError:
+            raise
+        except Exception as e:
+            if journal is not None:
+                journal.record_failure(usage_data, attempt, e)
+            if attempt == PRICING_MAX_ATTEMPTS:
+                raise
+            time.sleep(PRICING_RETRY_BACKOFF * 2 ** (attempt - 1) * random.uniform(0.8, 1.2))
+        else:
+            if journal is not None:
+                journal.record_price(usage_data, result)
+            store = get_telemetry_store()
+            if store is not None:
+                store.save_price(usage_data, result)
+            return result
+
+def get_journaled_prices(journal, usage_summaries):
+    # split the fleet into (index, result) pairs already in the journal or the SQL store and the indices still to be priced
+    prices = journal.load_prices() if journal is not None else {}
+    store = get_telemetry_store()
+    stored_prices = store.get_prices(usage_summaries) if store is not None else {}
+    results, pending = [], []
+    for i, usage_data in enumerate(usage_summaries):
+        result = journal.get_price(prices, usage_data) if journal is not None else None
+        if result is None:
+            result = stored_prices.get(i)
+        if result is not None:
+            results.append((i, result))
+        else:
+            pending.append(i)
+    return results, pending
+
+def get_pricing_all_vehicles(vehicle_usage_df, upload_fingerprint=None):
+    journal = PricingJournal(upload_fingerprint) if upload_fingerprint else None
+    usage_summaries = get_usage_records(vehicle_usage_df)
+    results, pending = get_journaled_prices(journal, usage_summaries)
+
+    def price_vehicle(usage_data):
+        try:
+            return price_vehicle_with_retry(usage_data, journal)
+        except Exception as e:
+            print(f"Error: {e}")
+            return None
+
     # Run in parallel using ThreadPoolExecutor
     with ThreadPoolExecutor(max_workers=5) as executor:  # Adjust max_workers as needed
-        all_vehicles_prices_data = list(executor.map(process_vehicle, vehicle_usage_df['vehicle_summary']))
+        results += zip(pending, executor.map(price_vehicle, [usage_summaries[i] for i in pending]))
     
     # Convert results to DataFrame
-    all_vehicles_prices_df = pd.DataFrame(all_vehicles_prices_data)
-    return all_vehicles_prices_df
+    return get_prices_df_from_results(results)
+
+def run_fleet_pricing_job(job, vehicle_usage_df, upload_fingerprint):
+    # vehicles priced by an earlier run of this upload come from the journal, the rest are
+    # priced on the shared model workers and their partial results are polled by the page
+    journal = PricingJournal(upload_fingerprint)
+    usage_summaries = get_usage_records(vehicle_usage_df)
+    results, pending = get_journaled_prices(journal, usage_summaries)
+    for result in results:
+        job.add_partial_result(result)
+    results += get_job_queue().map_items(
+        job, lambda usage_data: price_vehicle_with_retry(usage_data, journal), [usage_summaries[i] for i in pending], indices=pending
+    )
+    return get_prices_df_from_results(results)
+
+def get_prices_df_from_results(results):
+    # restore the upload order of (index, result) pairs and skip vehicles that failed pricing
+    all_vehicles_prices_data = [result for _, result in sorted(results, key=lambda x: x[0]) if result]
+    return pd.DataFrame(all_vehicles_prices_data)
+
+def plot_prices_all_vehicles(vehicle_usage_df, upload_fingerprint):
+    all_vehicles_prices_df = get_cached_pricing_all_vehicles(vehicle_usage_df, upload_fingerprint)
+    return plot_all_vehicles_prices_df(all_vehicles_prices_df), all_vehicles_prices_df
+
+def plot_all_vehicles_prices_df(all_vehicles_prices_df, render_tier=None):
+    import plotly.express as px
+
+    # large fleets switch to ranked WebGL markers, then to a price histogram
+    render_tier = render_tier or get_render_tier(len(all_vehicles_prices_df))
+    if render_tier == WEBGL:
+        return plot_prices_webgl(all_vehicles_prices_df)
+    if render_tier == AGGREGATED:
+        return plot_prices_binned(all_vehicles_prices_df)
 
-def plot_prices_all_vehicles(vehicle_usage_df):
-    # vehicle_usage_df = vehicle_usage_df.sort_values(by='vehicle_number')
-    all_vehicles_prices_df = get_cached_pricing_all_vehicles(vehicle_usage_df)
-    
     # Get the highest price and set Y-axis limit
     max_price = all_vehicles_prices_df['current_price'].max()
     y_axis_limit = max_price + 30000  # Adding 30k buffer
@@ -273,7 +462,81 @@ def plot_prices_all_vehicles(vehicle_usage_df):
         yaxis=dict(range=[0, y_axis_limit], showgrid=False, zeroline=False),   # Set Y-axis limit
         paper_bgcolor='black', plot_bgcolor='white', font=dict(color='black')  # white theme
     )
-    return fig, all_vehicles_prices_df
+    return fig
 
+def process_vehicle_forecast(vehicle_usage_df, i):
+    """Function to process each vehicle separately."""
+    usage_data = get_usage_records(vehicle_usage_df.iloc[[i]])[0]
+    vehicle_id = vehicle_usage_df['vehicle_number'][i]
+
+    price_analysis_report = get_price_analysis_report(usage_data)
+    price_final_dict = get_price_values(price_analysis_report)
+    if 'current_value' not in price_final_dict:
+        raise ValueError(f"No current value in the price forecast of vehicle {vehicle_id}")
+    return price_final_dict, vehicle_id
+
+def _try_vehicle_forecast(vehicle_usage_df, i):
+    # a vehicle that fails to price is left out of the chart, like map_items does for the fleet job
+    try:
+        return process_vehicle_forecast(vehicle_usage_df, i)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return None
+
+def run_fleet_forecast_job(job, vehicle_usage_df, num_vehicles):
+    # results arrive in completion order, the page draws each vehicle's trace as soon as it lands
+    results = get_job_queue().map_items(job, lambda i: process_vehicle_forecast(vehicle_usage_df, i), range(num_vehicles))
+    return combine_forecasting_figures(results, vehicle_usage_df)
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def get_cached_combined_forecasting_chart(_vehicle_usage_df, upload_fingerprint, num_vehicles):
+    with ThreadPoolExecutor() as executor:
+        results = list(executor.map(lambda i: (i, _try_vehicle_forecast(_vehicle_usage_df, i)), range(num_vehicles)))
+    return combine_forecasting_figures(results, _vehicle_usage_df)
+
+def combine_forecasting_figures(results, vehicle_usage_df, render_tier=None):
+    # results are (index, (price_final_dict, vehicle_id)) pairs in completion order, failed vehicles come through as None.
+    # Traces are added in that order and coloured by vehicle index so a partial chart only ever grows.
+    results = [(i, result) for i, result in results if result and 'current_value' in result[0]]
+    # the tier follows the fleet size rather than the results so far, so the chart doesn't switch mid-run
+    render_tier = render_tier or get_render_tier(len(vehicle_usage_df))
+
+    if render_tier == DETAILED:
+        import plotly.colors as pc
+        import plotly.graph_objects as go
+
+        viridis_colors = pc.sequential.Plasma_r  # Get Viridis colors
+        combined_fig = go.Figure()
+
+        for i, (price_final_dict, vehicle_id) in results:
+            fig = plot_price_forecasting_values(price_final_dict, vehicle_id)
+            for trace in fig['data']:
+                trace.name = f"Vehicle {vehicle_id}"  # Use actual vehicle ID
+                trace.line.color = viridis_colors[i % len(viridis_colors)]  # Assign Viridis color
+                combined_fig.add_trace(trace)
+    else:
+        forecast_matrix = get_forecast_matrix([price_final_dict for _, (price_final_dict, _) in results])
+        if render_tier == WEBGL:
+            combined_fig = plot_forecasts_webgl([vehicle_id for _, (_, vehicle_id) in results], forecast_matrix)
+        else:
+            soh_values = vehicle_usage_df['mean_soh'].to_numpy()[[i for i, _ in results]]
+            combined_fig = plot_forecasts_fan(forecast_matrix, soh_values)
+
+    combined_fig.update_layout(
+        # template="plotly_dark",  # Optional: Use dark theme
+        title="Battery Price Forecasting Across Vehicles",
+        xaxis_title="Time Period",
+        yaxis_title="Forecasted Value (INR)",
+        legend_title="SOH Cohorts" if render_tier == AGGREGATED else "Vehicles",
+        height=600,
+        paper_bgcolor="black",  # Set entire background to white
+        plot_bgcolor="white",  # Set the plot area background to white
+        font=dict(color="black"),  # Ensure text is visible
+        yaxis=dict(
+            showgrid=False, 
+            # gridcolor="lightgrey",  # Light grey gridlines
+            zeroline=True
+        )
+    )
 
-    
\ No newline at end of file
+    return combined_fig
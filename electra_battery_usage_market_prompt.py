@@ -1,9 +1,10 @@
-import plotly.graph_objs as go
 from typing import Dict, List, Optional
 from dataclasses import dataclass
 from datetime import datetime
-import ollama
+import llm_client
 import streamlit as st
+from cell_analytics import format_cell_health
+from thermal_episodes import format_excursion_episodes
 import re 
 import json
 import time 
@@ -39,6 +40,9 @@ class SafetyStatus:
     over_discharge: int = 2
     short_circuit: int = 2
 
+# usage metrics the pricing prompt always states, 'unknown' when the telemetry could not provide them
+PROMPT_USAGE_METRICS = ['mean_soh', 'temperature_excursions', 'final_capacity', 'age_of_vehicle', 'num_cycles', 'max_voltage', 'min_voltage']
+
 def generate_enhanced_pricing_prompt(
         battery_specs: BatterySpecs,
         operating_params: OperatingParams,
@@ -86,13 +90,13 @@ def generate_enhanced_pricing_prompt(
 
     4. Usage History:
         - State of Health : {mean_soh} 
-        - Temperature Excursions: {temperature_excursions}
+        - Temperature Excursions: {temperature_excursions}{excursion_episodes_line}
         - Final Capacity (in Ah units): {final_capacity}
         - Age of battery operating (in kms): {age_of_vehicle}
         - Cycle count : {num_cycles}
         - Max Cell Voltage: {max_voltage}
         - Min Cell Voltage: {min_voltage}
-    
+    {cell_health}
     Premium features adding to the cost:
     1. IP67 rating (+5-8%)
     2. Advanced protection systems:
@@ -188,7 +192,9 @@ def generate_enhanced_pricing_prompt(
         }}
     }}
     """
-    
+
+    usage_metrics = dict.fromkeys(PROMPT_USAGE_METRICS, 'unknown')
+    usage_metrics.update({key: 'unknown' if value is None else value for key, value in usage_data.items()})
     return base_prompt.format(
         capacity_kwh=battery_specs.capacity_kwh,
         nominal_capacity_ah=battery_specs.nominal_capacity_ah,
@@ -216,7 +222,9 @@ def generate_enhanced_pricing_prompt(
         overcharge=safety_status.overcharge,
         over_discharge=safety_status.over_discharge,
         short_circuit=safety_status.short_circuit,
-        **usage_data
+        excursion_episodes_line=format_excursion_episodes(usage_data),
+        cell_health=format_cell_health(usage_data),
+        **usage_metrics
     )
 
 def get_price_analysis_prompt(usage_data):
@@ -229,24 +237,31 @@ def get_price_analysis_prompt(usage_data):
     battery_stats_usage_price_prompt = generate_enhanced_pricing_prompt(specs, params, safety, usage_data)
     return battery_stats_usage_price_prompt
 
-def get_price_analysis_report(usage_data):
+def get_price_analysis_report(usage_data, seed=None):
     if usage_data:
         # Combine the usage stats with the battery static data properties prompt  
         battery_stats_usage_price_prompt = get_price_analysis_prompt(usage_data)
         
         try:
             start_time = time.time()
-            price_response = ollama.generate(model='mistral', prompt=battery_stats_usage_price_prompt)
+            price_response = llm_client.generate(prompt=battery_stats_usage_price_prompt, prompt_type='price_analysis', seed=seed)
             # st.write("Success!")
             
             price_analysis_report = price_response['response']
             # print("Output displayed in %.2f seconds" % (time.time() - start_time))
             
             return price_analysis_report
+        except llm_client.LLMCancelledError:
+            raise
         except Exception as e:
             print(f"Error: {e}")   
             
 def get_price_values(price_analysis_report):
+    if not price_analysis_report:
+        # the generation failed, callers check for the missing current_value
+        llm_client.record_output_quality('price_analysis', False)
+        return {}
+
     # Regular expressions to extract the required values
     pattern = r'"current_value": (\d+)|"1_month[s]?": (\d+)|"3_month[s]?": (\d+)|"6_month[s]?": (\d+)|"12_month[s]?": (\d+)|"confidence_level": ([\d.]+)'
 
@@ -259,11 +274,12 @@ def get_price_values(price_analysis_report):
                     for match in matches 
                     for i, value in enumerate(match) if value
                     }
+    llm_client.record_output_quality('price_analysis', 'current_value' in price_final_dict)
     return price_final_dict
 
-import plotly.graph_objects as go
-
 def plot_price_forecasting_values(price_final_dict, vehicle_id):
+    import plotly.graph_objects as go
+
     # Extract x and y values for the plot
     time_periods = ["Current Value", "1 Months", "3 Months", "6 Months", "12 Months"]
     values = [
@@ -318,6 +334,20 @@ def plot_price_forecasting_values(price_final_dict, vehicle_id):
         hoverinfo="text"
     ))
 
+    # empirical band across the self-consistency samples (price_sampling.py)
+    spread = price_final_dict.get('spread')
+    if spread:
+        band = [(period, spread[key]) for period, key in zip(time_periods, ['current_value', '1_months', '3_months', '6_months', '12_months']) if key in spread]
+        fig.add_trace(go.Scatter(
+            x=[period for period, _ in band] + [period for period, _ in band[::-1]],
+            y=[bounds['high'] for _, bounds in band] + [bounds['low'] for _, bounds in band[::-1]],
+            fill='toself',
+            fillcolor='rgba(99, 110, 250, 0.2)',
+            line=dict(width=0),
+            hoverinfo='skip'
+        ))
+        confidence_score = f"{confidence_score}% (model), {price_final_dict['num_samples']} samples within ±{price_final_dict['max_rel_spread'] * 50:.1f}"
+
     # Add confidence score at the top right
     fig.add_annotation(
         x=1, y=1.15, 
@@ -424,8 +454,9 @@ def latest_market_news_headlines():
     """
     
     try:
-        market_news_response = ollama.generate(model='mistral', prompt=battery_pricing_market_news_prompt)        
+        market_news_response = llm_client.generate(prompt=battery_pricing_market_news_prompt, prompt_type='market_news')        
         latest_market_news_report = market_news_response['response']
+        llm_client.record_output_quality('market_news', bool(latest_market_news_report.strip()))
         return latest_market_news_report
     except Exception as e:
         print(f"Error: {e}")   
@@ -0,0 +1,244 @@
+import io
+import itertools
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from telemetry_reader import iter_telemetry_chunks, read_telemetry_csv
+
+# Catalog of the telemetry files in a fleet folder, built at ingest time. Every file is split into
+# chunks of CATALOG_CHUNK_ROWS rows (the CSV analogue of a row group) and the catalog keeps, per file
+# and per chunk, the vehicle set, the time range and the min/max of a few key columns, so a query for
+# a vehicle or a date range only opens the files and chunks that can match. Plain CSV chunks are read
+# back by byte range, compressed files can only be skipped as a whole.
+CATALOG_FILE_NAME = '.fleet_catalog.json'
+CATALOG_CHUNK_ROWS = int(os.environ.get('CATALOG_CHUNK_ROWS', 50000))
+CATALOG_COLUMNS = ('SOH', 'ODO', 'CYCLE', 'MAX_CELL_T')
+TELEMETRY_SUFFIXES = ('.csv', '.csv.gz', '.csv.zip', '.csv.zst')
+
+@dataclass
+class ChunkStats:
+    row_start: int
+    rows: int
+    byte_start: Optional[int]  # byte range of the chunk's lines, None in compressed files
+    byte_end: Optional[int]
+    vehicles: List[str]
+    time_min: Optional[str]  # ISO UTC
+    time_max: Optional[str]
+    column_ranges: Dict[str, Tuple[Optional[float], Optional[float]]]
+
+@dataclass
+class FileStats:
+    name: str
+    size: int
+    mtime: float
+    rows: int = 0
+    vehicles: List[str] = field(default_factory=list)
+    time_min: Optional[str] = None
+    time_max: Optional[str] = None
+    column_ranges: Dict[str, Tuple[Optional[float], Optional[float]]] = field(default_factory=dict)
+    chunks: List[ChunkStats] = field(default_factory=list)
+
+def get_vehicle_column(df):
+    return 'Topic' if 'Topic' in df.columns else 'vehicle_number'
+
+def get_time_column(df):
+    return 'createdAt' if 'createdAt' in df.columns else 'deviceTime'
+
+def _to_utc(value, end_of_day=False):
+    if value is None:
+        return None
+    timestamp = pd.Timestamp(value)
+    # an end at midnight ('2024-05-21', a date or a day Timestamp) includes that whole day, the same
+    # day granularity as read_aggregates
+    if end_of_day and timestamp == timestamp.normalize():
+        timestamp += pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+
+def _float_or_none(value):
+    return None if pd.isna(value) else float(value)
+
+def get_chunk_stats(chunk, row_start, byte_start=None, byte_end=None):
+    times = pd.to_datetime(chunk[get_time_column(chunk)], utc=True, errors='coerce')
+    column_ranges = {}
+    for column in CATALOG_COLUMNS:
+        if column in chunk.columns:
+            values = pd.to_numeric(chunk[column], errors='coerce')
+            column_ranges[column] = (_float_or_none(values.min()), _float_or_none(values.max()))
+    return ChunkStats(
+        row_start=row_start, rows=len(chunk), byte_start=byte_start, byte_end=byte_end,
+        vehicles=sorted(map(str, chunk[get_vehicle_column(chunk)].dropna().unique())),
+        time_min=None if pd.isna(times.min()) else times.min().isoformat(),
+        time_max=None if pd.isna(times.max()) else times.max().isoformat(),
+        column_ranges=column_ranges,
+    )
+
+def _iter_csv_chunks(path, chunk_rows):
+    """(row start, chunk df, byte start, byte end) per chunk of a file."""
+    if not path.endswith('.csv'):
+        # compressed, chunks can only be located by row
+        row_start = 0
+        for chunk in iter_telemetry_chunks(path, chunk_rows=chunk_rows):
+            yield row_start, chunk, None, None
+            row_start += len(chunk)
+        return
+
+    # split on lines, telemetry files have no quoted line breaks
+    with open(path, 'rb') as f:
+        header = f.readline()
+        row_start, byte_start = 0, len(header)
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                return
+            data = b''.join(lines)
+            yield row_start, pd.read_csv(io.BytesIO(header + data), low_memory=False), byte_start, byte_start + len(data)
+            row_start += len(lines)
+            byte_start += len(data)
+
+def _merge_ranges(ranges):
+    lows = [low for low, _ in ranges if low is not None]
+    highs = [high for _, high in ranges if high is not None]
+    return (min(lows) if lows else None, max(highs) if highs else None)
+
+def scan_file(path, chunk_rows=CATALOG_CHUNK_ROWS):
+    stat = os.stat(path)
+    file_stats = FileStats(name=os.path.basename(path), size=stat.st_size, mtime=stat.st_mtime)
+    for row_start, chunk, byte_start, byte_end in _iter_csv_chunks(path, chunk_rows):
+        file_stats.chunks.append(get_chunk_stats(chunk, row_start, byte_start, byte_end))
+
+    chunks = file_stats.chunks
+    file_stats.rows = sum(chunk.rows for chunk in chunks)
+    file_stats.vehicles = sorted(set().union(*(chunk.vehicles for chunk in chunks)))
+    # compared as timestamps, the ISO strings only sort correctly when they share a format
+    time_mins = [pd.Timestamp(chunk.time_min) for chunk in chunks if chunk.time_min is not None]
+    time_maxs = [pd.Timestamp(chunk.time_max) for chunk in chunks if chunk.time_max is not None]
+    file_stats.time_min = min(time_mins).isoformat() if time_mins else None
+    file_stats.time_max = max(time_maxs).isoformat() if time_maxs else None
+    columns = sorted(set().union(*(chunk.column_ranges for chunk in chunks)))
+    file_stats.column_ranges = {column: _merge_ranges([chunk.column_ranges[column] for chunk in chunks if column in chunk.column_ranges]) for column in columns}
+    return file_stats
+
+def _overlaps(stats, vehicle, start, end, column_bounds):
+    if vehicle is not None and str(vehicle) not in stats.vehicles:
+        return False
+    if start is not None and (stats.time_max is None or pd.Timestamp(stats.time_max) < start):
+        return False
+    if end is not None and (stats.time_min is None or pd.Timestamp(stats.time_min) > end):
+        return False
+    for column, (low, high) in column_bounds.items():
+        column_min, column_max = stats.column_ranges.get(column, (None, None))
+        if column_min is None or (high is not None and column_min > high) or (low is not None and column_max < low):
+            return False
+    return True
+
+class FleetCatalog:
+    """Per-file and per-chunk statistics of a fleet folder, kept in the folder's CATALOG_FILE_NAME."""
+
+    def __init__(self, folder_path, files=None):
+        self.folder_path = folder_path
+        self.files: Dict[str, FileStats] = files or {}
+
+    @property
+    def path(self):
+        return os.path.join(self.folder_path, CATALOG_FILE_NAME)
+
+    @classmethod
+    def load(cls, folder_path):
+        catalog = cls(folder_path)
+        if os.path.exists(catalog.path):
+            with open(catalog.path, encoding='utf-8') as f:
+                for name, file_stats in json.load(f).items():
+                    chunks = [ChunkStats(**chunk) for chunk in file_stats.pop('chunks')]
+                    catalog.files[name] = FileStats(**file_stats, chunks=chunks)
+        return catalog
+
+    def save(self):
+        # written next to the catalog and renamed, a crash never leaves a half written catalog
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({name: asdict(file_stats) for name, file_stats in self.files.items()}, f)
+        os.replace(temp_path, self.path)
+
+    def update(self, chunk_rows=CATALOG_CHUNK_ROWS):
+        """Scans new and changed telemetry files, drops removed ones. Returns the names that changed."""
+        names = sorted(name for name in os.listdir(self.folder_path) if name.endswith(TELEMETRY_SUFFIXES))
+        changed = []
+        for name in names:
+            stat = os.stat(os.path.join(self.folder_path, name))
+            known = self.files.get(name)
+            if known is None or known.size != stat.st_size or known.mtime != stat.st_mtime:
+                self.files[name] = scan_file(os.path.join(self.folder_path, name), chunk_rows)
+                changed.append(name)
+        for name in set(self.files) - set(names):
+            del self.files[name]
+            changed.append(name)
+        return changed
+
+    def find_chunks(self, vehicle=None, start=None, end=None, column_bounds=None):
+        """(file name, chunk) pairs that may hold rows of the vehicle in start..end whose columns fall in
+        column_bounds ({column: (low, high)}, None for an open bound)."""
+        start, end = _to_utc(start), _to_utc(end, end_of_day=True)
+        column_bounds = column_bounds or {}
+        return [
+            (name, chunk)
+            for name, file_stats in self.files.items() if _overlaps(file_stats, vehicle, start, end, column_bounds)
+            for chunk in file_stats.chunks if _overlaps(chunk, vehicle, start, end, column_bounds)
+        ]
+
+    def _read_chunks(self, name, chunks):
+        path = os.path.join(self.folder_path, name)
+        if chunks[0].byte_start is None:
+            # compressed files are decompressed once, the rows of other chunks are dropped as they are parsed
+            wanted = np.concatenate([np.arange(chunk.row_start, chunk.row_start + chunk.rows) for chunk in chunks])
+            return read_telemetry_csv(path, row_filter=lambda parsed: np.isin(parsed.index, wanted))
+        with open(path, 'rb') as f:
+            header = f.readline()
+            parts = []
+            for chunk in chunks:
+                f.seek(chunk.byte_start)
+                parts.append(f.read(chunk.byte_end - chunk.byte_start))
+        return pd.read_csv(io.BytesIO(header + b''.join(parts)), low_memory=False)
+
+    def read(self, vehicle=None, start=None, end=None, column_bounds=None):
+        """Telemetry rows of the vehicle in start..end whose columns fall in column_bounds, reading only the
+        files and chunks that can match."""
+        matches = {}
+        for name, chunk in self.find_chunks(vehicle, start, end, column_bounds):
+            matches.setdefault(name, []).append(chunk)
+        frames = [self._read_chunks(name, chunks) for name, chunks in matches.items()]
+        if not frames:
+            return pd.DataFrame()
+
+        df = pd.concat(frames, ignore_index=True)
+        if vehicle is not None:
+            df = df[df[get_vehicle_column(df)].astype(str) == str(vehicle)]
+        if start is not None or end is not None:
+            times = pd.to_datetime(df[get_time_column(df)], utc=True, errors='coerce')
+            in_range = times.notna()
+            if start is not None:
+                in_range &= times >= _to_utc(start)
+            if end is not None:
+                in_range &= times <= _to_utc(end, end_of_day=True)
+            df = df[in_range]
+        # the chunk statistics only prune, rows of a matching chunk can still be out of bounds
+        for column, (low, high) in (column_bounds or {}).items():
+            values = pd.to_numeric(df[column], errors='coerce') if column in df.columns else pd.Series(np.nan, index=df.index)
+            in_bounds = values.notna()
+            if low is not None:
+                in_bounds &= values >= low
+            if high is not None:
+                in_bounds &= values <= high
+            df = df[in_bounds]
+        return df.reset_index(drop=True)
+
+def update_catalog(folder_path, chunk_rows=CATALOG_CHUNK_ROWS):
+    """Loads the folder's catalog, rescans new or changed files and saves it."""
+    catalog = FleetCatalog.load(folder_path)
+    if catalog.update(chunk_rows):
+        catalog.save()
+    return catalog
@@ -0,0 +1,178 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Fleet charts switch rendering tier by vehicle count: one bar/trace per vehicle up to
+# CHART_WEBGL_THRESHOLD, WebGL traces up to CHART_AGGREGATE_THRESHOLD, and binned or
+# percentile-band summaries above it so the chart payload no longer grows with the fleet.
+CHART_WEBGL_THRESHOLD = int(os.environ.get('CHART_WEBGL_THRESHOLD', 50))
+CHART_AGGREGATE_THRESHOLD = int(os.environ.get('CHART_AGGREGATE_THRESHOLD', 500))
+CHART_MAX_BINS = int(os.environ.get('CHART_MAX_BINS', 40))
+
+DETAILED, WEBGL, AGGREGATED = 'detailed', 'webgl', 'aggregated'
+
+FORECAST_KEYS = ['current_value', '1_months', '3_months', '6_months', '12_months']
+FORECAST_PERIODS = ["Current Value", "1 Months", "3 Months", "6 Months", "12 Months"]
+
+# SOH cohorts for the forecast fan chart, (lower bound inclusive, label)
+SOH_COHORTS = [(0, 'SOH < 70%'), (70, 'SOH 70-80%'), (80, 'SOH 80-90%'), (90, 'SOH ≥ 90%')]
+COHORT_COLORS = ['#d62728', '#ff7f0e', '#1f77b4', '#2ca02c']
+
+def get_render_tier(num_vehicles):
+    if num_vehicles <= CHART_WEBGL_THRESHOLD:
+        return DETAILED
+    if num_vehicles <= CHART_AGGREGATE_THRESHOLD:
+        return WEBGL
+    return AGGREGATED
+
+def _apply_dark_layout(fig, title, xaxis_title, yaxis_title):
+    fig.update_layout(
+        title=title,
+        xaxis_title=xaxis_title,
+        yaxis_title=yaxis_title,
+        paper_bgcolor='black',
+        plot_bgcolor='white',
+        font=dict(color='black'),
+        yaxis=dict(showgrid=False, zeroline=False)
+    )
+    return fig
+
+def plot_prices_webgl(all_vehicles_prices_df):
+    import plotly.graph_objects as go
+
+    # vehicles ranked by price as WebGL markers, no per-bar text labels
+    prices_df = all_vehicles_prices_df.sort_values(by='current_price', ascending=False)
+    fig = go.Figure(go.Scattergl(
+        x=np.arange(1, len(prices_df) + 1),
+        y=prices_df['current_price'],
+        mode='markers',
+        text=prices_df['vehicle_number'],
+        hovertemplate='Vehicle %{text}<br>%{y:,.0f} INR<extra></extra>',
+        marker=dict(color=prices_df['current_price'], colorscale='Viridis', showscale=True, size=6)
+    ))
+    return _apply_dark_layout(fig, 'Current Battery Prices of Vehicles', 'Vehicle Rank (by price)', 'Current Price (INR)')
+
+def plot_prices_binned(all_vehicles_prices_df):
+    import plotly.graph_objects as go
+
+    # histogram of current prices, payload is CHART_MAX_BINS bars whatever the fleet size
+    prices = all_vehicles_prices_df['current_price'].dropna().to_numpy(dtype=float)
+    counts, edges = np.histogram(prices, bins=CHART_MAX_BINS)
+    centers = (edges[:-1] + edges[1:]) / 2
+    fig = go.Figure(go.Bar(
+        x=centers,
+        y=counts,
+        width=np.diff(edges),
+        customdata=np.stack([edges[:-1], edges[1:]], axis=-1),
+        hovertemplate='%{customdata[0]:,.0f} - %{customdata[1]:,.0f} INR<br>%{y} vehicles<extra></extra>',
+        marker=dict(color=centers, colorscale='Viridis')
+    ))
+    return _apply_dark_layout(fig, f'Current Battery Price Distribution ({len(prices)} vehicles)', 'Current Price (INR)', 'No. of Vehicles')
+
+def plot_battery_health_webgl(vehicle_usage_df):
+    import plotly.graph_objects as go
+
+    vehicle_usage_df = vehicle_usage_df.sort_values(by='mean_soh', ascending=False)
+    rank = np.arange(1, len(vehicle_usage_df) + 1)
+    fig = go.Figure()
+    for column, name, color in [('mean_soh', 'Mean SOH', 'yellow'), ('final_capacity', 'Battery Capacity (Ah)', 'blue'), ('num_cycles', 'Number of Cycles', 'cyan')]:
+        fig.add_trace(go.Scattergl(
+            x=rank, y=vehicle_usage_df[column], name=name, mode='markers',
+            text=vehicle_usage_df['vehicle_number'],
+            hovertemplate='Vehicle %{text}<br>%{y}<extra>' + name + '</extra>',
+            marker=dict(color=color, size=5)
+        ))
+    fig.update_layout(
+        title='Battery Health Metrics Across Vehicles',
+        xaxis_title='Vehicle Rank (by SOH)',
+        yaxis_title='Value',
+        paper_bgcolor='black',
+        plot_bgcolor='black',
+        font=dict(color='white'),
+        legend=dict(font=dict(color='white'))
+    )
+    return fig
+
+def plot_battery_health_binned(vehicle_usage_df):
+    import plotly.graph_objects as go
+
+    # SOH bins with the mean capacity and cycle count of the vehicles falling in each bin
+    soh_bins = pd.cut(vehicle_usage_df['mean_soh'], bins=CHART_MAX_BINS)
+    grouped = vehicle_usage_df.groupby(soh_bins, observed=True).agg(
+        vehicles=('mean_soh', 'size'),
+        final_capacity=('final_capacity', 'mean'),
+        num_cycles=('num_cycles', 'mean')
+    ).reset_index()
+    bin_labels = [f"{interval.left:.1f}-{interval.right:.1f}" for interval in grouped['mean_soh']]
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=bin_labels, y=grouped['vehicles'], name='No. of Vehicles', marker_color='yellow', opacity=0.8))
+    fig.add_trace(go.Bar(x=bin_labels, y=grouped['final_capacity'].round(2), name='Mean Capacity (Ah)', marker_color='blue', opacity=0.8))
+    fig.add_trace(go.Scatter(
+        x=bin_labels, y=grouped['num_cycles'].round(0), name='Mean No. of Cycles',
+        mode='lines+markers', line=dict(color='cyan', width=2), marker=dict(size=6, symbol='circle')
+    ))
+    fig.update_layout(
+        title=f'Battery Health Metrics by SOH Band ({len(vehicle_usage_df)} vehicles)',
+        xaxis_title='Mean SOH Band (%)',
+        yaxis_title='Value',
+        barmode='group',
+        paper_bgcolor='black',
+        plot_bgcolor='black',
+        font=dict(color='white'),
+        legend=dict(font=dict(color='white'))
+    )
+    return fig
+
+def get_forecast_matrix(price_final_dicts):
+    # (vehicles x horizons) array, missing horizons forward-filled like plot_price_forecasting_values
+    forecast_df = pd.DataFrame([{key: price_final_dict.get(key) for key in FORECAST_KEYS} for price_final_dict in price_final_dicts], columns=FORECAST_KEYS)
+    return forecast_df.astype(float).ffill(axis=1).to_numpy()
+
+def plot_forecasts_webgl(vehicle_ids, forecast_matrix):
+    import plotly.graph_objects as go
+
+    # every vehicle in a single WebGL trace, lines separated by gaps instead of one trace per vehicle
+    n_periods = len(FORECAST_PERIODS)
+    x = np.tile(np.append(np.arange(n_periods, dtype=float), np.nan), len(vehicle_ids))
+    y = np.hstack([forecast_matrix, np.full((len(vehicle_ids), 1), np.nan)]).ravel()
+    text = np.repeat([str(vehicle_id) for vehicle_id in vehicle_ids], n_periods + 1)
+    fig = go.Figure(go.Scattergl(
+        x=x, y=y, text=text, mode='lines',
+        line=dict(width=1, color='rgba(99, 110, 250, 0.35)'),
+        hovertemplate='Vehicle %{text}<br>%{y:,.0f} INR<extra></extra>'
+    ))
+    fig.update_xaxes(tickmode='array', tickvals=list(range(n_periods)), ticktext=FORECAST_PERIODS)
+    return fig
+
+def plot_forecasts_fan(forecast_matrix, soh_values):
+    import plotly.graph_objects as go
+
+    # percentile bands per SOH cohort, payload is fixed by cohorts x horizons
+    soh_values = np.asarray(soh_values, dtype=float)
+    cohort_bounds = [lower for lower, _ in SOH_COHORTS[1:]]
+    cohort_index = np.digitize(soh_values, cohort_bounds)
+
+    fig = go.Figure()
+    for c, (_, label) in enumerate(SOH_COHORTS):
+        cohort_matrix = forecast_matrix[cohort_index == c]
+        if len(cohort_matrix) == 0:
+            continue
+        p10, p25, p50, p75, p90 = np.nanpercentile(cohort_matrix, [10, 25, 50, 75, 90], axis=0)
+        color = COHORT_COLORS[c]
+        for lower, upper, opacity in [(p10, p90, 0.15), (p25, p75, 0.3)]:
+            fig.add_trace(go.Scatter(x=FORECAST_PERIODS, y=upper, mode='lines', line=dict(width=0), legendgroup=label, showlegend=False, hoverinfo='skip'))
+            fig.add_trace(go.Scatter(
+                x=FORECAST_PERIODS, y=lower, mode='lines', line=dict(width=0), fill='tonexty',
+                fillcolor=_hex_to_rgba(color, opacity), legendgroup=label, showlegend=False, hoverinfo='skip'
+            ))
+        fig.add_trace(go.Scatter(
+            x=FORECAST_PERIODS, y=p50, mode='lines+markers', name=f"{label} ({len(cohort_matrix)} vehicles)",
+            legendgroup=label, line=dict(color=color, width=2),
+            hovertemplate='Median %{y:,.0f} INR<extra>' + label + '</extra>'
+        ))
+    return fig
+
+def _hex_to_rgba(hex_color, opacity):
+    r, g, b = (int(hex_color[i:i + 2], 16) for i in (1, 3, 5))
+    return f"rgba({r}, {g}, {b}, {opacity})"
@@ -0,0 +1,301 @@
+import json
+import operator
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import llm_client
+
+# "Ask the telemetry": the model translates a question into a small JSON aggregation query instead
+# of Python. The query is validated against the upload's columns, compiled to a plan of vectorized
+# filters and one groupby, and the plan is cached by the normalized question and the column set,
+# so repeated questions never reach the model.
+FLEET_QUERY_PLAN_CACHE_SIZE = int(os.environ.get('FLEET_QUERY_PLAN_CACHE_SIZE', 128))
+FLEET_QUERY_MAX_GENERATIONS = 2
+FLEET_QUERY_MAX_ROWS = 1000  # upper bound on "limit", results are meant to be read on the page
+FLEET_QUERY_TIME_KEY_UPLOADS = 4  # uploads whose derived time keys are kept
+
+FILTER_OPS = ('==', '!=', '<', '<=', '>', '>=', 'in', 'between', 'is_null', 'not_null')
+AGG_FUNCS = ('mean', 'median', 'sum', 'min', 'max', 'std', 'count', 'nunique')
+NUMERIC_FUNCS = ('mean', 'median', 'sum', 'std')
+# derived from the row timestamp, usable in filters and group_by like upload columns
+TIME_KEYS = ('day', 'hour', 'month')
+NUMERIC_TIME_KEYS = ('hour',)  # day and month are compared as YYYY-MM-DD / YYYY-MM strings
+# the Python operators, unlike the numpy ufuncs, also compare the string day / month keys on numpy < 1.25
+COMPARISON_OPS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+fleet_query_prompt = """
+You translate questions about EV battery telemetry into a JSON query. Reply with the JSON object only, in a ```json block.
+
+Telemetry columns (one row per reading): {columns}
+Derived keys: vehicle_number (the vehicle), day (YYYY-MM-DD), hour (0-23), month (YYYY-MM).
+Temperature excursions are readings with MAX_CELL_T above 40.
+
+Query format:
+{{
+  "filters": [{{"column": "<column or key>", "op": "<one of {ops}>", "value": <number, string, [low, high] for between, list for in>}}],
+  "group_by": ["<column or key>", ...],
+  "aggregations": [{{"column": "<column, or * for count>", "func": "<one of {funcs}>", "as": "<result name>"}}],
+  "order_by": [{{"column": "<result name or group_by key>", "descending": true}}],
+  "limit": <number of rows>
+}}
+"filters", "group_by", "order_by" and "limit" are optional, "aggregations" needs at least one entry.
+
+Example - "Which 3 vehicles have the lowest average SOH?":
+```json
+{{"group_by": ["vehicle_number"], "aggregations": [{{"column": "SOH", "func": "mean", "as": "mean_soh"}}],
+ "order_by": [{{"column": "mean_soh", "descending": false}}], "limit": 3}}
+```
+
+Question: {question}
+"""
+
+class FleetQueryError(ValueError):
+    """Raised when a generated query does not fit the query format or the upload's columns."""
+
+@dataclass
+class QueryPlan:
+    filters: List[Tuple[str, str, object]]
+    group_by: List[str]
+    aggregations: List[Tuple[str, str, str]]  # (output name, column, func)
+    order_by: List[Tuple[str, bool]] = field(default_factory=list)
+    limit: Optional[int] = None
+    spec: Dict = field(default_factory=dict)  # the validated query, for display
+
+def normalize_question(question):
+    return ' '.join(re.sub(r'[^\w\s.<>=-]', ' ', question.lower()).split())
+
+def get_vehicle_column(columns):
+    return 'Topic' if 'Topic' in columns else 'vehicle_number'
+
+def describe_columns(columns):
+    # CELL<n>_<quantity> columns listed once per quantity, there are dozens of them
+    cells = {}
+    described = []
+    for column in columns:
+        match = re.match(r'^CELL(\d+)_(\w+)$', column)
+        if match:
+            cells.setdefault(match.group(2), []).append(int(match.group(1)))
+        elif column != get_vehicle_column(columns):
+            described.append(column)
+    described += [f"CELL<n>_{quantity} (n={min(numbers)}..{max(numbers)})" for quantity, numbers in cells.items()]
+    return ', '.join(described)
+
+def compile_query(spec, columns, numeric_columns):
+    """Validates a JSON query against the upload's columns and returns its QueryPlan, raises FleetQueryError."""
+    numeric_columns = set(numeric_columns) | set(NUMERIC_TIME_KEYS)
+    if not isinstance(spec, dict):
+        raise FleetQueryError("the query is not a JSON object")
+    unknown = set(spec) - {'filters', 'group_by', 'aggregations', 'order_by', 'limit'}
+    if unknown:
+        raise FleetQueryError(f"unknown query fields {sorted(unknown)}")
+
+    for part in ('filters', 'group_by', 'aggregations', 'order_by'):
+        if not isinstance(spec.get(part) or [], list):
+            raise FleetQueryError(f"{part} must be a list")
+    for part in ('filters', 'aggregations', 'order_by'):
+        if not all(isinstance(entry, dict) for entry in spec.get(part) or []):
+            raise FleetQueryError(f"every entry of {part} must be an object")
+
+    # column names are matched case-insensitively, models tend to write "soh" for SOH
+    vehicle_column = get_vehicle_column(columns)
+    names = {column.lower(): column for column in columns if column != vehicle_column}
+    names.update({key: key for key in TIME_KEYS}, vehicle_number='vehicle_number', topic='vehicle_number')
+
+    def resolve(name, allow_star=False):
+        if allow_star and name == '*':
+            return name
+        if not isinstance(name, str) or name.lower() not in names:
+            raise FleetQueryError(f"unknown column {name!r}")
+        return names[name.lower()]
+
+    filters = []
+    for condition in spec.get('filters') or []:
+        column, op, value = resolve(condition.get('column')), condition.get('op'), condition.get('value')
+        if op not in FILTER_OPS:
+            raise FleetQueryError(f"unsupported filter op {op!r}")
+        if op == 'between' and not (isinstance(value, list) and len(value) == 2):
+            raise FleetQueryError("between needs a [low, high] value")
+        if op == 'in' and not isinstance(value, list):
+            raise FleetQueryError("in needs a list value")
+        if column in numeric_columns and op not in ('is_null', 'not_null'):
+            try:
+                value = [float(v) for v in value] if isinstance(value, list) else float(value)
+            except (TypeError, ValueError):
+                raise FleetQueryError(f"{column} is numeric, {value!r} is not a number")
+        filters.append((column, op, value))
+
+    group_by = [resolve(column) for column in spec.get('group_by') or []]
+
+    aggregations = []
+    for aggregation in spec.get('aggregations') or []:
+        column, func = resolve(aggregation.get('column'), allow_star=True), aggregation.get('func')
+        if func not in AGG_FUNCS:
+            raise FleetQueryError(f"unsupported aggregation {func!r}")
+        if column == '*' and func != 'count':
+            raise FleetQueryError(f"{func} needs a column, * only works with count")
+        if func in NUMERIC_FUNCS and column not in numeric_columns:
+            raise FleetQueryError(f"{func} needs a numeric column, {column} is not")
+        output = str(aggregation.get('as') or f"{func}_{column}".replace('*', 'rows'))
+        aggregations.append((output, column, func))
+    if not aggregations:
+        raise FleetQueryError("the query has no aggregations")
+    outputs = [output for output, _, _ in aggregations]
+    if len(set(outputs + group_by)) != len(outputs) + len(group_by):
+        raise FleetQueryError("result names are not unique")
+
+    order_by = []
+    for order in spec.get('order_by') or []:
+        column = order.get('column')
+        if column not in outputs + group_by:
+            raise FleetQueryError(f"cannot order by {column!r}, it is not a result column")
+        order_by.append((column, bool(order.get('descending', False))))
+
+    limit = spec.get('limit')
+    if limit is not None:
+        if not isinstance(limit, int) or limit < 1:
+            raise FleetQueryError("limit must be a positive integer")
+        limit = min(limit, FLEET_QUERY_MAX_ROWS)
+
+    return QueryPlan(filters, group_by, aggregations, order_by, limit, spec)
+
+_time_keys = OrderedDict()  # upload fingerprint -> {key: array}, derived once per upload
+_time_keys_lock = threading.Lock()
+
+def _get_time_keys(df, upload_fingerprint):
+    with _time_keys_lock:
+        if upload_fingerprint is not None and upload_fingerprint in _time_keys:
+            _time_keys.move_to_end(upload_fingerprint)
+            return _time_keys[upload_fingerprint]
+
+    times = pd.to_datetime(df['createdAt' if 'createdAt' in df.columns else 'deviceTime'], utc=True, errors='coerce')
+    instants = times.dt.tz_localize(None).to_numpy('datetime64[ns]')
+    time_keys = {
+        'day': np.datetime_as_string(instants.astype('datetime64[D]')),
+        'hour': times.dt.hour.to_numpy(),
+        'month': np.datetime_as_string(instants.astype('datetime64[M]')),
+    }
+    if upload_fingerprint is not None:
+        with _time_keys_lock:
+            _time_keys[upload_fingerprint] = time_keys
+            while len(_time_keys) > FLEET_QUERY_TIME_KEY_UPLOADS:
+                _time_keys.popitem(last=False)
+    return time_keys
+
+def _get_values(df, column, upload_fingerprint):
+    if column == 'vehicle_number':
+        return df[get_vehicle_column(df.columns)].to_numpy()
+    if column in TIME_KEYS:
+        return _get_time_keys(df, upload_fingerprint)[column]
+    return df[column].to_numpy()
+
+def _condition_mask(values, op, value):
+    if op == 'is_null':
+        return pd.isna(values)
+    if op == 'not_null':
+        return ~pd.isna(values)
+    if op == 'in':
+        return np.isin(values, value)
+    if op == 'between':
+        return (values >= value[0]) & (values <= value[1])
+    with np.errstate(invalid='ignore'):
+        return COMPARISON_OPS[op](values, value)
+
+def execute_plan(plan, df, upload_fingerprint=None):
+    """Result dataframe of a plan over the upload, vectorized filters and a single groupby."""
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, value in plan.filters:
+        try:
+            mask &= np.asarray(_condition_mask(_get_values(df, column, upload_fingerprint), op, value), dtype=bool)
+        except TypeError:
+            raise FleetQueryError(f"cannot compare {column} with {value!r}")
+
+    # only the columns the plan touches, already filtered
+    needed = set(plan.group_by) | {column for _, column, _ in plan.aggregations if column != '*'}
+    frame = pd.DataFrame({column: _get_values(df, column, upload_fingerprint)[mask] for column in needed}, index=np.flatnonzero(mask))
+    # count(*) counts a column that is never null
+    frame['*'] = 1
+    aggregations = {output: (column, func) for output, column, func in plan.aggregations}
+
+    if plan.group_by:
+        result = frame.groupby(plan.group_by, sort=True, dropna=False).agg(**aggregations).reset_index()
+    else:
+        result = pd.DataFrame({output: [frame[column].agg(func)] for output, (column, func) in aggregations.items()})
+    if plan.order_by:
+        result = result.sort_values([column for column, _ in plan.order_by], ascending=[not descending for _, descending in plan.order_by])
+    if plan.limit is not None:
+        result = result.head(plan.limit)
+    return result.reset_index(drop=True)
+
+def extract_query_json(text):
+    match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", text, re.DOTALL) or re.search(r"(\{.*\})", text, re.DOTALL)
+    if not match:
+        raise FleetQueryError("the response has no JSON object")
+    try:
+        return json.loads(match.group(1))
+    except json.JSONDecodeError as e:
+        raise FleetQueryError(f"the JSON does not parse: {e}")
+
+class QueryPlanCache:
+    """LRU of compiled plans keyed by (normalized question, column set)."""
+
+    def __init__(self, max_entries=FLEET_QUERY_PLAN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is None:
+                self.misses += 1
+                return None
+            self._plans.move_to_end(key)
+            self.hits += 1
+            return plan
+
+    def put(self, key, plan):
+        with self._lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+
+_plan_cache = QueryPlanCache()
+
+def get_plan_cache():
+    return _plan_cache
+
+def generate_query_plan(question, df):
+    columns = list(df.columns)
+    numeric_columns = {column for column in columns if pd.api.types.is_numeric_dtype(df[column])}
+    prompt = fleet_query_prompt.format(columns=describe_columns(columns), ops=', '.join(FILTER_OPS), funcs=', '.join(AGG_FUNCS), question=question)
+    reason = ''
+    for attempt in range(FLEET_QUERY_MAX_GENERATIONS):
+        response = llm_client.generate(prompt=prompt, prompt_type='fleet_query')
+        try:
+            plan = compile_query(extract_query_json(response['response']), columns, numeric_columns)
+        except FleetQueryError as e:
+            llm_client.record_output_quality('fleet_query', False)
+            reason = str(e)
+            prompt = f"{prompt}\n\nA previous query was rejected: {reason}. Fix this in the new query."
+            continue
+        llm_client.record_output_quality('fleet_query', True)
+        return plan
+    raise FleetQueryError(f"No valid query for the question: {reason}")
+
+def ask_fleet(question, df, upload_fingerprint=None):
+    """(result dataframe, plan) for a natural language question over the upload, raises FleetQueryError."""
+    key = (normalize_question(question), hash(tuple(df.columns)))
+    plan = _plan_cache.get(key)
+    if plan is None:
+        plan = generate_query_plan(question, df)
+        _plan_cache.put(key, plan)
+    return execute_plan(plan, df, upload_fingerprint), plan
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import llm_client
+
+# Job runner threads orchestrate a stage (one per submitted job), model workers run
+# the individual LLM calls. Both pools are shared by every session in the process.
+JOB_MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', 4))
+MODEL_MAX_WORKERS = int(os.environ.get('MODEL_MAX_WORKERS', 5))
+JOB_MAX_RETAINED = int(os.environ.get('JOB_MAX_RETAINED', 32))  # finished jobs kept for polling
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2.0))  # secs between page refreshes
+JOB_ABANDON_TIMEOUT = float(os.environ.get('JOB_ABANDON_TIMEOUT', 30.0))  # secs without a poll before an opt-in job is cancelled
+
+PENDING, RUNNING, DONE, FAILED, CANCELLED = 'pending', 'running', 'done', 'failed', 'cancelled'
+
+@dataclass
+class Job:
+    job_id: str
+    key: tuple
+    total: int = 0
+    status: str = PENDING
+    completed: int = 0
+    partial_results: List[Any] = field(default_factory=list)
+    result: Any = None
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    abandon_after: Optional[float] = None  # cancel once no page has polled the job for this long
+    last_polled_at: float = field(default_factory=time.time)
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def is_finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def is_abandoned(self):
+        return self.abandon_after is not None and time.time() - self.last_polled_at > self.abandon_after
+
+    def touch(self):
+        # called by every page render that shows this job, acts as its heartbeat
+        self.last_polled_at = time.time()
+
+    def progress(self):
+        if self.status == DONE:
+            return 1.0
+        return min(self.completed / self.total, 1.0) if self.total else 0.0
+
+    def add_partial_result(self, item):
+        # list.append is atomic, readers only ever take a snapshot copy
+        self.partial_results.append(item)
+        self.completed += 1
+
+    def snapshot_partial_results(self):
+        return list(self.partial_results)
+
+class JobQueue:
+    def __init__(self, job_max_workers=JOB_MAX_WORKERS, model_max_workers=MODEL_MAX_WORKERS, max_retained=JOB_MAX_RETAINED):
+        self._job_executor = ThreadPoolExecutor(max_workers=job_max_workers, thread_name_prefix='job-runner')
+        self.model_executor = ThreadPoolExecutor(max_workers=model_max_workers, thread_name_prefix='model-worker')
+        self._max_retained = max_retained
+        self._lock = threading.Lock()
+        self._jobs_by_id: Dict[str, Job] = {}
+        self._jobs_by_key: Dict[tuple, Job] = {}
+
+    def submit(self, key, fn: Callable, *args, total=0, abandon_after=None, rerun=False, **kwargs) -> Job:
+        """Submit fn(job, *args, **kwargs) once per key; resubmitting a live or finished key returns the existing job.
+
+        rerun=True replaces a finished job of the key with a new run, a live one is still returned."""
+        with self._lock:
+            job = self._jobs_by_key.get(key)
+            if job is not None and job.status not in (FAILED, CANCELLED) and not (rerun and job.is_finished):
+                return job
+
+            job = Job(job_id=uuid.uuid4().hex, key=key, total=total, abandon_after=abandon_after)
+            self._jobs_by_id[job.job_id] = job
+            self._jobs_by_key[key] = job
+            self._evict_finished_jobs()
+
+        self._job_executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.is_cancelled or job.is_abandoned():
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            return
+
+        job.status = RUNNING
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = CANCELLED if job.is_cancelled else DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+            print(f"Error: {e}")
+        finally:
+            job.finished_at = time.time()
+
+    def map_items(self, job, fn: Callable, items, indices=None):
+        """Run fn over items on the shared model workers, recording each result on the job as it completes.
+
+        Returns (index, result) pairs in completion order, indices default to the item positions. On
+        cancellation, or once an opt-in job is abandoned, items not yet started are dropped and the
+        results so far are returned."""
+        indices = range(len(items)) if indices is None else indices
+
+        def run_item(item):
+            # model calls of a cancelled job are abandoned while they are still queued for the model server
+            with llm_client.cancel_on(job.cancel_event):
+                return fn(item)
+
+        futures = {self.model_executor.submit(run_item, item): i for i, item in zip(indices, items)}
+        results = []
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error: {e}")
+                    result = None
+                results.append((futures[future], result))
+                job.add_partial_result((futures[future], result))
+
+            if job.is_abandoned():
+                job.cancel_event.set()
+            if job.is_cancelled:
+                for future in pending:
+                    future.cancel()
+                break
+        return results
+
+    def get(self, job_id) -> Optional[Job]:
+        return self._jobs_by_id.get(job_id)
+
+    def get_by_key(self, key) -> Optional[Job]:
+        return self._jobs_by_key.get(key)
+
+    def cancel(self, key):
+        job = self._jobs_by_key.get(key)
+        if job is not None and not job.is_finished:
+            job.cancel_event.set()
+
+    def _evict_finished_jobs(self):
+        finished = sorted((job for job in self._jobs_by_id.values() if job.is_finished), key=lambda job: job.finished_at)
+        for job in finished[:max(len(finished) - self._max_retained, 0)]:
+            del self._jobs_by_id[job.job_id]
+            if self._jobs_by_key.get(job.key) is job:
+                del self._jobs_by_key[job.key]
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue() -> JobQueue:
+    # one queue per process, shared by every Streamlit session and rerun
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
@@ -0,0 +1,412 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from model_endpoints import LLMUnavailableError, get_endpoint_pool, is_timeout_error
+from model_routes import get_model_route, route_stats
+
+# Every ollama.generate call in the app goes through generate() below. Identical
+# in-flight prompts (same model + rendered prompt) are coalesced into a single
+# generation whose result is handed to every waiter, and each generation has to be
+# admitted by the process-wide AdmissionController before it is routed to one of the
+# model endpoints. The model, generation options and latency budget come from the
+# route of the call's prompt type (model_routes.py). A circuit breaker fails calls fast
+# while the model server keeps failing, serving the last response to the same prompt (or
+# the caller's surrogate) when there is one, and callers can abandon a call cooperatively
+# with cancel_checkpoint().
+
+# Priority classes, lower value is served first. PREFETCH is speculative work, e.g. the reutilisation
+# prefetcher, it never delays a request someone is waiting on
+INTERACTIVE, REUTILISATION, FLEET_BATCH, NEWS, PREFETCH = 0, 1, 2, 3, 4
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', REUTILISATION: 'reutilisation', FLEET_BATCH: 'fleet_batch', NEWS: 'news', PREFETCH: 'prefetch'}
+
+# Priority used when the caller didn't set one with llm_priority()
+PROMPT_TYPE_PRIORITY = {
+    'report_table': INTERACTIVE,
+    'agg_code': INTERACTIVE,
+    'fleet_query': INTERACTIVE,
+    'reutilisation': REUTILISATION,
+    'price_analysis': FLEET_BATCH,
+    'market_news': NEWS,
+}
+
+LLM_MAX_CONCURRENT = int(os.environ.get('LLM_MAX_CONCURRENT', 4))  # generations in flight per process
+LLM_INTERACTIVE_RESERVED = int(os.environ.get('LLM_INTERACTIVE_RESERVED', 1))  # slots only interactive calls may use
+# requests allowed to wait per class before new ones are shed
+LLM_MAX_QUEUE_DEPTH = {INTERACTIVE: 32, REUTILISATION: 8, FLEET_BATCH: 64, NEWS: 1, PREFETCH: 1}
+# secs a request may be deferred waiting for a slot before it is shed, None waits indefinitely
+LLM_ADMISSION_TIMEOUT = {INTERACTIVE: None, REUTILISATION: 300, FLEET_BATCH: 900, NEWS: 120, PREFETCH: None}
+
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('LLM_BREAKER_FAILURE_THRESHOLD', 5))  # consecutive failures that open the circuit
+LLM_BREAKER_RESET_TIMEOUT = float(os.environ.get('LLM_BREAKER_RESET_TIMEOUT', 30.0))  # secs open before a probe call is let through
+LLM_RESPONSE_CACHE_SIZE = 256  # last responses kept to serve while the model server is unavailable
+LLM_CHECKPOINT_INTERVAL = 0.5  # secs between cancellation checkpoints of a waiting caller
+
+class LLMOverloadedError(Exception):
+    """Raised when a request is shed by admission control instead of being sent to the model server."""
+
+class LLMCancelledError(Exception):
+    """Raised when the caller cancelled the request before it was sent to the model server."""
+
+class _Ticket:
+    __slots__ = ('priority', 'seq', 'cancelled')
+
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.seq = seq
+        self.cancelled = False
+
+    def sort_key(self):
+        return (self.priority, self.seq)
+
+class AdmissionController:
+    def __init__(self, max_concurrent=LLM_MAX_CONCURRENT, interactive_reserved=LLM_INTERACTIVE_RESERVED,
+                 max_queue_depth=LLM_MAX_QUEUE_DEPTH, admission_timeout=LLM_ADMISSION_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.interactive_reserved = min(interactive_reserved, max_concurrent - 1)
+        self.max_queue_depth = max_queue_depth
+        self.admission_timeout = admission_timeout
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting = []  # tickets, served in (priority, arrival) order
+        self._active = Counter()  # priority -> generations in flight
+        self.stats = Counter()
+
+    def new_ticket(self, priority):
+        return _Ticket(priority, next(self._seq))
+
+    def _limit(self, priority):
+        return self.max_concurrent if priority == INTERACTIVE else self.max_concurrent - self.interactive_reserved
+
+    def _can_start(self, ticket):
+        head = min(self._waiting, key=_Ticket.sort_key)
+        return head is ticket and sum(self._active.values()) < self._limit(ticket.priority)
+
+    @contextmanager
+    def admit(self, ticket):
+        priority = ticket.priority
+        name = PRIORITY_NAMES[priority]
+        with self._cond:
+            if sum(1 for waiting in self._waiting if waiting.priority == priority) >= self.max_queue_depth[priority]:
+                self.stats[f'{name}.shed'] += 1
+                raise LLMOverloadedError(f"Model server queue full for {name} requests")
+
+            self._waiting.append(ticket)
+            admitted = self._cond.wait_for(lambda: ticket.cancelled or self._can_start(ticket), self.admission_timeout[ticket.priority])
+            self._waiting.remove(ticket)
+            if ticket.cancelled:
+                self.stats[f'{name}.cancelled'] += 1
+                self._cond.notify_all()
+                raise LLMCancelledError(f"{name} request cancelled while queued")
+            if not admitted:
+                self.stats[f'{name}.shed'] += 1
+                self._cond.notify_all()
+                raise LLMOverloadedError(f"Timed out waiting for the model server ({name} request)")
+
+            # the ticket may have been boosted while queued, account it under its final class
+            priority = ticket.priority
+            self._active[priority] += 1
+            self.stats[f'{PRIORITY_NAMES[priority]}.admitted'] += 1
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[priority] -= 1
+                self._cond.notify_all()
+
+    def cancel(self, ticket):
+        # withdraws the ticket if it is still queued, a generation already admitted runs to completion
+        with self._cond:
+            ticket.cancelled = True
+            self._cond.notify_all()
+
+    def boost(self, ticket, priority):
+        # a higher priority caller joined a coalesced request that is still queued
+        with self._cond:
+            if priority < ticket.priority:
+                ticket.priority = priority
+                self._cond.notify_all()
+
+    def wait_for_idle(self, priority, timeout=None):
+        """Block until nothing of this priority is queued or in flight; returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._active[priority] and not any(ticket.priority == priority for ticket in self._waiting), timeout
+            )
+
+    def snapshot(self):
+        with self._cond:
+            stats = dict(self.stats)
+            for priority, name in PRIORITY_NAMES.items():
+                stats[f'{name}.active'] = self._active[priority]
+                stats[f'{name}.waiting'] = sum(1 for ticket in self._waiting if ticket.priority == priority)
+            return stats
+
+class CircuitBreaker:
+    """Closed -> open after consecutive model server failures -> half-open after the reset timeout, where a
+    single probe call decides between closing again and another open period."""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURE_THRESHOLD, reset_timeout=LLM_BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+        self.stats = Counter()
+
+    def check(self):
+        """Fail fast before queueing, raises LLMUnavailableError while the circuit is open."""
+        with self._lock:
+            if self.state == self.OPEN and time.time() - self.opened_at < self.reset_timeout:
+                self.stats['rejected'] += 1
+                raise LLMUnavailableError(f"Model server unavailable, retrying in {self._retry_in():.0f}s")
+
+    def allow(self):
+        """Raises LLMUnavailableError unless a call may be sent to the model server now."""
+        with self._lock:
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self._probing):
+                self._probing = self.state == self.HALF_OPEN
+                return
+            self.stats['rejected'] += 1
+            raise LLMUnavailableError(f"Model server unavailable, retrying in {self._retry_in():.0f}s")
+
+    def _retry_in(self):
+        return max(self.reset_timeout - (time.time() - self.opened_at), 0) if self.opened_at else 0
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.stats['opened'] += 1
+                self.state = self.OPEN
+                self.opened_at = time.time()
+            self._probing = False
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, state=self.state, consecutive_failures=self.consecutive_failures)
+
+class _InFlightCall:
+    def __init__(self, context=None):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.context = context
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = Counter()
+
+    def do(self, key, fn, stat_name='default', context=None, on_join=None):
+        """Run fn once per key at a time; context is kept on the leader's call and handed to on_join for each waiter."""
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _InFlightCall(context)
+                self.stats[f'{stat_name}.executed'] += 1
+            else:
+                call.waiters += 1
+                self.stats[f'{stat_name}.coalesced'] += 1
+
+        if not is_leader:
+            if on_join is not None:
+                on_join(call.context)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def is_sole_caller(self, key, context):
+        # True while the call for key is the one started with context and nobody joined it
+        with self._lock:
+            call = self._calls.get(key)
+            return call is not None and call.context is context and not call.waiters
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+_single_flight = SingleFlight()
+_admission = AdmissionController()
+_breaker = CircuitBreaker()
+_recent_responses = OrderedDict()  # request key -> last response, served while the model server is unavailable
+_recent_responses_lock = threading.Lock()
+_fallback_stats = Counter()
+# callers with a cancellation checkpoint wait here instead of blocking in the request themselves
+_call_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='llm-call')
+_call_context = threading.local()
+
+@contextmanager
+def llm_priority(priority):
+    """Run the calls made in this block (on this thread) under the given priority class."""
+    previous = getattr(_call_context, 'priority', None)
+    _call_context.priority = priority
+    try:
+        yield
+    finally:
+        _call_context.priority = previous
+
+def interactive():
+    return llm_priority(INTERACTIVE)
+
+@contextmanager
+def cancel_checkpoint(checkpoint):
+    """Calls made in this block (on this thread) run checkpoint() while they wait, it abandons the call by raising.
+
+    A queued request that nobody else joined is withdrawn, one already sent runs out its latency budget."""
+    previous = getattr(_call_context, 'checkpoint', None)
+    _call_context.checkpoint = checkpoint
+    try:
+        yield
+    finally:
+        _call_context.checkpoint = previous
+
+def checkpoint():
+    """Run this thread's cancellation checkpoint, for callers fanning model calls out to other threads."""
+    thread_checkpoint = getattr(_call_context, 'checkpoint', None)
+    if thread_checkpoint is not None:
+        thread_checkpoint()
+
+def cancel_on(event):
+    """cancel_checkpoint() raising LLMCancelledError once the threading.Event is set."""
+    def checkpoint():
+        if event.is_set():
+            raise LLMCancelledError("Request cancelled")
+    return cancel_checkpoint(checkpoint)
+
+def get_call_priority(prompt_type):
+    priority = getattr(_call_context, 'priority', None)
+    return priority if priority is not None else PROMPT_TYPE_PRIORITY.get(prompt_type, FLEET_BATCH)
+
+def wait_for_interactive_idle(timeout=None):
+    """Block until no interactive generation is queued or in flight; returns False on timeout."""
+    return _admission.wait_for_idle(INTERACTIVE, timeout)
+
+def get_prompt_hash(model, prompt):
+    return hashlib.sha256(f"{model}\0{prompt}".encode('utf-8')).hexdigest()
+
+def _remember_response(key, response):
+    with _recent_responses_lock:
+        _recent_responses[key] = response
+        _recent_responses.move_to_end(key)
+        while len(_recent_responses) > LLM_RESPONSE_CACHE_SIZE:
+            _recent_responses.popitem(last=False)
+
+def _get_recent_response(key):
+    with _recent_responses_lock:
+        return _recent_responses.get(key)
+
+def generate(prompt, prompt_type='default', model=None, fallback=None, seed=None):
+    """Drop-in for ollama.generate; concurrent identical requests share one generation.
+
+    The model defaults to the prompt type's route, a seed makes it an independent sample of the same prompt. When the model server fails or the circuit
+    breaker is open, the last response to the same request is served, else fallback() (a surrogate
+    response text) when given. Raises LLMUnavailableError while the circuit is open, LLMOverloadedError
+    when the request is shed by admission control, LLMCancelledError when abandoned through
+    cancel_checkpoint(), and the endpoint's timeout error once the route's latency budget is spent."""
+    route = get_model_route(prompt_type)
+    model = model or route.model
+    options = route.options()
+    if seed is not None:
+        options['seed'] = seed
+    key = get_prompt_hash(model, f"{sorted(options.items())}\0{prompt}")
+    ticket = _admission.new_ticket(get_call_priority(prompt_type))
+    checkpoint = getattr(_call_context, 'checkpoint', None)
+
+    def run():
+        with _admission.admit(ticket):
+            _breaker.allow()
+            start_time = time.time()
+            try:
+                response = get_endpoint_pool().generate(model=model, prompt=prompt, options=options, timeout=route.latency_budget)
+            except Exception as e:
+                _breaker.record_failure()
+                route_stats.record_call(prompt_type, time.time() - start_time, error=True, budget_exceeded=is_timeout_error(e))
+                raise
+            _breaker.record_success()
+            route_stats.record_call(prompt_type, time.time() - start_time)
+            _remember_response(key, response)
+            return response
+
+    def call():
+        _breaker.check()
+        return _single_flight.do(
+            key, run, stat_name=prompt_type, context=ticket,
+            on_join=lambda leader_ticket: _admission.boost(leader_ticket, ticket.priority)
+        )
+
+    future = None
+    if checkpoint is not None:
+        checkpoint()
+        future = _call_executor.submit(call)
+        # the checkpoint may raise (e.g. the session reran), the request is withdrawn unless others joined it
+        while not wait([future], timeout=LLM_CHECKPOINT_INTERVAL).done:
+            try:
+                checkpoint()
+            except BaseException:
+                if _single_flight.is_sole_caller(key, ticket):
+                    _admission.cancel(ticket)
+                raise
+
+    try:
+        return call() if future is None else future.result()
+    except (LLMOverloadedError, LLMCancelledError):
+        raise
+    except Exception:
+        response = _get_recent_response(key)
+        if response is not None:
+            _fallback_stats[f'{prompt_type}.served_cached'] += 1
+            return response
+        if fallback is None:
+            raise
+        _fallback_stats[f'{prompt_type}.served_surrogate'] += 1
+        return {'model': model, 'response': fallback(), 'done': True, 'surrogate': True}
+
+def record_output_quality(prompt_type, parsed_ok):
+    # call sites report whether the generated output could be parsed, tracked per route
+    route_stats.record_quality(prompt_type, parsed_ok)
+
+def get_llm_stats():
+    # e.g. {'price_analysis.executed': 12, 'price_analysis.coalesced': 7, 'fleet_batch.shed': 3, 'in_flight': 2}
+    stats = dict(_single_flight.stats)
+    stats.update(_admission.snapshot())
+    stats.update(_fallback_stats)
+    stats['in_flight'] = _single_flight.in_flight()
+    stats['circuit_breaker'] = _breaker.snapshot()
+    stats['endpoints'] = get_endpoint_pool().snapshot()
+    stats['routes'] = route_stats.snapshot()
+    return stats
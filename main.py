@@ -1,14 +1,20 @@
 import pandas as pd 
-import ollama
+import llm_client
 import streamlit as st
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import plotly.colors as pc
 import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
 from electra_battery_usage_market_prompt import *
 from csv_analyzer import *
+from telemetry_reader import read_telemetry_csv, TELEMETRY_FILE_TYPES
+from usage_records import get_usage_records
 from battery_reutilisation_gen import * 
+from fleet_charts import get_render_tier, DETAILED
+from market_news_cache import get_market_news_cache, format_news_age
+from reutil_prefetch import get_reutil_prefetcher
+from price_sampling import sample_price_analysis, PRICE_SAMPLES_MIN, PRICE_SAMPLES_MAX
+from fleet_query import ask_fleet, FleetQueryError
+from job_queue import get_job_queue, DONE, FAILED, CANCELLED, JOB_POLL_INTERVAL, JOB_ABANDON_TIMEOUT
+import time
 
 st.set_page_config(
     page_title="Battery LLM Pricing Indicator",
@@ -18,15 +24,35 @@ st.set_page_config(
 
 st.title('💸 Battery Pricing Estimation')
 
-@st.cache_data
-def load_csv(uploaded_file):
-    return pd.read_csv(uploaded_file) if uploaded_file is not None else None
+def rerun_cancellable():
+    # model calls made by this script run are abandoned when the session reruns: updating the
+    # placeholder is a Streamlit checkpoint, which raises once a rerun has been requested
+    placeholder = st.empty()
+    return llm_client.cancel_checkpoint(placeholder.empty)
 
-@st.cache_data
-def get_cached_vehicle_usage_df(df):
-    return get_vehicle_usage_df(df, generate_agg_fields_prompt)
+# the upload frame and its summary are shared read-only across reruns and sessions, cache_data would
+# unpickle a fresh copy of them on every rerun (every poll while a job runs)
+@st.cache_resource(max_entries=CACHE_MAX_ENTRIES)
+def load_csv(_uploaded_file, upload_fingerprint):
+    # .zip / .gz / .zst uploads are decompressed as a stream into the chunked parser
+    return read_telemetry_csv(_uploaded_file, _uploaded_file.name) if _uploaded_file is not None else None
+
+@st.cache_resource(max_entries=CACHE_MAX_ENTRIES)
+def get_cached_vehicle_usage_df(_df, upload_fingerprint):
+    return get_vehicle_usage_df(_df, generate_agg_fields_prompt, upload_fingerprint)
+
+# Background jobs rendered on this run, the page polls until they finish
+active_jobs = []
+
+def watch_job(job):
+    # heartbeat the job so opt-in jobs get cancelled once nobody is looking at them any more
+    job.touch()
+    active_jobs.append(job)
+    return job
 
 # Initialize session state
+if 'forecast_job_key' not in st.session_state:
+    st.session_state.forecast_job_key = None
 if 'selected_vehicle' not in st.session_state:
     st.session_state.selected_vehicle = None    
 if 'parameters' not in st.session_state:
@@ -36,6 +62,25 @@ if 'vehicle_params' not in st.session_state:
 if 'price_analysis_report' not in st.session_state:
     st.session_state.price_analysis_report = None
 
+# Button outputs are kept in session state and drawn on every run, the job polling reruns would
+# otherwise clear them right after the click
+if 'show_market_news' not in st.session_state:
+    st.session_state.show_market_news = False
+if 'battery_health_key' not in st.session_state:
+    st.session_state.battery_health_key = None
+if 'reutil_result' not in st.session_state:
+    st.session_state.reutil_result = None  # ((upload fingerprint, vehicle), usage data, products df)
+if 'price_report_key' not in st.session_state:
+    st.session_state.price_report_key = None  # (upload fingerprint, vehicle) of the detailed report
+if 'price_report_values' not in st.session_state:
+    st.session_state.price_report_values = None
+if 'price_report_table' not in st.session_state:
+    st.session_state.price_report_table = None
+if 'fleet_answer' not in st.session_state:
+    st.session_state.fleet_answer = None  # ((upload fingerprint, question), result df, query spec, error)
+if 'reutil_prefetch_key' not in st.session_state:
+    st.session_state.reutil_prefetch_key = None  # (upload fingerprint, pricing job, vehicle) last prefetched
+
 # Initialize session state for dataframes processed    
 if "vehicle_usage_df" not in st.session_state:
     st.session_state.vehicle_usage_df = None
@@ -57,10 +102,16 @@ if 'battery_reutil_fig' not in st.session_state:
 col1, col2 = st.columns((1.5, 2), gap='medium')
 
 with col1:
-    uploaded_file = st.file_uploader("Upload a CSV file", type=["csv"], label_visibility='collapsed')
+    uploaded_file = st.file_uploader("Upload a CSV file", type=TELEMETRY_FILE_TYPES, label_visibility='collapsed')
     
     if uploaded_file is not None:
-        df = load_csv(uploaded_file)
+        upload_fingerprint = get_session_upload_fingerprint(uploaded_file)
+        try:
+            df = load_csv(uploaded_file, upload_fingerprint)
+        except ValueError as e:
+            # empty file, zip without a CSV, .zst without zstandard installed
+            st.error(f"Could not read {uploaded_file.name}: {e}")
+            st.stop()
         df.rename(columns={'Topic':'vehicle_number'})
 
 with col2: 
@@ -69,93 +120,160 @@ with col2:
         st.write(f"No. of vehicles in the source data: {len(vehicles_list)}")
 
         st.markdown("*Estimated time to run ~ 30-40 secs*")
-        vehicle_usage_df = get_cached_vehicle_usage_df(df) 
+        vehicle_usage_df = get_cached_vehicle_usage_df(df, upload_fingerprint)
         st.session_state.vehicle_usage_df = vehicle_usage_df
 
-    if st.button("Get Battery Pricing Market Trends & Latest Updates", icon="💹", use_container_width=True):
-        st.write("Gathering Battery Price News & Updates....", divider="green")
-        latest_market_news_report = latest_market_news_headlines()
-        st.write(latest_market_news_report)
+        with st.expander("Usage Summary by Date Range"):
+            usage_index = get_cached_usage_index(df, upload_fingerprint)
+            first_day, last_day = usage_index.get_day_range()
+            date_range = st.date_input("Trip days", (first_day, last_day), min_value=first_day, max_value=last_day)
+            # the picker returns a single date while the range is being selected
+            if len(date_range) == 2:
+                st.dataframe(usage_index.summaries(*date_range), hide_index=True, use_container_width=True)
+
+        with st.expander("Ask the Telemetry"):
+            # the question becomes a validated JSON query, repeated questions reuse the cached plan. It is
+            # only asked on submit, the answer (or error) is kept so polling reruns never reach the model
+            with st.form("ask_fleet_form"):
+                question = st.text_input("Question", placeholder="Which 3 vehicles have the lowest average SOH?")
+                ask_question = st.form_submit_button("Ask")
+            fleet_answer_key = (upload_fingerprint, question)
+            if ask_question and question:
+                query_result_df, query_spec, query_error = None, None, None
+                try:
+                    with llm_client.interactive(), rerun_cancellable():
+                        query_result_df, query_plan = ask_fleet(question, df, upload_fingerprint)
+                    query_spec = query_plan.spec
+                except FleetQueryError as e:
+                    query_error = str(e)
+                except (llm_client.LLMUnavailableError, llm_client.LLMOverloadedError, llm_client.LLMCancelledError) as e:
+                    query_error = f"The model server could not answer the question: {e}"
+                except Exception as e:
+                    # the route's latency budget ran out, the rerun that abandons the call is not an Exception
+                    if not llm_client.is_timeout_error(e):
+                        raise
+                    query_error = "The model server took too long to answer, please try again shortly."
+                st.session_state.fleet_answer = (fleet_answer_key, query_result_df, query_spec, query_error)
+
+            if st.session_state.fleet_answer and st.session_state.fleet_answer[0] == fleet_answer_key:
+                _, query_result_df, query_spec, query_error = st.session_state.fleet_answer
+                if query_error:
+                    st.error(query_error)
+                else:
+                    st.dataframe(query_result_df, hide_index=True, use_container_width=True)
+                    st.json(query_spec, expanded=False)
+
+    # headlines come from a shared cache kept fresh in the background, clicks never wait on the model
+    market_news_cache = get_market_news_cache()
+    news_col1, news_col2 = st.columns((4, 1))
+    show_market_news = news_col1.button("Get Battery Pricing Market Trends & Latest Updates", icon="💹", use_container_width=True)
+    force_refresh_news = news_col2.button("Force Refresh", icon="🔄", use_container_width=True)
+
+    if show_market_news or force_refresh_news:
+        st.session_state.show_market_news = True
+        if force_refresh_news or market_news_cache.report is None:
+            with st.spinner("Gathering Battery Price News & Updates...."):
+                market_news_cache.refresh(wait=True)
+
+    if st.session_state.show_market_news:
+        if market_news_cache.report:
+            if market_news_cache.is_stale():
+                market_news_cache.refresh()
+            st.caption(f"Updated {format_news_age(market_news_cache.age())}" + (" (stale, refresh in progress)" if market_news_cache.is_stale() else ""))
+            st.write(market_news_cache.report)
+        else:
+            st.warning(f"Market news not available yet: {market_news_cache.last_error or 'refresh in progress'}")
 
 st.subheader("Battery Price Comparison Across Vehicles", divider="blue")
 col1, col2 = st.columns((2, 2), gap='medium')
 
 with col1: 
+    all_vehicles_prices_df = None
     if uploaded_file and not vehicle_usage_df.empty:
         # if st.button("Show Pricing Comparison Across Vehicles", icon="🚙", use_container_width=True):
-        st.markdown("*Estimated time to run ~ 2-3 mins*")
-        all_vehicles_prices_fig, all_vehicles_prices_df = plot_prices_all_vehicles(vehicle_usage_df)
-        st.session_state.pricing_comparison_fig = all_vehicles_prices_fig
+        # priced once per upload in the background, every rerun renders whatever is ready so far
+        # vehicles already in the upload's pricing journal are not priced again, so a rerun only prices the missing ones
+        retry_pricing = st.session_state.pop('retry_fleet_pricing', False)
+        pricing_job = get_job_queue().submit(
+            (upload_fingerprint, 'fleet_pricing'), run_fleet_pricing_job, vehicle_usage_df, upload_fingerprint,
+            total=len(vehicle_usage_df), rerun=retry_pricing
+        )
+        watch_job(pricing_job)
+
+        if pricing_job.status == DONE:
+            all_vehicles_prices_df = pricing_job.result
+            prices_df = all_vehicles_prices_df
+            unpriced = len(vehicle_usage_df) - len(all_vehicles_prices_df)
+            if unpriced:
+                st.warning(f"{unpriced} vehicles could not be priced")
+                if st.button("Retry Unpriced Vehicles", icon="🔁", use_container_width=True):
+                    st.session_state.retry_fleet_pricing = True
+                    st.rerun()
+        else:
+            st.markdown("*Estimated time to run ~ 2-3 mins*")
+            st.progress(pricing_job.progress(), text=f"Priced {pricing_job.completed} of {pricing_job.total} vehicles")
+            prices_df = get_prices_df_from_results(pricing_job.snapshot_partial_results())
+            if pricing_job.status == FAILED:
+                st.error(f"Fleet pricing failed: {pricing_job.error}")
+
+        # rendering tier follows the fleet size, not the vehicles priced so far
+        fleet_render_tier = get_render_tier(len(vehicle_usage_df))
+        st.session_state.pricing_comparison_fig = plot_all_vehicles_prices_df(prices_df, fleet_render_tier) if not prices_df.empty else None
         st.session_state.all_vehicles_prices_df = all_vehicles_prices_df
     
         if st.session_state.pricing_comparison_fig:
             st.plotly_chart(st.session_state.pricing_comparison_fig, use_container_width=True)
+
+        if fleet_render_tier != DETAILED and not prices_df.empty:
+            drill_down_vehicles = st.multiselect("Drill down into vehicles", list(prices_df['vehicle_number']), key='prices_drill_down')
+            if drill_down_vehicles:
+                drill_down_df = prices_df[prices_df['vehicle_number'].isin(drill_down_vehicles)]
+                st.plotly_chart(plot_all_vehicles_prices_df(drill_down_df, render_tier=DETAILED), use_container_width=True)
             
         if st.button("Battery Health Behavior Across Vehicles", icon="🔋", use_container_width=True):
-            st.session_state.battery_health_fig = plot_battery_health_across_vehicles(vehicle_usage_df)
-        
-            if st.session_state.battery_health_fig:
-                st.plotly_chart(st.session_state.battery_health_fig, use_container_width=True)
+            st.session_state.battery_health_fig = get_cached_battery_health_fig(vehicle_usage_df, upload_fingerprint)
+            st.session_state.battery_health_key = upload_fingerprint
+
+        if st.session_state.battery_health_key == upload_fingerprint and st.session_state.battery_health_fig:
+            st.plotly_chart(st.session_state.battery_health_fig, use_container_width=True)
 
 with col2: 
-    def process_vehicle_forecast(i):
-        """Function to process each vehicle separately."""
-        usage_data = vehicle_usage_df['vehicle_summary'][i]
-        vehicle_id = vehicle_usage_df['vehicle_number'][i]
-    
-        price_analysis_report = get_price_analysis_report(usage_data)
-        price_final_dict = get_price_values(price_analysis_report)
-        fig = plot_price_forecasting_values(price_final_dict, vehicle_id)
-        return fig, vehicle_id
-    
     if uploaded_file and not vehicle_usage_df.empty:
+        num_vehicles = len(vehicle_usage_df)
+        forecast_job_key = (upload_fingerprint, 'fleet_forecast', num_vehicles)
+
         if st.button("Forecasting Behavior Across Vehicles", icon="📉", use_container_width=True):
-            st.markdown("*Estimated time to run ~ 5 mins*")
-        
-            num_vehicles = min(5, len(vehicle_usage_df))
-        
-            @st.cache_data
-            def get_combined_forecasting_chart():
-                with ThreadPoolExecutor() as executor:
-                    results = list(executor.map(process_vehicle_forecast, range(num_vehicles)))
-                
-                figures, vehicle_ids = zip(*results)  # Unpack figures and vehicle IDs
-                
-                viridis_colors = pc.sequential.Plasma_r  # Get Viridis colors
-                color_map = {i: viridis_colors[i % len(viridis_colors)] for i in range(num_vehicles)}
-        
-                combined_fig = go.Figure()
-        
-                for i, (fig, vehicle_id) in enumerate(zip(figures, vehicle_ids)):
-                    for trace in fig['data']:
-                        trace.name = f"Vehicle {vehicle_id}"  # Use actual vehicle ID
-                        trace.line.color = color_map[i]  # Assign Viridis color
-                        combined_fig.add_trace(trace)
-        
-                combined_fig.update_layout(
-                    # template="plotly_dark",  # Optional: Use dark theme
-                    title="Battery Price Forecasting Across Vehicles",
-                    xaxis_title="Time Period",
-                    yaxis_title="Forecasted Value (INR)",
-                    legend_title="Vehicles",
-                    height=600,
-                    paper_bgcolor="black",  # Set entire background to white
-                    plot_bgcolor="white",  # Set the plot area background to white
-                    font=dict(color="black"),  # Ensure text is visible
-                    yaxis=dict(
-                        showgrid=False, 
-                        # gridcolor="lightgrey",  # Light grey gridlines
-                        zeroline=True
-                    )
-                )
-        
-                return combined_fig
-        
-            st.session_state.forecasting_behavior_fig = get_combined_forecasting_chart()
+            # the whole fleet is forecast, the job is cancelled once no session polls it (user navigated away)
+            get_job_queue().submit(
+                forecast_job_key, run_fleet_forecast_job, vehicle_usage_df, num_vehicles,
+                total=num_vehicles, abandon_after=JOB_ABANDON_TIMEOUT
+            )
+            st.session_state.forecast_job_key = forecast_job_key
+
+        # keep rendering the submitted forecast on later reruns, adding traces as vehicles complete
+        forecast_job = get_job_queue().get_by_key(forecast_job_key) if st.session_state.forecast_job_key == forecast_job_key else None
+        if forecast_job:
+            watch_job(forecast_job)
+            if forecast_job.status == DONE:
+                st.session_state.forecasting_behavior_fig = forecast_job.result
+            else:
+                st.progress(forecast_job.progress(), text=f"Forecasted {forecast_job.completed} of {forecast_job.total} vehicles")
+                st.session_state.forecasting_behavior_fig = combine_forecasting_figures(forecast_job.snapshot_partial_results(), vehicle_usage_df)
+                if forecast_job.status == CANCELLED:
+                    st.session_state.forecast_job_key = None
+                elif st.button("Stop Forecasting", icon="⏹️", use_container_width=True):
+                    get_job_queue().cancel(forecast_job_key)
         
             if st.session_state.forecasting_behavior_fig:
                 st.plotly_chart(st.session_state.forecasting_behavior_fig, use_container_width=True)
 
+            if get_render_tier(num_vehicles) != DETAILED:
+                forecast_results = [(i, result) for i, result in forecast_job.snapshot_partial_results() if result]
+                drill_down_vehicles = st.multiselect("Drill down into vehicles", [vehicle_id for _, (_, vehicle_id) in forecast_results], key='forecast_drill_down')
+                if drill_down_vehicles:
+                    drill_down_results = [(i, result) for i, result in forecast_results if result[1] in drill_down_vehicles]
+                    st.plotly_chart(combine_forecasting_figures(drill_down_results, vehicle_usage_df, render_tier=DETAILED), use_container_width=True)
+
 
 st.write("\n")
 st.write("\n")
@@ -164,7 +282,7 @@ col1, col2, col3 = st.columns((0.5, 2, 0.5), gap='small')
 
 with col1: 
     # Show dropdown only if vehicles exist
-    if uploaded_file and not all_vehicles_prices_df.empty:
+    if uploaded_file and all_vehicles_prices_df is not None and not all_vehicles_prices_df.empty:
         selected_vehicle = st.selectbox(
             "Vehicle List", 
             list(vehicle_usage_df['vehicle_number'].unique()),
@@ -177,18 +295,30 @@ with col1:
         st.sidebar.title("Battery Usage Dynamic Pricing Simulator")
         if selected_vehicle:
             st.session_state.selected_vehicle = selected_vehicle
-            vehicle_params = vehicle_usage_df[vehicle_usage_df['vehicle_number'] == selected_vehicle].iloc[0].to_dict()
+            vehicle_params = dict(get_usage_records(vehicle_usage_df[vehicle_usage_df['vehicle_number'] == selected_vehicle])[0])
             vehicle_params.pop('vehicle_number', None) 
-            vehicle_params.pop('vehicle_summary')
             #sidebar values filling 
             st.session_state.vehicle_params = vehicle_params  # Store in session state
             st.session_state.parameters = vehicle_params.copy()  # Default values for sidebar
+
+        # speculatively generate reutilisation options in idle model time, selected vehicle first, queued
+        # once per price result and selected vehicle rather than on every poll
+        reutil_prefetch_key = (upload_fingerprint, pricing_job.job_id, selected_vehicle)
+        if st.session_state.reutil_prefetch_key != reutil_prefetch_key:
+            get_reutil_prefetcher().prefetch(all_vehicles_prices_df.to_dict(orient="records"), selected_vehicle)
+            st.session_state.reutil_prefetch_key = reutil_prefetch_key
         
     else:
         st.session_state.selected_vehicle = None  # Ensure it is reset
 
     usage_data = {}
     for key, value in st.session_state.parameters.items():
+        if isinstance(value, list):
+            # cell features like the weakest cells list are shown but not editable, they are priced as stored
+            st.sidebar.caption(f"{key.replace('_', ' ').title()}: {', '.join(map(str, value))}")
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue  # missing values have nothing to edit, the report states them as unknown
         usage_data[key] = st.sidebar.number_input(
             key.replace('_', ' ').title(), 
             value=value,
@@ -207,6 +337,8 @@ with col1:
         st.session_state.vehicle_params = {}
         st.session_state.parameters = {}
         st.session_state.price_analysis_report = None
+        st.session_state.price_report_key = None
+        st.session_state.reutil_result = None
         st.rerun()
 
 
@@ -225,39 +357,74 @@ with col2:
 
         st.write("\n")
         st.write("\n")
+        vehicle_result_key = (upload_fingerprint, vehicle_id)
     
         if st.button("See Recommended Battery Reutilisation Options", icon="♻️", use_container_width=True):
-            st.markdown("*Estimated time to run ~ 30 secs*")
             if vehicle_agg_filter_df is not None:
                 #store the values in dict format for the selected vehicle
                 usage_data2 = vehicle_agg_filter_df.to_dict(orient="records")[0]
-            
-                #run the prompt and display the products reutilised in the streamlit UI
-                display_all_reutil_prods(usage_data2)
+
+                #served instantly when already prefetched, otherwise generated now
+                reutil_prefetcher = get_reutil_prefetcher()
+                if reutil_prefetcher.get(usage_data2) is None:
+                    st.markdown("*Estimated time to run ~ 30 secs*")
+                with rerun_cancellable():
+                    prod_df = reutil_prefetcher.get_or_generate(usage_data2)
+                st.session_state.reutil_result = (vehicle_result_key, usage_data2, prod_df)
+
+        #display the products reutilised in the streamlit UI
+        if st.session_state.reutil_result and st.session_state.reutil_result[0] == vehicle_result_key:
+            _, usage_data2, prod_df = st.session_state.reutil_result
+            if prod_df is not None:
+                display_all_reutil_prods(usage_data2, prod_df)
+            else:
+                st.write("products reutil report not found!")
                 
         # st.subheader("Vehicle Usage Parameters", divider="orange")
         # st.json(st.session_state.vehicle_params)
         
         # Prevent error by checking if a vehicle is selected
+        sample_confidence_band = st.checkbox(
+            "Empirical confidence band", value=False,
+            help=f"Prices the vehicle {PRICE_SAMPLES_MIN}-{PRICE_SAMPLES_MAX} times and shows the spread of the estimates"
+        )
         if st.session_state.selected_vehicle and st.button("Get Detailed Dynamic Price Info for Selected Vehicle", icon="💰", use_container_width=True):
             st.markdown("*GenAI is running & Calculating the Estimate..*")
             st.markdown("*Estimated time to run ~ 30-40 secs*")
             
-            price_analysis_report = get_price_analysis_report(usage_data)
+            sampled_price_values = None
+            with llm_client.interactive(), rerun_cancellable():
+                if sample_confidence_band:
+                    # the full summary with the sidebar edits, cell features and missing values included
+                    sampled_price_values, price_analysis_report = sample_price_analysis(st.session_state.vehicle_params)
+                else:
+                    price_analysis_report = get_price_analysis_report(st.session_state.vehicle_params)
             st.session_state.price_analysis_report = price_analysis_report  # Store in session state
-            
-            #display the detailed report and forecasting chart for selected vehicle 
-            if st.session_state.price_analysis_report:
-                # st.subheader(f"💰 Price Forecasting", divider="green")
-        
-                vehicle_id = st.session_state.selected_vehicle
-                price_final_dict = get_price_values(st.session_state.price_analysis_report)
-                single_forecasting_fig = plot_price_forecasting_values(price_final_dict, vehicle_id)
-                st.plotly_chart(single_forecasting_fig, use_container_width=True)
-                
-                st.subheader("👩🏻‍💻 Price Analysis Full Report", divider="blue")
-                price_summary_response = ollama.generate(
-                    model='mistral', 
-                    prompt=f"Present this report in a better tabular form: {st.session_state.price_analysis_report}"
-                )
-                st.write(price_summary_response['response']) 
+            st.session_state.price_report_key = vehicle_result_key
+            st.session_state.price_report_values = None
+            st.session_state.price_report_table = None
+            if not price_analysis_report:
+                st.error("The model server is unavailable right now, please try again shortly.")
+            else:
+                st.session_state.price_report_values = sampled_price_values or get_price_values(price_analysis_report)
+                with llm_client.interactive(), rerun_cancellable():
+                    # the untabulated report stands in when the model server is unavailable
+                    price_summary_response = llm_client.generate(
+                        prompt=f"Present this report in a better tabular form: {price_analysis_report}",
+                        prompt_type='report_table', fallback=lambda: price_analysis_report
+                    )
+                st.session_state.price_report_table = price_summary_response['response']
+
+        #display the detailed report and forecasting chart for selected vehicle 
+        if st.session_state.price_report_key == vehicle_result_key and st.session_state.price_report_table:
+            # st.subheader(f"💰 Price Forecasting", divider="green")
+            single_forecasting_fig = plot_price_forecasting_values(st.session_state.price_report_values, vehicle_id)
+            st.plotly_chart(single_forecasting_fig, use_container_width=True)
+
+            st.subheader("👩🏻‍💻 Price Analysis Full Report", divider="blue")
+            st.write(st.session_state.price_report_table)
+
+# Poll background jobs by rerunning the page until every job shown above has finished
+if any(not job.is_finished for job in active_jobs):
+    time.sleep(JOB_POLL_INTERVAL)
+    st.rerun()
@@ -1,13 +1,12 @@
 import pandas as pd 
-import ollama
+import llm_client
 import streamlit as st
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import plotly.colors as pc
 import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
 from electra_battery_usage_market_prompt import *
 from csv_analyzer import *
+from telemetry_reader import read_telemetry_csv, TELEMETRY_FILE_TYPES
+from usage_records import get_usage_records
 
 st.set_page_config(
     page_title="Battery LLM Pricing Indicator Dev",
@@ -17,13 +16,16 @@ st.set_page_config(
 
 st.title('💸 Battery Pricing Estimation Dev')
 
-@st.cache_data
-def load_csv(uploaded_file):
-    return pd.read_csv(uploaded_file) if uploaded_file is not None else None
+# the upload frame and its summary are shared read-only across reruns and sessions, cache_data would
+# unpickle a fresh copy of them on every rerun (every poll while a job runs)
+@st.cache_resource(max_entries=CACHE_MAX_ENTRIES)
+def load_csv(_uploaded_file, upload_fingerprint):
+    # .zip / .gz / .zst uploads are decompressed as a stream into the chunked parser
+    return read_telemetry_csv(_uploaded_file, _uploaded_file.name) if _uploaded_file is not None else None
 
-@st.cache_data
-def get_cached_vehicle_usage_df(df):
-    return get_vehicle_usage_df(df, generate_agg_fields_prompt)
+@st.cache_resource(max_entries=CACHE_MAX_ENTRIES)
+def get_cached_vehicle_usage_df(_df, upload_fingerprint):
+    return get_vehicle_usage_df(_df, generate_agg_fields_prompt, upload_fingerprint)
 
 # Initialize session state
 if 'selected_vehicle' not in st.session_state:
@@ -46,15 +48,21 @@ if 'battery_health_fig' not in st.session_state:
 col1, col2 = st.columns((1.5, 2), gap='large')
 
 with col1:
-    uploaded_file = st.file_uploader("Upload a CSV file", type=["csv"], label_visibility='collapsed')
+    uploaded_file = st.file_uploader("Upload a CSV file", type=TELEMETRY_FILE_TYPES, label_visibility='collapsed')
     
     if uploaded_file is not None:
-        df = load_csv(uploaded_file)
+        upload_fingerprint = get_session_upload_fingerprint(uploaded_file)
+        try:
+            df = load_csv(uploaded_file, upload_fingerprint)
+        except ValueError as e:
+            # empty file, zip without a CSV, .zst without zstandard installed
+            st.error(f"Could not read {uploaded_file.name}: {e}")
+            st.stop()
         vehicles_list = list(df['Topic' if 'Topic' in df.columns else 'vehicle_number'].unique())
         st.write(f"No. of vehicles in the source data: {len(vehicles_list)}")
 
         st.markdown("*Estimated time to run ~ 30-40 secs*")
-        vehicle_usage_df = get_cached_vehicle_usage_df(df)    
+        vehicle_usage_df = get_cached_vehicle_usage_df(df, upload_fingerprint)
     
         # Show dropdown only if vehicles exist
         if vehicles_list:
@@ -68,9 +76,8 @@ with col1:
                         
             if selected_vehicle:
                 st.session_state.selected_vehicle = selected_vehicle
-                vehicle_params = vehicle_usage_df[vehicle_usage_df['vehicle_number'] == selected_vehicle].iloc[0].to_dict()
+                vehicle_params = dict(get_usage_records(vehicle_usage_df[vehicle_usage_df['vehicle_number'] == selected_vehicle])[0])
                 vehicle_params.pop('vehicle_number', None) 
-                vehicle_params.pop('vehicle_summary')
                 st.session_state.vehicle_params = vehicle_params  # Store in session state
                 st.session_state.parameters = vehicle_params.copy()  # Default values for sidebar
                 
@@ -82,6 +89,12 @@ with col1:
         
         usage_data = {}
         for key, value in st.session_state.parameters.items():
+            if isinstance(value, list):
+                # cell features like the weakest cells list are shown but not editable, they are priced as stored
+                st.sidebar.caption(f"{key.replace('_', ' ').title()}: {', '.join(map(str, value))}")
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue  # missing values have nothing to edit, the report states them as unknown
             usage_data[key] = st.sidebar.number_input(
                 key.replace('_', ' ').title(), 
                 value=value,
@@ -110,7 +123,7 @@ with col1:
             st.markdown("*GenAI is running & Calculating the Estimate..*")
             st.markdown("*Estimated time to run ~ 30-40 secs*")
             
-            price_analysis_report = get_price_analysis_report(usage_data)
+            price_analysis_report = get_price_analysis_report(st.session_state.vehicle_params)
             st.session_state.price_analysis_report = price_analysis_report  # Store in session state
             
             #display the detailed report and forecasting chart for selected vehicle 
@@ -123,15 +136,15 @@ with col1:
                 # st.plotly_chart(fig, use_container_width=True)
                 
                 st.subheader("👩🏻‍💻 Price Analysis Full Report", divider="blue")
-                price_summary_response = ollama.generate(
-                    model='mistral', 
-                    prompt=f"Present this report in a better tabular form: {st.session_state.price_analysis_report}"
+                price_summary_response = llm_client.generate(
+                    prompt=f"Present this report in a better tabular form: {st.session_state.price_analysis_report}",
+                    prompt_type='report_table'
                 )
                 st.write(price_summary_response['response'])
 
     if uploaded_file and not vehicle_usage_df.empty:
         if st.button("Battery Health Behavior Across Vehicles", icon="🔋", use_container_width=True):
-            st.session_state.battery_health_fig = plot_battery_health_across_vehicles(vehicle_usage_df)
+            st.session_state.battery_health_fig = get_cached_battery_health_fig(vehicle_usage_df, upload_fingerprint)
         
             if st.session_state.battery_health_fig:
                 st.plotly_chart(st.session_state.battery_health_fig, use_container_width=True)
@@ -142,24 +155,14 @@ with col1:
         st.write(latest_market_news_report)
 
 
-def process_vehicle_forecast(i):
-    """Function to process each vehicle separately."""
-    usage_data = vehicle_usage_df['vehicle_summary'][i]
-    vehicle_id = vehicle_usage_df['vehicle_number'][i]
-
-    price_analysis_report = get_price_analysis_report(usage_data)
-    price_final_dict = get_price_values(price_analysis_report)
-    fig = plot_price_forecasting_values(price_final_dict, vehicle_id)
-    return fig, vehicle_id
-        
 with col2:    
     st.subheader("Battery Price Comparison Across Vehicles", divider="blue")
     
     if uploaded_file and not vehicle_usage_df.empty:
         # if st.button("Show Pricing Comparison Across Vehicles", icon="🚙", use_container_width=True):
         st.markdown("*Estimated time to run ~ 2-3 mins*")
-        all_vehicles_prices_fig = plot_prices_all_vehicles(vehicle_usage_df)
-        st.session_state.pricing_comparison_fig = plot_prices_all_vehicles(vehicle_usage_df)
+        all_vehicles_prices_fig, all_vehicles_prices_df = plot_prices_all_vehicles(vehicle_usage_df, upload_fingerprint)
+        st.session_state.pricing_comparison_fig = all_vehicles_prices_fig
 
         if st.session_state.pricing_comparison_fig:
             st.plotly_chart(st.session_state.pricing_comparison_fig, use_container_width=True)
@@ -169,44 +172,7 @@ with col2:
         
             num_vehicles = min(5, len(vehicle_usage_df))
         
-            @st.cache_data
-            def get_combined_forecasting_chart():
-                with ThreadPoolExecutor() as executor:
-                    results = list(executor.map(process_vehicle_forecast, range(num_vehicles)))
-                
-                figures, vehicle_ids = zip(*results)  # Unpack figures and vehicle IDs
-                
-                viridis_colors = pc.sequential.Plasma_r  # Get Viridis colors
-                color_map = {i: viridis_colors[i % len(viridis_colors)] for i in range(num_vehicles)}
-        
-                combined_fig = go.Figure()
-        
-                for i, (fig, vehicle_id) in enumerate(zip(figures, vehicle_ids)):
-                    for trace in fig['data']:
-                        trace.name = f"Vehicle {vehicle_id}"  # Use actual vehicle ID
-                        trace.line.color = color_map[i]  # Assign Viridis color
-                        combined_fig.add_trace(trace)
-        
-                combined_fig.update_layout(
-                    # template="plotly_dark",  # Optional: Use dark theme
-                    title="Battery Price Forecasting Across Vehicles",
-                    xaxis_title="Time Period",
-                    yaxis_title="Forecasted Value (INR)",
-                    legend_title="Vehicles",
-                    height=600,
-                    paper_bgcolor="black",  # Set entire background to white
-                    plot_bgcolor="white",  # Set the plot area background to white
-                    font=dict(color="black"),  # Ensure text is visible
-                    yaxis=dict(
-                        showgrid=False, 
-                        # gridcolor="lightgrey",  # Light grey gridlines
-                        zeroline=True
-                    )
-                )
-        
-                return combined_fig
-        
-            st.session_state.forecasting_behavior_fig = get_combined_forecasting_chart()
+            st.session_state.forecasting_behavior_fig = get_cached_combined_forecasting_chart(vehicle_usage_df, upload_fingerprint, num_vehicles)
         
             if st.session_state.forecasting_behavior_fig:
                 st.plotly_chart(st.session_state.forecasting_behavior_fig, use_container_width=True)
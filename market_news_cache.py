@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+
+from electra_battery_usage_market_prompt import latest_market_news_headlines
+
+# The market news prompt is static, so headlines are generated by a background refresher
+# into one process-wide cache and every session is served the cached copy.
+MARKET_NEWS_TTL = float(os.environ.get('MARKET_NEWS_TTL', 6 * 60 * 60))  # secs before headlines count as stale
+MARKET_NEWS_REFRESH_AHEAD = 0.8  # refresh once this fraction of the TTL has elapsed
+MARKET_NEWS_RETRY_INTERVAL = 60.0  # secs before retrying a failed refresh
+
+class MarketNewsCache:
+    def __init__(self, fetch_fn=latest_market_news_headlines, ttl=MARKET_NEWS_TTL):
+        self._fetch_fn = fetch_fn
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refresh_done = threading.Event()
+        self._refreshing = False
+        self._scheduler = None
+        self.report = None
+        self.refreshed_at = None
+        self.last_error = None
+
+    def age(self):
+        return time.time() - self.refreshed_at if self.refreshed_at else None
+
+    def is_stale(self):
+        return self.refreshed_at is None or self.age() > self.ttl
+
+    def refresh(self, wait=False, timeout=None):
+        """Start a refresh unless one is already running; optionally block until it finishes."""
+        with self._lock:
+            if not self._refreshing:
+                self._refreshing = True
+                self._refresh_done.clear()
+                threading.Thread(target=self._refresh, name='market-news-refresh', daemon=True).start()
+        if wait:
+            self._refresh_done.wait(timeout)
+        return self.report
+
+    def _refresh(self):
+        try:
+            report = self._fetch_fn()
+            if report:
+                # keep serving the previous headlines if the model server returned nothing
+                self.report = report
+                self.refreshed_at = time.time()
+                self.last_error = None
+            else:
+                self.last_error = "No headlines returned by the model"
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Error: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+            self._refresh_done.set()
+
+    def start_scheduler(self):
+        with self._lock:
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(target=self._schedule, name='market-news-scheduler', daemon=True)
+                self._scheduler.start()
+
+    def _schedule(self):
+        while True:
+            age = self.age()
+            if age is None or age >= self.ttl * MARKET_NEWS_REFRESH_AHEAD:
+                self.refresh(wait=True)
+            age = self.age()
+            if age is None:
+                sleep_for = MARKET_NEWS_RETRY_INTERVAL
+            else:
+                sleep_for = max(self.ttl * MARKET_NEWS_REFRESH_AHEAD - age, MARKET_NEWS_RETRY_INTERVAL)
+            time.sleep(sleep_for)
+
+_market_news_cache = None
+_market_news_cache_lock = threading.Lock()
+
+def get_market_news_cache() -> MarketNewsCache:
+    # one cache per process; the scheduler starts with the first session that asks for it
+    global _market_news_cache
+    with _market_news_cache_lock:
+        if _market_news_cache is None:
+            _market_news_cache = MarketNewsCache()
+            _market_news_cache.start_scheduler()
+        return _market_news_cache
+
+def format_news_age(age_secs):
+    if age_secs is None:
+        return "never"
+    if age_secs < 60:
+        return "just now"
+    if age_secs < 3600:
+        return f"{int(age_secs // 60)} min ago"
+    return f"{age_secs / 3600:.1f} hrs ago"
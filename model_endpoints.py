@@ -0,0 +1,212 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Pool of Ollama endpoints (several local `ollama serve` instances or nodes). Requests go to
+# the healthy endpoint with the fewest outstanding requests; optionally a request still
+# running past the endpoint's latency percentile is hedged to a second endpoint and the
+# first response wins.
+#   OLLAMA_HOSTS=http://127.0.0.1:11434,http://127.0.0.1:11435
+OLLAMA_HOSTS = [host.strip() for host in os.environ.get('OLLAMA_HOSTS', os.environ.get('OLLAMA_HOST', 'http://127.0.0.1:11434')).split(',') if host.strip()]
+OLLAMA_HEALTH_CHECK_INTERVAL = float(os.environ.get('OLLAMA_HEALTH_CHECK_INTERVAL', 15.0))  # secs
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get('OLLAMA_CONNECT_TIMEOUT', 5.0))  # secs to open a connection, a down server fails fast
+OLLAMA_READ_TIMEOUT = float(os.environ.get('OLLAMA_READ_TIMEOUT', 300.0))  # secs without a response when the route sets no budget
+OLLAMA_MAX_CONSECUTIVE_FAILURES = 3  # failed requests before an endpoint is taken out of rotation
+# hedge after this latency percentile of the endpoint (e.g. 95), unset disables hedging
+OLLAMA_HEDGE_PERCENTILE = float(os.environ['OLLAMA_HEDGE_PERCENTILE']) if os.environ.get('OLLAMA_HEDGE_PERCENTILE') else None
+OLLAMA_HEDGE_MIN_SAMPLES = 20  # latencies recorded before an endpoint's percentile is trusted
+
+class LLMUnavailableError(Exception):
+    """Raised without calling the model server: the circuit breaker is open or no endpoint is available."""
+
+# ollama and httpx (pydantic models included) are imported when the first endpoint is created, not
+# at app start up
+
+def is_timeout_error(error):
+    import httpx
+
+    return isinstance(error, httpx.TimeoutException)
+
+def get_client_timeout(read_timeout=None):
+    import httpx
+
+    # the read timeout covers the whole generation (responses are not streamed), connecting gets its own short limit
+    return httpx.Timeout(read_timeout or OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT)
+
+class ModelEndpoint:
+    def __init__(self, host, client=None):
+        import ollama
+
+        self.host = host
+        self.client = client or ollama.Client(host=host, timeout=get_client_timeout())
+        self._timeout_clients = {}  # latency budget -> client enforcing it
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.latencies = deque(maxlen=200)
+        self.requests = 0
+        self.failures = 0
+
+    def get_client(self, timeout=None):
+        if timeout is None:
+            return self.client
+        if timeout not in self._timeout_clients:
+            import ollama
+
+            self._timeout_clients[timeout] = ollama.Client(host=self.host, timeout=get_client_timeout(timeout))
+        return self._timeout_clients[timeout]
+
+    def latency_percentile(self, percentile):
+        if len(self.latencies) < OLLAMA_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * percentile / 100), len(ordered) - 1)]
+
+    def snapshot(self):
+        return {
+            'host': self.host,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'failures': self.failures,
+            'p50_latency': self.latency_percentile(50),
+        }
+
+class EndpointPool:
+    def __init__(self, hosts=OLLAMA_HOSTS, hedge_percentile=OLLAMA_HEDGE_PERCENTILE, health_check_interval=OLLAMA_HEALTH_CHECK_INTERVAL):
+        self.endpoints = [ModelEndpoint(host) for host in hosts]
+        self.hedge_percentile = hedge_percentile
+        self.health_check_interval = health_check_interval
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        self._hedge_executor = ThreadPoolExecutor(max_workers=max(2 * len(self.endpoints), 2), thread_name_prefix='model-hedge')
+        self._health_checker = None
+
+    def start_health_checks(self):
+        with self._lock:
+            if self._health_checker is None and len(self.endpoints) > 1:
+                self._health_checker = threading.Thread(target=self._run_health_checks, name='model-health-check', daemon=True)
+                self._health_checker.start()
+
+    def _run_health_checks(self):
+        while True:
+            for endpoint in self.endpoints:
+                self.check_health(endpoint)
+            time.sleep(self.health_check_interval)
+
+    def check_health(self, endpoint):
+        try:
+            endpoint.client.list()
+            healthy = True
+        except Exception:
+            healthy = False
+        with self._lock:
+            endpoint.healthy = healthy
+            if healthy:
+                endpoint.consecutive_failures = 0
+        return healthy
+
+    def _pick(self, exclude=()):
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+            # with every endpoint marked down still try one, a request is the cheapest health check
+            healthy = [endpoint for endpoint in candidates if endpoint.healthy] or candidates
+            if not healthy:
+                return None
+            least_outstanding = min(endpoint.outstanding for endpoint in healthy)
+            endpoint = random.choice([endpoint for endpoint in healthy if endpoint.outstanding == least_outstanding])
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _call(self, endpoint, timeout=None, **kwargs):
+        # endpoint.outstanding was already taken by _pick
+        start_time = time.time()
+        try:
+            response = endpoint.get_client(timeout).generate(**kwargs)
+        except Exception:
+            with self._lock:
+                endpoint.outstanding -= 1
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= OLLAMA_MAX_CONSECUTIVE_FAILURES:
+                    endpoint.healthy = False
+            raise
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.requests += 1
+            endpoint.consecutive_failures = 0
+            endpoint.healthy = True
+            endpoint.latencies.append(time.time() - start_time)
+        return response
+
+    def _fail_over(self, endpoint, error, timeout=None, **kwargs):
+        # fail over once to another endpoint before giving up, unless the latency budget is already spent
+        fallback = None if is_timeout_error(error) else self._pick(exclude=(endpoint,))
+        if fallback is None:
+            raise error
+        return self._call(fallback, timeout, **kwargs)
+
+    def generate(self, timeout=None, **kwargs):
+        """Same arguments as ollama.generate, routed to the least-loaded healthy endpoint.
+
+        timeout (secs) aborts the request, the model server stops generating once the client disconnects."""
+        endpoint = self._pick()
+        if endpoint is None:
+            raise LLMUnavailableError("No model endpoint configured (OLLAMA_HOSTS)")
+        hedge_delay = endpoint.latency_percentile(self.hedge_percentile) if self.hedge_percentile and len(self.endpoints) > 1 else None
+        if hedge_delay is None:
+            try:
+                return self._call(endpoint, timeout, **kwargs)
+            except Exception as e:
+                return self._fail_over(endpoint, e, timeout, **kwargs)
+
+        primary = self._hedge_executor.submit(self._call, endpoint, timeout, **kwargs)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            if primary.exception() is not None:
+                return self._fail_over(endpoint, primary.exception(), timeout, **kwargs)
+            return primary.result()
+
+        hedge_endpoint = self._pick(exclude=(endpoint,))
+        if hedge_endpoint is None:
+            return primary.result()
+        with self._lock:
+            self.hedged_requests += 1
+        hedge = self._hedge_executor.submit(self._call, hedge_endpoint, timeout, **kwargs)
+
+        # first successful response wins, the slower request is left to finish in the background
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'endpoints': [endpoint.snapshot() for endpoint in self.endpoints],
+                'hedged_requests': self.hedged_requests,
+                'hedge_wins': self.hedge_wins,
+            }
+
+_endpoint_pool = None
+_endpoint_pool_lock = threading.Lock()
+
+def get_endpoint_pool() -> EndpointPool:
+    global _endpoint_pool
+    with _endpoint_pool_lock:
+        if _endpoint_pool is None:
+            _endpoint_pool = EndpointPool()
+            _endpoint_pool.start_health_checks()
+        return _endpoint_pool
@@ -0,0 +1,78 @@
+import os
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+# Routing table: each prompt type gets its own model, generation options and latency budget.
+# Models can be swapped per route without code changes, e.g. a small quantized model for the
+# cheap routes on CPU-only hosts:
+#   LLM_MODEL_MARKET_NEWS=qwen2.5:3b-instruct-q4_K_M LLM_MODEL_REPORT_TABLE=qwen2.5:3b-instruct-q4_K_M
+
+@dataclass
+class ModelRoute:
+    model: str = 'mistral'
+    num_predict: Optional[int] = None  # max tokens generated
+    temperature: Optional[float] = None
+    num_ctx: Optional[int] = None  # context window, the long prompts need more than Ollama's default
+    latency_budget: Optional[float] = None  # secs before the request is abandoned
+
+    def options(self):
+        options = {'num_predict': self.num_predict, 'temperature': self.temperature, 'num_ctx': self.num_ctx}
+        return {key: value for key, value in options.items() if value is not None}
+
+def _route(prompt_type, **defaults):
+    env_prefix = f"LLM_MODEL_{prompt_type.upper()}"
+    route = ModelRoute(**defaults)
+    route.model = os.environ.get(env_prefix, route.model)
+    if os.environ.get(f"{env_prefix}_BUDGET"):
+        route.latency_budget = float(os.environ[f"{env_prefix}_BUDGET"])
+    return route
+
+MODEL_ROUTES: Dict[str, ModelRoute] = {
+    'agg_code': _route('agg_code', temperature=0.1, num_predict=1024, num_ctx=4096, latency_budget=120),
+    'price_analysis': _route('price_analysis', temperature=0.3, num_predict=1024, num_ctx=4096, latency_budget=120),
+    'reutilisation': _route('reutilisation', temperature=0.5, num_predict=1024, latency_budget=90),
+    'market_news': _route('market_news', temperature=0.7, num_predict=256, num_ctx=4096, latency_budget=90),
+    'report_table': _route('report_table', temperature=0.2, num_predict=1024, num_ctx=4096, latency_budget=90),
+    'fleet_query': _route('fleet_query', temperature=0.0, num_predict=512, num_ctx=4096, latency_budget=60),
+}
+DEFAULT_ROUTE = _route('default')
+
+def get_model_route(prompt_type) -> ModelRoute:
+    return MODEL_ROUTES.get(prompt_type, DEFAULT_ROUTE)
+
+class RouteStats:
+    """Latency and output-quality counters per route, quality is reported by the call sites that parse the output."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: defaultdict(float))
+
+    def record_call(self, prompt_type, latency, error=False, budget_exceeded=False):
+        with self._lock:
+            stats = self._stats[prompt_type]
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['budget_exceeded'] += int(budget_exceeded)
+            if not error:
+                stats['total_latency'] += latency
+                stats['max_latency'] = max(stats['max_latency'], latency)
+
+    def record_quality(self, prompt_type, parsed_ok):
+        with self._lock:
+            self._stats[prompt_type]['parsed_ok' if parsed_ok else 'parse_failed'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {}
+            for prompt_type, stats in self._stats.items():
+                stats = dict(stats)
+                succeeded = stats.get('calls', 0) - stats.get('errors', 0)
+                stats['mean_latency'] = stats.get('total_latency', 0) / succeeded if succeeded else None
+                parsed = stats.get('parsed_ok', 0) + stats.get('parse_failed', 0)
+                stats['parse_rate'] = stats.get('parsed_ok', 0) / parsed if parsed else None
+                snapshot[prompt_type] = dict(stats, model=get_model_route(prompt_type).model)
+            return snapshot
+
+route_stats = RouteStats()
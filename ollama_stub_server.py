@@ -0,0 +1,96 @@
+"""Minimal stand-in for `ollama serve`, for exercising endpoint routing and hedging locally.
+
+    python ollama_stub_server.py --port 11435 --delay 2 --jitter 3
+    python ollama_stub_server.py --port 11436 --delay 2 --fail-rate 0.2
+    OLLAMA_HOSTS=http://127.0.0.1:11435,http://127.0.0.1:11436 streamlit run main.py
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_PRICE_REPORT = """{
+    "current_value": 145000,
+    "overall_health_score": 72.5,
+    "safety_risk_score": 35.0,
+    "value_forecast": {
+        "1_months": 143500,
+        "3_months": 140000,
+        "6_months": 135500,
+        "12_months": 127000,
+        "confidence_level": 80
+    }
+}"""
+
+STUB_REUTIL_REPORT = """```json
+[
+    {"productName": "Home Energy Storage", "description": "Backup power for homes", "capacitySpecification": 12.0,
+     "recoveryValue": 90000, "recoveryPercentage": 62.0, "implementationComplexity": "Easy",
+     "marketDemand": "High", "technicalViabilityScore": 8}
+]
+```"""
+
+def get_stub_response(prompt):
+    if 'repurposing' in prompt:
+        return STUB_REUTIL_REPORT
+    if 'headlines' in prompt:
+        return "* Fleet Battery Replacement Costs Drop to ₹5,900/kWh"
+    return STUB_PRICE_REPORT
+
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    jitter = 0.0
+    fail_rate = 0.0
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json(200, {'models': [{'name': 'mistral:latest', 'model': 'mistral:latest'}]})
+        else:
+            self._send_json(200, {'status': 'Ollama is running'})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path != '/api/generate':
+            self._send_json(404, {'error': f'unsupported path {self.path}'})
+            return
+
+        time.sleep(self.delay + random.uniform(0, self.jitter))
+        if random.random() < self.fail_rate:
+            self._send_json(500, {'error': 'stub failure'})
+            return
+
+        self._send_json(200, {
+            'model': request.get('model', 'mistral'),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'response': get_stub_response(request.get('prompt', '')),
+            'done': True,
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--delay', type=float, default=1.0, help='base secs per generation')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random secs per generation')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of generations answered with HTTP 500')
+    args = parser.parse_args()
+
+    StubHandler.delay, StubHandler.jitter, StubHandler.fail_rate = args.delay, args.jitter, args.fail_rate
+    print(f"Stub Ollama listening on http://{args.host}:{args.port}")
+    ThreadingHTTPServer((args.host, args.port), StubHandler).serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import os
+import statistics
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import llm_client
+from electra_battery_usage_market_prompt import get_price_analysis_report, get_price_values
+
+# Self-consistency pricing: several independently seeded pricing samples of the same vehicle,
+# aggregated to the median value per horizon with the sample spread as an empirical band.
+# Sampling starts with PRICE_SAMPLES_MIN concurrent samples; once they are all in and still disagree
+# by more than PRICE_SAMPLE_TOLERANCE, one more sample is priced per round, up to PRICE_SAMPLES_MAX.
+PRICE_SAMPLES_MAX = int(os.environ.get('PRICE_SAMPLES_MAX', 5))
+PRICE_SAMPLES_MIN = int(os.environ.get('PRICE_SAMPLES_MIN', 3))
+PRICE_SAMPLE_TOLERANCE = float(os.environ.get('PRICE_SAMPLE_TOLERANCE', 0.05))  # max (high - low) / median per horizon
+# fleet pricing samples every vehicle when enabled, it multiplies the model calls per vehicle by up to PRICE_SAMPLES_MAX
+PRICE_SAMPLING_FLEET = os.environ.get('PRICE_SAMPLING_FLEET', '0') == '1'
+
+SAMPLED_KEYS = ['current_value', '1_months', '3_months', '6_months', '12_months']
+
+_sample_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='price-sample')
+
+def get_sample_spread(samples):
+    # samples are price value dicts, each horizon is summarised over the samples that have it
+    spread = {}
+    for key in SAMPLED_KEYS:
+        values = [sample[key] for sample in samples if key in sample]
+        if values:
+            median = statistics.median(values)
+            spread[key] = {
+                'median': median,
+                'low': min(values),
+                'high': max(values),
+                'rel_spread': (max(values) - min(values)) / median if median else 0.0,
+            }
+    return spread
+
+def samples_agree(samples, tolerance=PRICE_SAMPLE_TOLERANCE):
+    spread = get_sample_spread(samples)
+    return bool(spread) and all(bounds['rel_spread'] <= tolerance for bounds in spread.values())
+
+def aggregate_samples(samples, converged):
+    """Median price values over the samples, same keys as get_price_values plus the spread."""
+    spread = get_sample_spread(samples)
+    price_values = {key: bounds['median'] for key, bounds in spread.items()}
+    confidence_levels = [sample['confidence_level'] for sample in samples if 'confidence_level' in sample]
+    if confidence_levels:
+        price_values['confidence_level'] = statistics.median(confidence_levels)
+    price_values.update(
+        spread=spread,
+        num_samples=len(samples),
+        max_rel_spread=max(bounds['rel_spread'] for bounds in spread.values()),
+        converged=converged,
+    )
+    return price_values
+
+def sample_price_analysis(usage_data, max_samples=PRICE_SAMPLES_MAX, min_samples=PRICE_SAMPLES_MIN, tolerance=PRICE_SAMPLE_TOLERANCE):
+    """Returns (aggregated price values, report of the sample closest to the median current value).
+
+    Both are None when no sample could be priced."""
+    min_samples = max(min(min_samples, max_samples), 1)
+    stop = threading.Event()
+    priority = llm_client.get_call_priority('price_analysis')
+
+    def sample(seed):
+        # samples run under the caller's priority, queued ones are withdrawn once the samples agree
+        with llm_client.llm_priority(priority), llm_client.cancel_on(stop):
+            report = get_price_analysis_report(usage_data, seed=seed)
+        return report, get_price_values(report)
+
+    samples = []  # (report, price values) of the samples priced so far
+    launched = 0
+    converged = False
+    try:
+        while launched < max_samples:
+            # a round is the first min_samples, then one more sample (more when earlier ones failed to price)
+            round_size = min(max(min_samples - len(samples), 1), max_samples - launched)
+            pending = {_sample_executor.submit(sample, seed) for seed in range(launched, launched + round_size)}
+            launched += round_size
+
+            # the whole round is in before the samples are compared, nothing is launched speculatively
+            while pending:
+                done, pending = wait(pending, timeout=llm_client.LLM_CHECKPOINT_INTERVAL, return_when=FIRST_COMPLETED)
+                llm_client.checkpoint()
+                for future in done:
+                    try:
+                        report, price_values = future.result()
+                    except llm_client.LLMCancelledError:
+                        continue
+                    if 'current_value' in price_values:
+                        samples.append((report, price_values))
+
+            if len(samples) >= min_samples and samples_agree([price_values for _, price_values in samples], tolerance):
+                converged = True
+                break
+    finally:
+        # withdraws the round still queued when the caller's checkpoint raised
+        stop.set()
+
+    if not samples:
+        return None, None
+    price_values = aggregate_samples([price_values for _, price_values in samples], converged)
+    report, _ = min(samples, key=lambda sample: abs(sample[1]['current_value'] - price_values['current_value']))
+    return price_values, report
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from usage_records import PriceResult
+
+# Durable per-upload journal of fleet pricing outcomes. Every priced vehicle is appended
+# (and fsynced) to <fingerprint>.prices.jsonl as soon as it completes, failed attempts go
+# to <fingerprint>.failures.jsonl, so a rerun over the same upload only prices vehicles
+# that are missing or failed.
+PRICING_JOURNAL_DIR = os.environ.get('PRICING_JOURNAL_DIR', '.pricing_journal')
+
+def _to_native(value):
+    # numpy scalars coming from the usage summary dataframe
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def get_usage_hash(usage_data):
+    # the usage summary is regenerated by LLM code after a restart, only reuse prices for identical inputs
+    return hashlib.sha256(json.dumps(dict(usage_data), sort_keys=True, default=_to_native).encode('utf-8')).hexdigest()[:16]
+
+class PricingJournal:
+    def __init__(self, upload_fingerprint, journal_dir=PRICING_JOURNAL_DIR):
+        os.makedirs(journal_dir, exist_ok=True)
+        self.prices_path = os.path.join(journal_dir, f"{upload_fingerprint}.prices.jsonl")
+        self.failures_path = os.path.join(journal_dir, f"{upload_fingerprint}.failures.jsonl")
+        self._lock = threading.Lock()
+
+    def _append(self, path, record):
+        line = json.dumps(record, default=_to_native) + '\n'
+        with self._lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record_price(self, usage_data, result):
+        self._append(self.prices_path, {
+            'vehicle_number': usage_data['vehicle_number'],
+            'usage_hash': get_usage_hash(usage_data),
+            'result': result._asdict(),
+            'recorded_at': time.time(),
+        })
+
+    def record_failure(self, usage_data, attempt, error):
+        self._append(self.failures_path, {
+            'vehicle_number': usage_data['vehicle_number'],
+            'usage_hash': get_usage_hash(usage_data),
+            'attempt': attempt,
+            'error': f"{type(error).__name__}: {error}",
+            'recorded_at': time.time(),
+        })
+
+    @staticmethod
+    def _read(path):
+        if not os.path.exists(path):
+            return []
+        records = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # a torn last line from a crash mid-write, everything before it is intact
+                    continue
+        return records
+
+    def load_prices(self):
+        """(vehicle_number, usage_hash) -> priced result for every vehicle priced so far."""
+        return {(record['vehicle_number'], record['usage_hash']): PriceResult.from_dict(record['result']) for record in self._read(self.prices_path)}
+
+    def load_failures(self):
+        """vehicle_number -> latest failed attempt, for vehicles without a later successful price."""
+        priced = {vehicle_number for vehicle_number, _ in self.load_prices()}
+        failures = {}
+        for record in self._read(self.failures_path):
+            if record['vehicle_number'] not in priced:
+                failures[record['vehicle_number']] = record
+        return failures
+
+    def get_price(self, prices, usage_data):
+        return prices.get((usage_data['vehicle_number'], get_usage_hash(usage_data)))
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import llm_client
+from battery_reutilisation_gen import generate_battery_reutil_prods_prompt, generate_reutil_prod_df
+
+# Once fleet pricing has finished, every input of the reutilisation prompt is known, so
+# recommendations are generated ahead of time in idle model time: selected vehicle first,
+# then the most valuable batteries. The prefetcher runs one generation at a time at PREFETCH
+# priority, behind fleet pricing, and never starts one while an interactive request is in flight.
+REUTIL_PREFETCH_MAX_ENTRIES = int(os.environ.get('REUTIL_PREFETCH_MAX_ENTRIES', 500))
+
+class ReutilPrefetcher:
+    def __init__(self, max_entries=REUTIL_PREFETCH_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._results = OrderedDict()  # prompt hash -> prod_df, least recently used first
+        self._pending = []  # (prompt hash, usage_data) in priority order
+        self._cond = threading.Condition()
+        self._worker = None
+
+    @staticmethod
+    def _get_key(usage_data):
+        prompt = generate_battery_reutil_prods_prompt(usage_data)
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+    def get(self, usage_data):
+        key = self._get_key(usage_data)
+        with self._cond:
+            prod_df = self._results.get(key)
+            if prod_df is not None:
+                self._results.move_to_end(key)
+            return prod_df
+
+    def get_or_generate(self, usage_data):
+        """Interactive path: serve the prefetched recommendations, or generate them now."""
+        prod_df = self.get(usage_data)
+        if prod_df is None:
+            # a prefetch of the same vehicle already in flight is joined by the llm_client coalescing
+            with llm_client.interactive():
+                prod_df = self._generate(usage_data)
+            if prod_df is not None:
+                self._store(self._get_key(usage_data), prod_df)
+        return prod_df
+
+    def prefetch(self, prices_records, selected_vehicle=None):
+        """Queue recommendations for all priced vehicles, ahead of anything queued by earlier pages."""
+        ordered = sorted(prices_records, key=lambda record: (record.get('vehicle_number') != selected_vehicle, -(record.get('current_price') or 0)))
+        queued = [(self._get_key(usage_data), usage_data) for usage_data in ordered]
+        with self._cond:
+            queued = [(key, usage_data) for key, usage_data in queued if key not in self._results]
+            queued_keys = {key for key, _ in queued}
+            self._pending = (queued + [item for item in self._pending if item[0] not in queued_keys])[:self._max_entries]
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='reutil-prefetch', daemon=True)
+                self._worker.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                key, usage_data = self._pending.pop(0)
+                if key in self._results:
+                    continue
+
+            # yield to user-facing requests, only idle model time is spent on speculation
+            llm_client.wait_for_interactive_idle()
+            with llm_client.llm_priority(llm_client.PREFETCH):
+                prod_df = self._generate(usage_data)
+            if prod_df is not None:
+                self._store(key, prod_df)
+
+    @staticmethod
+    def _generate(usage_data):
+        try:
+            return generate_reutil_prod_df(usage_data)
+        except Exception as e:
+            print(f"Error: {e}")
+
+    def _store(self, key, prod_df):
+        with self._cond:
+            self._results[key] = prod_df
+            self._results.move_to_end(key)
+            while len(self._results) > self._max_entries:
+                self._results.popitem(last=False)
+
+_reutil_prefetcher = None
+_reutil_prefetcher_lock = threading.Lock()
+
+def get_reutil_prefetcher() -> ReutilPrefetcher:
+    global _reutil_prefetcher
+    with _reutil_prefetcher_lock:
+        if _reutil_prefetcher is None:
+            _reutil_prefetcher = ReutilPrefetcher()
+        return _reutil_prefetcher
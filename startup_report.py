@@ -0,0 +1,96 @@
+"""Import-time report of the Streamlit app and the aggregation sandbox worker, against a start up budget.
+
+    python startup_report.py
+    python startup_report.py --budget 0.5 --top 15
+
+Every measurement runs in a fresh interpreter with `-X importtime`, so nothing is warm in sys.modules.
+The app is measured the way `streamlit run` executes it: streamlit itself is loaded by the server
+before the script runs and is reported but not counted against the budget. The heavy packages in
+DEFERRED_PACKAGES are only imported by the features that use them; the report fails when one of them
+is loaded at start up again.
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+
+STARTUP_BUDGET = float(os.environ.get('STARTUP_BUDGET', 1.0))  # secs of imports per cold start
+APP_SCRIPT = 'main.py'
+PRELOADED_PACKAGES = ('streamlit',)  # already imported by the server process
+# loaded on first use: charts, the model client, the SQL store, the batch-only aggregate store
+DEFERRED_PACKAGES = ('plotly', 'ollama', 'httpx', 'pydantic', 'sqlalchemy', 'IPython', 'pyarrow.dataset')
+WORKER_MODULES = ('agg_sandbox', 'pandas', 'pyarrow.feather')  # imports of the sandbox worker process
+
+APP_MARKER = '-- app imports --'
+
+def get_script_imports(path):
+    """Top-level modules imported by a script, in order."""
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+def measure_imports(modules, preloaded=()):
+    """(wall secs, {module: self secs}) of importing modules in a fresh interpreter, preloaded imported first
+    and left out of both numbers."""
+    code = '\n'.join([
+        'import sys, time',
+        *(f'import {module}' for module in preloaded),
+        f'sys.stderr.write({APP_MARKER!r} + "\\n")',
+        'start = time.perf_counter()',
+        *(f'import {module}' for module in modules),
+        'print(time.perf_counter() - start)',
+    ])
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+
+    self_secs = {}
+    lines = completed.stderr.splitlines()
+    for line in lines[lines.index(APP_MARKER) + 1:]:
+        if line.startswith('import time:') and not line.endswith('| imported package'):
+            self_us, _, name = line[len('import time:'):].split('|')
+            self_secs[name.strip()] = int(self_us) / 1e6
+    return float(completed.stdout.strip().splitlines()[-1]), self_secs
+
+def get_package_times(self_secs):
+    packages = Counter()
+    for module, secs in self_secs.items():
+        packages[module.split('.')[0]] += secs
+    return packages
+
+def print_report(title, wall_secs, self_secs, budget, top):
+    print(f"{title}: {wall_secs:.3f}s of imports (budget {budget:.2f}s)")
+    for package, secs in get_package_times(self_secs).most_common(top):
+        print(f"  {secs:8.3f}s  {package}")
+    deferred = [package for package in DEFERRED_PACKAGES if package in self_secs]
+    if deferred:
+        print(f"  loaded at start up but should be deferred: {', '.join(deferred)}")
+    return wall_secs <= budget and not deferred
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=float, default=STARTUP_BUDGET, help='secs of imports allowed per process')
+    parser.add_argument('--top', type=int, default=10, help='packages listed per process')
+    args = parser.parse_args()
+
+    app_modules = [module for module in get_script_imports(APP_SCRIPT) if module.split('.')[0] not in PRELOADED_PACKAGES]
+    started = time.perf_counter()
+    preloaded_secs, _ = measure_imports(PRELOADED_PACKAGES)
+    print(f"{', '.join(PRELOADED_PACKAGES)} (server process, not counted): {preloaded_secs:.3f}s")
+    ok = print_report(APP_SCRIPT, *measure_imports(app_modules, PRELOADED_PACKAGES), args.budget, args.top)
+    ok &= print_report('aggregation sandbox worker', *measure_imports(WORKER_MODULES), args.budget, args.top)
+    print(f"measured in {time.perf_counter() - started:.1f}s")
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import json
+import os
+import time
+
+import pandas as pd
+from sqlalchemy import (Column, Date, Float, Index, Integer, MetaData, String, Table, Text, create_engine, delete, event,
+                        func, select, tuple_)
+
+from pricing_journal import _to_native, get_usage_hash
+from telemetry_store import TELEMETRY_DB_URL, TELEMETRY_STORE_BATCH_SIZE
+from usage_records import PriceResult, compact_usage_df, get_usage_records
+
+# SQLAlchemy schema and access layer of the telemetry store, see telemetry_store for the configuration.
+metadata = MetaData()
+
+# one row per source and (vehicle, day): a day split across files or uploads keeps every part,
+# reads add the parts up
+daily_rollups = Table(
+    'daily_rollups', metadata,
+    Column('source', String(64), primary_key=True),  # sha256 of the file, uploaded or read by the batch job
+    Column('vehicle_number', String(64), primary_key=True),
+    Column('day', Date, primary_key=True),
+    Column('row_count', Integer, nullable=False),
+    Column('soh_sum', Float), Column('soh_count', Integer),
+    Column('capacity_sum', Float), Column('capacity_count', Integer),
+    Column('odo_max', Float), Column('cycle_max', Float),
+    Column('max_cell_v', Float), Column('min_cell_v', Float),
+    Column('max_cell_t', Float), Column('excursions', Integer),
+)
+# date range scans over the whole fleet, the primary key covers per-vehicle lookups
+Index('ix_daily_rollups_day_vehicle', daily_rollups.c.day, daily_rollups.c.vehicle_number)
+
+usage_summaries = Table(
+    'usage_summaries', metadata,
+    Column('upload_fingerprint', String(64), primary_key=True),
+    Column('vehicle_number', String(64), primary_key=True),
+    Column('position', Integer, nullable=False),  # row order of the upload's summary
+    Column('summary', Text, nullable=False),
+    Column('created_at', Float, nullable=False),
+)
+Index('ix_usage_summaries_vehicle', usage_summaries.c.vehicle_number)
+
+price_reports = Table(
+    'price_reports', metadata,
+    Column('vehicle_number', String(64), primary_key=True),
+    Column('usage_hash', String(16), primary_key=True),
+    Column('result', Text, nullable=False),
+    Column('created_at', Float, nullable=False),
+)
+
+def _records(df):
+    # plain Python values for the DBAPI, NaN as NULL
+    records = df.astype(object).where(df.notna(), None).to_dict('records')
+    return [{key: _to_native(value) if hasattr(value, 'item') else value for key, value in record.items()} for record in records]
+
+def _batches(items, size=TELEMETRY_STORE_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class TelemetryStore:
+    def __init__(self, url=TELEMETRY_DB_URL):
+        if url.startswith('sqlite:///'):
+            directory = os.path.dirname(url[len('sqlite:///'):])
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.engine = create_engine(url)
+        if self.engine.dialect.name == 'sqlite':
+            event.listen(self.engine, 'connect', self._configure_sqlite)
+        metadata.create_all(self.engine)
+
+    @staticmethod
+    def _configure_sqlite(dbapi_connection, connection_record):
+        # readers in other sessions are not blocked by a bulk load
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    def _replace(self, conn, table, key_columns, records):
+        # delete the keys being loaded and bulk insert, all in the caller's transaction
+        keys = list({tuple(record[column] for column in key_columns) for record in records})
+        key = tuple_(*(table.c[column] for column in key_columns))
+        for batch in _batches(keys):
+            conn.execute(delete(table).where(key.in_(batch)))
+        for batch in _batches(records):
+            conn.execute(table.insert(), batch)
+
+    def save_rollups(self, rollups, source):
+        """Stores the rollups of one source, replacing what that source stored before."""
+        records = _records(rollups.assign(source=source))
+        with self.engine.begin() as conn:
+            # days the source no longer has go as well, not only the ones being loaded
+            conn.execute(delete(daily_rollups).where(daily_rollups.c.source == source))
+            for batch in _batches(records):
+                conn.execute(daily_rollups.insert(), batch)
+        return len(records)
+
+    def get_rollups(self, vehicles=None, start=None, end=None):
+        """One rollup per (vehicle_number, day), the parts stored by different sources merged."""
+        c = daily_rollups.c
+        query = select(
+            c.vehicle_number, c.day,
+            func.sum(c.row_count).label('row_count'),
+            func.sum(c.soh_sum).label('soh_sum'), func.sum(c.soh_count).label('soh_count'),
+            func.sum(c.capacity_sum).label('capacity_sum'), func.sum(c.capacity_count).label('capacity_count'),
+            func.max(c.odo_max).label('odo_max'), func.max(c.cycle_max).label('cycle_max'),
+            func.max(c.max_cell_v).label('max_cell_v'), func.min(c.min_cell_v).label('min_cell_v'),
+            func.max(c.max_cell_t).label('max_cell_t'), func.sum(c.excursions).label('excursions'),
+        ).group_by(c.vehicle_number, c.day).order_by(c.vehicle_number, c.day)
+        query = self._filter(query, vehicles, start, end)
+        with self.engine.connect() as conn:
+            return pd.DataFrame(conn.execute(query).mappings().all())
+
+    @staticmethod
+    def _filter(query, vehicles, start, end):
+        if vehicles is not None:
+            query = query.where(daily_rollups.c.vehicle_number.in_([str(vehicle) for vehicle in vehicles]))
+        if start is not None:
+            query = query.where(daily_rollups.c.day >= pd.Timestamp(start).date())
+        if end is not None:
+            query = query.where(daily_rollups.c.day <= pd.Timestamp(end).date())
+        return query
+
+    def get_range_usage_summaries(self, start=None, end=None, vehicles=None):
+        """Usage summary per vehicle over the days start..end, aggregated in SQL from the daily rollups."""
+        c = daily_rollups.c
+        query = select(
+            c.vehicle_number,
+            (func.sum(c.soh_sum) / func.nullif(func.sum(c.soh_count), 0)).label('mean_soh'),
+            func.sum(c.excursions).label('temperature_excursions'),
+            (func.sum(c.capacity_sum) / func.nullif(func.sum(c.capacity_count), 0)).label('final_capacity'),
+            func.max(c.odo_max).label('age_of_vehicle'),
+            func.max(c.cycle_max).label('num_cycles'),
+            func.max(c.max_cell_v).label('max_voltage'),
+            func.min(c.min_cell_v).label('min_voltage'),
+        ).group_by(c.vehicle_number).order_by(c.vehicle_number)
+        with self.engine.connect() as conn:
+            vehicle_usage_df = pd.DataFrame(conn.execute(self._filter(query, vehicles, start, end)).mappings().all())
+        if vehicle_usage_df.empty:
+            return vehicle_usage_df
+        vehicle_usage_df = vehicle_usage_df.astype({column: float for column in vehicle_usage_df.columns[1:]})
+        vehicle_usage_df = vehicle_usage_df.round({'mean_soh': 2, 'final_capacity': 2, 'age_of_vehicle': 2})
+        vehicle_usage_df['temperature_excursions'] = vehicle_usage_df['temperature_excursions'].fillna(0).astype(int)
+        vehicle_usage_df['num_cycles'] = vehicle_usage_df['num_cycles'].fillna(0).astype(int)
+        return compact_usage_df(vehicle_usage_df)
+
+    def save_usage_summaries(self, upload_fingerprint, vehicle_usage_df):
+        now = time.time()
+        records = [
+            {'upload_fingerprint': upload_fingerprint, 'vehicle_number': str(summary['vehicle_number']), 'position': position,
+             'summary': json.dumps(dict(summary), default=_to_native), 'created_at': now}
+            for position, summary in enumerate(get_usage_records(vehicle_usage_df))
+        ]
+        with self.engine.begin() as conn:
+            conn.execute(delete(usage_summaries).where(usage_summaries.c.upload_fingerprint == upload_fingerprint))
+            for batch in _batches(records):
+                conn.execute(usage_summaries.insert(), batch)
+
+    def get_usage_summaries(self, upload_fingerprint):
+        """The upload's usage summary dataframe, None when it has not been stored."""
+        query = (select(usage_summaries.c.summary)
+                 .where(usage_summaries.c.upload_fingerprint == upload_fingerprint)
+                 .order_by(usage_summaries.c.position))
+        with self.engine.connect() as conn:
+            summaries = [json.loads(summary) for summary in conn.execute(query).scalars()]
+        if not summaries:
+            return None
+        return compact_usage_df(pd.DataFrame(summaries))
+
+    def save_price(self, usage_data, result):
+        record = {'vehicle_number': str(usage_data['vehicle_number']), 'usage_hash': get_usage_hash(usage_data),
+                  'result': json.dumps(result._asdict(), default=_to_native), 'created_at': time.time()}
+        with self.engine.begin() as conn:
+            self._replace(conn, price_reports, ['vehicle_number', 'usage_hash'], [record])
+
+    def get_prices(self, usage_summaries_list):
+        """{index: result} for the usage summaries that already have a stored price."""
+        keys = {(str(usage_data['vehicle_number']), get_usage_hash(usage_data)): i for i, usage_data in enumerate(usage_summaries_list)}
+        key = tuple_(price_reports.c.vehicle_number, price_reports.c.usage_hash)
+        prices = {}
+        with self.engine.connect() as conn:
+            for batch in _batches(list(keys)):
+                query = select(price_reports.c.vehicle_number, price_reports.c.usage_hash, price_reports.c.result).where(key.in_(batch))
+                for vehicle_number, usage_hash, result in conn.execute(query):
+                    prices[keys[(vehicle_number, usage_hash)]] = PriceResult.from_dict(json.loads(result))
+        return prices
@@ -0,0 +1,83 @@
+import gzip
+import os
+import zipfile
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for .zst uploads
+    zstandard = None
+
+# Telemetry CSVs may arrive plain or compressed (.zip, .gz, .zst). The decompressed bytes are streamed
+# straight into pandas' chunked parser: the expanded CSV is never written to disk or held in memory as
+# text. Parsed chunks are kept (or filtered first) and concatenated, so a full read peaks at about twice
+# the final frame; readers that only want some rows pass a row filter and never hold the rest.
+TELEMETRY_READ_CHUNK_ROWS = int(os.environ.get('TELEMETRY_READ_CHUNK_ROWS', 100000))
+TELEMETRY_FILE_TYPES = ['csv', 'zip', 'gz', 'zst']  # uploader extensions
+
+# format by leading magic bytes, the file name is only a fallback for unseekable streams
+MAGIC_BYTES = {b'PK\x03\x04': 'zip', b'\x1f\x8b': 'gz', b'\x28\xb5\x2f\xfd': 'zst'}
+
+def detect_compression(source, name=None):
+    if hasattr(source, 'seekable') and source.seekable():
+        position = source.tell()
+        head = source.read(4)
+        source.seek(position)
+        for magic, compression in MAGIC_BYTES.items():
+            if head.startswith(magic):
+                return compression
+        return None
+    extension = os.path.splitext(name or '')[1].lstrip('.').lower()
+    return extension if extension in MAGIC_BYTES.values() else None
+
+@contextmanager
+def open_telemetry_stream(source, name=None):
+    """Binary stream of the decompressed CSV of a path or file object (an upload)."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            with open_telemetry_stream(f, name or os.fspath(source)) as stream:
+                yield stream
+        return
+
+    if hasattr(source, 'seekable') and source.seekable():
+        source.seek(0)  # a cached upload may have been read before
+    compression = detect_compression(source, name or getattr(source, 'name', None))
+    if compression == 'zip':
+        with zipfile.ZipFile(source) as archive:
+            members = [member for member in archive.namelist() if member.lower().endswith('.csv') and not member.startswith('__MACOSX/')]
+            if not members:
+                raise ValueError("The zip archive has no CSV file")
+            with archive.open(members[0]) as stream:
+                yield stream
+    elif compression == 'gz':
+        with gzip.GzipFile(fileobj=source) as stream:
+            yield stream
+    elif compression == 'zst':
+        if zstandard is None:
+            raise ValueError("Reading .zst telemetry needs the zstandard package (pip install zstandard)")
+        with zstandard.ZstdDecompressor().stream_reader(source, closefd=False) as stream:
+            yield stream
+    else:
+        yield source
+
+def iter_telemetry_chunks(source, name=None, chunk_rows=TELEMETRY_READ_CHUNK_ROWS):
+    """DataFrames of up to chunk_rows rows, parsed while the file is being decompressed."""
+    with open_telemetry_stream(source, name) as stream:
+        with pd.read_csv(stream, chunksize=chunk_rows, low_memory=False) as reader:
+            yield from reader
+
+def read_telemetry_csv(source, name=None, chunk_rows=TELEMETRY_READ_CHUNK_ROWS, row_filter=None):
+    """The telemetry file as one DataFrame, ValueError when it has no rows.
+
+    row_filter(chunk) returns a boolean mask of the rows to keep, applied to each chunk as it is parsed.
+    Chunk indexes continue across chunks, they are the row positions in the file."""
+    try:
+        chunks = (chunk[row_filter(chunk)] if row_filter is not None else chunk for chunk in iter_telemetry_chunks(source, name, chunk_rows))
+        chunks = [chunk for chunk in chunks if len(chunk)]
+    except pd.errors.EmptyDataError:
+        chunks = []
+    if not chunks:
+        raise ValueError("empty telemetry file")
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
@@ -0,0 +1,69 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from thermal_episodes import EXCURSION_THRESHOLD
+from trip_buckets import get_trip_days
+
+# Optional SQL store shared by app sessions and the batch job: daily rollups of the raw telemetry,
+# usage summaries per upload and price reports per usage summary. SQLite by default, any SQLAlchemy
+# URL works. Disabled unless TELEMETRY_STORE=1. The schema and the TelemetryStore class live in
+# telemetry_db and are only imported once the store is enabled and first used.
+TELEMETRY_STORE_ENABLED = os.environ.get('TELEMETRY_STORE', '0') == '1'
+TELEMETRY_DB_URL = os.environ.get('TELEMETRY_DB_URL', 'sqlite:///.telemetry_store/telemetry.db')
+TELEMETRY_STORE_BATCH_SIZE = 500  # rows per executemany / keys per IN clause
+
+def get_file_fingerprint(path, block_size=1 << 20):
+    """sha256 of a telemetry file read in blocks, the same value as the app's upload fingerprint of its bytes."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_daily_rollups(df):
+    """One row of additive and extreme values per (vehicle_number, day) of raw telemetry."""
+    vehicle_column = 'Topic' if 'Topic' in df.columns else 'vehicle_number'
+    time_column = 'createdAt' if 'createdAt' in df.columns else 'deviceTime'
+
+    def column(name):
+        return pd.to_numeric(df[name], errors='coerce') if name in df.columns else pd.Series(np.nan, index=df.index)
+
+    soh, capacity, max_cell_t = column('SOH'), column('ADP_AMPHR'), column('MAX_CELL_T')
+    values = pd.DataFrame({
+        'vehicle_number': df[vehicle_column].astype(str),
+        'day': get_trip_days(df[time_column]),
+        'soh': soh, 'soh_present': soh.notna(),
+        'capacity': capacity, 'capacity_present': capacity.notna(),
+        'odo': column('ODO'), 'cycle': column('CYCLE'),
+        'max_cell_v': column('MAX_CELL_V'), 'min_cell_v': column('MIN_CELL_V'),
+        'max_cell_t': max_cell_t, 'excursion': max_cell_t > EXCURSION_THRESHOLD,
+    }).dropna(subset=['day'])
+    rollups = values.groupby(['vehicle_number', 'day'], sort=False).agg(
+        row_count=('soh', 'size'),
+        soh_sum=('soh', 'sum'), soh_count=('soh_present', 'sum'),
+        capacity_sum=('capacity', 'sum'), capacity_count=('capacity_present', 'sum'),
+        odo_max=('odo', 'max'), cycle_max=('cycle', 'max'),
+        max_cell_v=('max_cell_v', 'max'), min_cell_v=('min_cell_v', 'min'),
+        max_cell_t=('max_cell_t', 'max'), excursions=('excursion', 'sum'),
+    ).reset_index()
+    rollups['day'] = pd.to_datetime(rollups['day']).dt.date
+    return rollups
+
+_telemetry_store = None
+_telemetry_store_lock = threading.Lock()
+
+def get_telemetry_store():
+    """The process-wide store, None when the SQL store is disabled."""
+    global _telemetry_store
+    if not TELEMETRY_STORE_ENABLED:
+        return None
+    with _telemetry_store_lock:
+        if _telemetry_store is None:
+            from telemetry_db import TelemetryStore
+
+            _telemetry_store = TelemetryStore()
+        return _telemetry_store
@@ -0,0 +1,145 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from cell_analytics import merge_summary_features
+
+# Temperature excursion episodes: runs of consecutive MAX_CELL_T readings above the threshold,
+# per vehicle over time-sorted telemetry. Unlike a count of hot rows this does not depend on
+# the sampling rate. A gap longer than EXCURSION_MAX_GAP between readings ends an episode, and a
+# hot reading lasts until the next reading of the same vehicle.
+EXCURSION_THRESHOLD = 40.0  # degC, same threshold as temperature_excursions
+EXCURSION_MAX_GAP = pd.Timedelta(os.environ.get('EXCURSION_MAX_GAP', '10min'))
+
+def find_episodes(vehicle_codes, times, temps, threshold, max_gap):
+    """Episodes of rows sorted by (vehicle, time), as arrays of (first row, vehicle code, duration ns, peak temp, open).
+
+    An episode is open when it runs up to the last row of its vehicle, the next chunk may continue it."""
+    hot = temps > threshold
+    same_vehicle_next = np.r_[vehicle_codes[1:] == vehicle_codes[:-1], False]
+    gap_next = np.r_[np.diff(times), 0]
+    linked_next = same_vehicle_next & (gap_next <= max_gap)
+    starts = hot & ~np.r_[False, linked_next[:-1] & hot[:-1]]
+
+    hot_rows = np.flatnonzero(hot)
+    if not len(hot_rows):
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty, np.array([], dtype=np.float64), np.array([], dtype=bool)
+    episode_of_hot = np.cumsum(starts)[hot_rows] - 1
+    first_of_episode = np.r_[0, np.flatnonzero(np.diff(episode_of_hot)) + 1]
+    last_of_episode = np.r_[first_of_episode[1:] - 1, len(hot_rows) - 1]
+
+    durations = np.bincount(episode_of_hot, weights=np.where(linked_next, gap_next, 0)[hot_rows]).astype(np.int64)
+    peaks = np.maximum.reduceat(temps[hot_rows], first_of_episode)
+    first_rows = hot_rows[first_of_episode]
+    is_open = ~same_vehicle_next[hot_rows[last_of_episode]]
+    return first_rows, vehicle_codes[first_rows], durations, peaks, is_open
+
+class ExcursionEpisodeTracker:
+    """Episode statistics per vehicle, fed with time-ordered telemetry chunks (one chunk for a whole upload).
+
+    Each vehicle's last reading and its open episode are carried into the next chunk, so an episode
+    spanning a chunk boundary is counted once with its full duration."""
+
+    def __init__(self, threshold=EXCURSION_THRESHOLD, max_gap=EXCURSION_MAX_GAP, temp_column='MAX_CELL_T'):
+        self.threshold = threshold
+        self.max_gap = max_gap.value
+        self.temp_column = temp_column
+        self._state = pd.DataFrame(
+            {
+                'last_time': pd.Series(dtype=np.int64), 'last_temp': pd.Series(dtype=np.float64),
+                'episodes': pd.Series(dtype=np.int64), 'total_ns': pd.Series(dtype=np.int64),
+                'max_ns': pd.Series(dtype=np.int64), 'peak': pd.Series(dtype=np.float64),
+                'open_ns': pd.Series(dtype=np.int64), 'open_peak': pd.Series(dtype=np.float64),
+            }
+        )
+
+    def update(self, chunk):
+        vehicle_column = 'Topic' if 'Topic' in chunk.columns else 'vehicle_number'
+        time_column = 'deviceTime' if 'deviceTime' in chunk.columns else 'createdAt'
+        chunk = chunk[[vehicle_column, time_column, self.temp_column]].dropna()
+        if chunk.empty:
+            return self
+
+        # each vehicle's last reading from the previous chunks goes in front of its new readings
+        chunk_vehicles = chunk[vehicle_column].to_numpy()
+        carried = self._state[self._state.index.isin(pd.unique(chunk_vehicles))]
+        vehicles = np.r_[carried.index.to_numpy(dtype=object), chunk_vehicles.astype(object)]
+        chunk_times = pd.to_datetime(chunk[time_column], utc=True).dt.tz_localize(None).to_numpy('datetime64[ns]').astype(np.int64)
+        times = np.r_[carried['last_time'].to_numpy(np.int64), chunk_times]
+        temps = np.r_[carried['last_temp'].to_numpy(np.float64), chunk[self.temp_column].to_numpy(np.float64)]
+        is_carried = np.r_[np.ones(len(carried), dtype=bool), np.zeros(len(chunk), dtype=bool)]
+
+        codes, vehicle_index = pd.factorize(vehicles)
+        order = np.lexsort((~is_carried, times, codes))
+        codes, times, temps, is_carried = codes[order], times[order], temps[order], is_carried[order]
+
+        first_rows, episode_vehicles, durations, peaks, is_open = find_episodes(codes, times, temps, self.threshold, self.max_gap)
+        n_vehicles = len(vehicle_index)
+        state = self._state.reindex(vehicle_index)
+        open_ns = state['open_ns'].fillna(0).to_numpy(np.int64)
+        open_peak = state['open_peak'].to_numpy(np.float64)
+
+        # an episode starting on a carried reading continues the vehicle's open episode, already counted
+        continued = is_carried[first_rows]
+        full_durations = durations + np.where(continued, open_ns[episode_vehicles], 0)
+        full_peaks = np.where(continued, np.fmax(peaks, open_peak[episode_vehicles]), peaks)
+
+        max_ns = state['max_ns'].fillna(0).to_numpy(np.int64)
+        np.maximum.at(max_ns, episode_vehicles, full_durations)
+        peak = state['peak'].to_numpy(np.float64)
+        np.fmax.at(peak, episode_vehicles, full_peaks)
+
+        last_rows = np.r_[np.flatnonzero(np.diff(codes)), len(codes) - 1]
+        new_open_ns = np.zeros(n_vehicles, dtype=np.int64)
+        new_open_peak = np.full(n_vehicles, np.nan)
+        new_open_ns[episode_vehicles[is_open]] = full_durations[is_open]
+        new_open_peak[episode_vehicles[is_open]] = full_peaks[is_open]
+
+        updated = pd.DataFrame({
+            'last_time': times[last_rows],
+            'last_temp': temps[last_rows],
+            'episodes': state['episodes'].fillna(0).to_numpy(np.int64) + np.bincount(episode_vehicles[~continued], minlength=n_vehicles),
+            'total_ns': state['total_ns'].fillna(0).to_numpy(np.int64) + np.bincount(episode_vehicles, weights=durations, minlength=n_vehicles).astype(np.int64),
+            'max_ns': max_ns,
+            'peak': peak,
+            'open_ns': new_open_ns,
+            'open_peak': new_open_peak,
+        }, index=vehicle_index)
+        self._state = pd.concat([self._state[~self._state.index.isin(vehicle_index)], updated])
+        return self
+
+    def result(self):
+        """Per-vehicle episode statistics indexed by vehicle number, open episodes included."""
+        minutes = pd.Timedelta(minutes=1).value
+        return pd.DataFrame({
+            'excursion_episodes': self._state['episodes'].astype(int),
+            'excursion_total_minutes': (self._state['total_ns'] / minutes).round(1),
+            'excursion_max_minutes': (self._state['max_ns'] / minutes).round(1),
+            'excursion_peak_temp': self._state['peak'],
+        }).rename_axis('vehicle_number')
+
+def get_excursion_episodes(df, threshold=EXCURSION_THRESHOLD, max_gap=EXCURSION_MAX_GAP):
+    return ExcursionEpisodeTracker(threshold, max_gap).update(df).result()
+
+def add_excursion_episodes(vehicle_usage_df, df):
+    """Adds the episode statistics as columns, for the pricing prompt."""
+    if 'MAX_CELL_T' not in df.columns:
+        return vehicle_usage_df
+    episodes = get_excursion_episodes(df)
+    # vehicles without a temperature reading have had no excursion
+    episodes = episodes.reindex(pd.unique(df['Topic' if 'Topic' in df.columns else 'vehicle_number'])).fillna({
+        'excursion_episodes': 0, 'excursion_total_minutes': 0.0, 'excursion_max_minutes': 0.0
+    })
+    return merge_summary_features(vehicle_usage_df, episodes)
+
+def format_excursion_episodes(usage_data):
+    """Episode line of the pricing prompt's usage history, empty when the summary has no episode statistics."""
+    if usage_data.get('excursion_episodes') is None:
+        return ''
+    line = f"\n        - Temperature Excursion Episodes (above {EXCURSION_THRESHOLD:.0f}°C): {int(usage_data['excursion_episodes'])}"
+    if usage_data['excursion_episodes']:
+        line += (f" (total {usage_data['excursion_total_minutes']:.0f} min, longest {usage_data['excursion_max_minutes']:.0f} min,"
+                 f" peak {usage_data['excursion_peak_temp']:.1f}°C)")
+    return line
@@ -0,0 +1,16 @@
+import pandas as pd
+
+# Day / hour / minute buckets of telemetry timestamps, shared by the batch aggregation and the app.
+# Kept free of module level side effects (aggr_ecozen_data sets pandas options for its batch run).
+
+def get_trip_days(times):
+    """trip_day bucket of each timestamp as datetime64[D], NaT where the timestamp does not parse."""
+    return pd.to_datetime(times, utc=True, errors='coerce').dt.tz_localize(None).dt.floor('D').to_numpy('datetime64[D]')
+
+def add_trip_buckets(df, time_column='createdAt'):
+    #extract day, hour, minute buckets of every row
+    times = pd.to_datetime(df[time_column])
+    df['trip_day'] = times.dt.date
+    df['trip_hour'] = times.dt.hour
+    df['trip_min'] = times.dt.minute
+    return df
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+from thermal_episodes import EXCURSION_THRESHOLD
+from trip_buckets import get_trip_days
+from usage_records import get_usage_records
+
+# Usage summaries over arbitrary date ranges. The upload is reduced once to one row of aggregates per
+# (vehicle, trip_day), sorted by vehicle then day. Additive aggregates keep prefix sums and the extrema
+# keep sparse tables, so a date range costs two binary searches and O(1) lookups per vehicle.
+
+def _sparse_table(values, reduce, levels):
+    # table[k][i] reduces values[i : i + 2**k]
+    table = [values]
+    for k in range(1, levels):
+        previous, half = table[-1], 1 << (k - 1)
+        table.append(reduce(previous[:-half], previous[half:]) if len(previous) > half else previous[:0])
+    return table
+
+def _range_reduce(table, reduce, lo, hi):
+    """reduce over values[lo:hi] for arrays of ranges, NaN for empty ranges."""
+    lengths = hi - lo
+    result = np.full(len(lo), np.nan)
+    nonempty = lengths > 0
+    lo, hi, lengths = lo[nonempty], hi[nonempty], lengths[nonempty]
+    levels = np.floor(np.log2(lengths)).astype(int)
+    reduced = np.empty(len(lo))
+    for k in np.unique(levels):
+        at_level = levels == k
+        reduced[at_level] = reduce(table[k][lo[at_level]], table[k][hi[at_level] - (1 << k)])
+    result[nonempty] = reduced
+    return result
+
+class UsageWindowIndex:
+    """Per-vehicle daily aggregates of an upload, answering usage summaries for any date range."""
+
+    def __init__(self, df):
+        vehicle_column = 'Topic' if 'Topic' in df.columns else 'vehicle_number'
+        time_column = 'createdAt' if 'createdAt' in df.columns else 'deviceTime'
+        trip_days = get_trip_days(df[time_column])
+        has_day = ~np.isnat(trip_days)
+        days = trip_days[has_day].astype(np.int64)
+        vehicle_codes, vehicles = pd.factorize(df[vehicle_column].to_numpy()[has_day])
+        self.vehicles = pd.Index(vehicles)
+
+        self.first_day = int(days.min()) if len(days) else 0
+        self.span = int(days.max()) - self.first_day + 1 if len(days) else 1
+        # one group per (vehicle, day), numbered in vehicle then day order
+        self.keys, group = np.unique(vehicle_codes.astype(np.int64) * self.span + (days - self.first_day), return_inverse=True)
+        group = group.ravel()
+        order = np.argsort(group, kind='stable')
+        group_starts = np.r_[0, np.flatnonzero(np.diff(group[order])) + 1] if len(group) else np.array([], dtype=np.int64)
+        n_groups = len(self.keys)
+
+        def column(name):
+            if name not in df.columns:
+                return np.full(len(days), np.nan)
+            return pd.to_numeric(df[name], errors='coerce').to_numpy(np.float64)[has_day]
+
+        def prefix(weights):
+            return np.r_[0.0, np.cumsum(np.bincount(group, weights=weights, minlength=n_groups))]
+
+        def daily(name, reduce):
+            return reduce.reduceat(column(name)[order], group_starts) if n_groups else np.array([])
+
+        soh, capacity = column('SOH'), column('ADP_AMPHR')
+        self.soh_sum, self.soh_count = prefix(np.nan_to_num(soh)), prefix(~np.isnan(soh))
+        self.capacity_sum, self.capacity_count = prefix(np.nan_to_num(capacity)), prefix(~np.isnan(capacity))
+        self.excursions = prefix(column('MAX_CELL_T') > EXCURSION_THRESHOLD)
+
+        # a range never spans vehicles, so the tables only need levels up to the longest vehicle history
+        days_per_vehicle = np.bincount(self.keys // self.span) if n_groups else np.array([1])
+        levels = int(np.log2(max(days_per_vehicle.max(), 1))) + 1
+        self.extrema = {
+            'age_of_vehicle': (np.fmax, _sparse_table(daily('ODO', np.fmax), np.fmax, levels)),
+            'num_cycles': (np.fmax, _sparse_table(daily('CYCLE', np.fmax), np.fmax, levels)),
+            'max_voltage': (np.fmax, _sparse_table(daily('MAX_CELL_V', np.fmax), np.fmax, levels)),
+            'min_voltage': (np.fmin, _sparse_table(daily('MIN_CELL_V', np.fmin), np.fmin, levels)),
+        }
+
+    def get_day_range(self):
+        """First and last trip_day of the upload, as dates."""
+        first = np.datetime64(self.first_day, 'D')
+        return pd.Timestamp(first).date(), pd.Timestamp(first + self.span - 1).date()
+
+    def _day_offset(self, day, default, lowest, highest):
+        # clamped so that the range keys never reach into the neighbouring vehicles
+        if day is None:
+            return default
+        offset = int(np.datetime64(pd.Timestamp(day).date(), 'D').astype(np.int64)) - self.first_day
+        return min(max(offset, lowest), highest)
+
+    def summaries(self, start=None, end=None, vehicles=None):
+        """Usage summary per vehicle over the trip days start..end (inclusive, None for open ended), with the
+        columns of the full-upload summary. Vehicles without telemetry in the range are left out."""
+        vehicles = self.vehicles if vehicles is None else pd.Index(vehicles)
+        codes = self.vehicles.get_indexer(vehicles)
+        vehicles, codes = vehicles[codes >= 0], codes[codes >= 0].astype(np.int64)
+        lo = np.searchsorted(self.keys, codes * self.span + self._day_offset(start, 0, 0, self.span), side='left')
+        hi = np.searchsorted(self.keys, codes * self.span + self._day_offset(end, self.span - 1, -1, self.span - 1), side='right')
+        lo, hi = np.minimum(lo, hi), hi
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_soh = (self.soh_sum[hi] - self.soh_sum[lo]) / (self.soh_count[hi] - self.soh_count[lo])
+            final_capacity = (self.capacity_sum[hi] - self.capacity_sum[lo]) / (self.capacity_count[hi] - self.capacity_count[lo])
+        extrema = {name: _range_reduce(table, reduce, lo, hi) for name, (reduce, table) in self.extrema.items()}
+
+        vehicle_usage_df = pd.DataFrame({
+            'vehicle_number': vehicles,
+            'mean_soh': np.round(mean_soh, 2),
+            'temperature_excursions': (self.excursions[hi] - self.excursions[lo]).astype(int),
+            'final_capacity': np.round(final_capacity, 2),
+            'age_of_vehicle': np.round(extrema['age_of_vehicle'], 2),
+            'num_cycles': np.nan_to_num(extrema['num_cycles']).astype(int),
+            'max_voltage': extrema['max_voltage'],
+            'min_voltage': extrema['min_voltage'],
+        })[hi > lo].reset_index(drop=True)
+        return vehicle_usage_df
+
+    def summary(self, vehicle, start=None, end=None):
+        """Usage record of one vehicle over start..end, None when it has no telemetry in the range."""
+        vehicle_usage_df = self.summaries(start, end, vehicles=[vehicle])
+        return get_usage_records(vehicle_usage_df)[0] if len(vehicle_usage_df) else None
@@ -0,0 +1,98 @@
+from collections.abc import Mapping, Sequence
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# Usage summaries live only as typed dataframe columns. Prompt formatting, hashing and pricing read a
+# vehicle through a UsageRecord, a two-slot view onto the column arrays made on access, so the fleet
+# holds no per-vehicle dicts. Price results are NamedTuples, a fixed layout without a per-row __dict__.
+SUMMARY_DTYPES = {
+    'mean_soh': 'float64',
+    'temperature_excursions': 'int32',
+    'final_capacity': 'float64',
+    'age_of_vehicle': 'float64',
+    'num_cycles': 'int32',
+    'max_voltage': 'float64',
+    'min_voltage': 'float64',
+    'excursion_episodes': 'int32',
+}
+
+def compact_usage_df(vehicle_usage_df):
+    """The summary without the per-vehicle dict column (which the generated code still builds), with
+    narrow integer columns and string vehicle numbers as a categorical."""
+    vehicle_usage_df = vehicle_usage_df.drop(columns='vehicle_summary', errors='ignore')
+    dtypes = {column: dtype for column, dtype in SUMMARY_DTYPES.items() if column in vehicle_usage_df.columns}
+    for column, dtype in dtypes.items():
+        values = pd.to_numeric(vehicle_usage_df[column], errors='coerce')
+        if dtype.startswith('int') and values.isna().any():
+            continue  # keep the float column, integer columns cannot hold missing values
+        vehicle_usage_df[column] = values.astype(dtype)
+    if not pd.api.types.is_numeric_dtype(vehicle_usage_df['vehicle_number']):
+        vehicle_usage_df['vehicle_number'] = vehicle_usage_df['vehicle_number'].astype('category')
+    return vehicle_usage_df.reset_index(drop=True)
+
+def _to_python(value):
+    # numpy scalars as Python values, missing values as None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value
+
+class UsageRecord(Mapping):
+    """Read-only mapping view of one vehicle's summary row."""
+    __slots__ = ('_records', '_row')
+
+    def __init__(self, records, row):
+        self._records = records
+        self._row = row
+
+    def __getitem__(self, key):
+        return _to_python(self._records.columns[key][self._row])
+
+    def __iter__(self):
+        return iter(self._records.columns)
+
+    def __len__(self):
+        return len(self._records.columns)
+
+    def __repr__(self):
+        return f"UsageRecord({dict(self)!r})"
+
+class UsageRecords(Sequence):
+    """The summary rows of a usage dataframe as UsageRecord views, sharing the dataframe's column arrays."""
+
+    def __init__(self, vehicle_usage_df):
+        columns = [column for column in vehicle_usage_df.columns if column != 'vehicle_summary']
+        self.columns = {column: vehicle_usage_df[column].to_numpy() for column in columns}
+        self._length = len(vehicle_usage_df)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(self._length))]
+        if not -self._length <= row < self._length:
+            raise IndexError(row)
+        return UsageRecord(self, row % self._length)
+
+    def __len__(self):
+        return self._length
+
+def get_usage_records(vehicle_usage_df):
+    return UsageRecords(vehicle_usage_df)
+
+class PriceResult(NamedTuple):
+    vehicle_number: str
+    mean_soh: float
+    temperature_excursions: int
+    final_capacity: float
+    age_of_vehicle: float
+    num_cycles: int
+    max_voltage: float
+    min_voltage: float
+    current_price: float
+
+    @classmethod
+    def from_dict(cls, result):
+        # journal and store entries are plain JSON objects
+        return cls(**{field: result.get(field) for field in cls._fields})